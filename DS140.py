@@ -0,0 +1,181 @@
+"""
+DS140.py
+
+Read access from Python to the CSV files written by Mazama_USGS_DS140_2011.py:
+
+  import DS140
+  tin = DS140.load_mineral('tin')
+  tin.column('world_production')
+  world = DS140.load_variable('world_production', minerals=['tin','zinc'], years=range(1990,2011))
+  DS140.list_variables()
+  cube = DS140.load_cube('supply', prefix='DS140_cube')
+
+Tables are kept in an in-process LRU cache bounded by the memory used by
+their data.  Every lookup checks the size and modification time of the CSV
+file; if they have changed the file is hashed and only re-read when its
+content has actually changed.
+
+Cubes written with the --cube option of Mazama_USGS_DS140_2011.py are
+opened as read-only memory maps, so slicing them reads only the pages used.
+"""
+
+import os, json, threading
+import collections
+import numpy as np
+
+from Mazama_USGS_DS140_2011 import MINERALS, USE_MINERALS, read_csv, file_sha1
+
+
+########################################
+# Table
+#
+# The contents of one converted CSV file.  'data' is a float64 matrix with
+# one row per year and one column per name; the years are in column 0 and
+# missing values are NaN.
+
+class Table(object):
+
+    def __init__(self, mineral, kind, titles, names, data):
+        self.mineral = mineral
+        self.kind = kind
+        self.titles = titles
+        self.names = names
+        self.data = data
+        self.years = data[:,0].astype(int)
+
+    def __repr__(self):
+        return "<Table %s (%s): %d years x %d variables>" % (self.mineral, self.kind, len(self.years), len(self.names)-1)
+
+    @property
+    def variables(self):
+        return self.names[1:]
+
+    def column(self, name):
+        return self.data[:,self.names.index(name)]
+
+    # Returns a new Table with only the rows for 'years'
+    def select(self, years):
+        rows = np.in1d(self.years, list(years))
+        return Table(self.mineral, self.kind, self.titles, self.names, self.data[rows])
+
+Variable = collections.namedtuple('Variable', 'name minerals years values')
+
+# 'values' has the shape (minerals, years, variables) with NaN for missing data
+Cube = collections.namedtuple('Cube', 'kind minerals years variables values')
+
+
+########################################
+# TableCache
+#
+# Least recently used cache of Tables keyed by CSV path.  Entries are
+# evicted once the data of all cached Tables exceeds 'max_bytes'.
+
+class TableCache(object):
+
+    def __init__(self, max_bytes=64*1024*1024):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+    def get(self, path, load):
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        with self.lock:
+            entry = self.entries.pop(path, None)
+            if entry is not None:
+                self.nbytes -= entry[1].data.nbytes
+        if entry is not None:
+            (size, mtime, sha1), table = entry
+            if (size, mtime) != (stat.st_size, stat.st_mtime):
+                # The file has been rewritten; only re-read it if the content changed
+                new_sha1 = file_sha1(path)
+                if new_sha1 != sha1:
+                    entry = None
+                else:
+                    entry = ((stat.st_size, stat.st_mtime, sha1), table)
+        if entry is None:
+            table = load(path)
+            entry = ((stat.st_size, stat.st_mtime, file_sha1(path)), table)
+        with self.lock:
+            # Another thread may have put the same path back in the meantime
+            old = self.entries.pop(path, None)
+            if old is not None:
+                self.nbytes -= old[1].data.nbytes
+            # Put the entry back as the most recently used and evict the oldest
+            self.entries[path] = entry
+            self.nbytes += entry[1].data.nbytes
+            while self.nbytes > self.max_bytes and len(self.entries) > 1:
+                old_path, (signature, old_table) = self.entries.popitem(last=False)
+                self.nbytes -= old_table.data.nbytes
+        return entry[1]
+
+cache = TableCache()
+
+
+########################################
+# Public API
+
+def csv_path(mineral, kind='supply', directory='.'):
+    if kind == 'end_use':
+        return os.path.join(directory, mineral + '-use.csv')
+    return os.path.join(directory, mineral + '.csv')
+
+# Minerals with a CSV file of 'kind' in 'directory'
+def list_minerals(kind='supply', directory='.'):
+    if kind == 'end_use':
+        minerals = [mineral[:-len('-use')] for mineral in USE_MINERALS]
+    else:
+        minerals = list(MINERALS)
+    return [mineral for mineral in minerals if os.path.exists(csv_path(mineral, kind, directory))]
+
+def load_mineral(mineral, kind='supply', years=None, directory='.'):
+    def load(path):
+        titles, names, data = read_csv(path)
+        return Table(mineral, kind, titles, names, data)
+    table = cache.get(csv_path(mineral, kind, directory), load)
+    if years is not None:
+        table = table.select(years)
+    return table
+
+# Sorted list of all variable names of 'kind' tables for 'minerals' (default all)
+def list_variables(minerals=None, kind='supply', directory='.'):
+    if minerals is None:
+        minerals = list_minerals(kind, directory)
+    variables = set()
+    for mineral in minerals:
+        variables.update(load_mineral(mineral, kind, directory=directory).variables)
+    return sorted(variables)
+
+# Returns a Variable with a matrix of values for each mineral (rows) and year
+# (columns).  Minerals that don't have the variable are left out.
+def load_variable(name, minerals=None, years=None, kind='supply', directory='.'):
+    if minerals is None:
+        minerals = list_minerals(kind, directory)
+    tables = []
+    for mineral in minerals:
+        table = load_mineral(mineral, kind, years, directory)
+        if name in table.names:
+            tables.append(table)
+
+    all_years = sorted(set().union(*[table.years for table in tables])) if tables else []
+    values = np.empty((len(tables), len(all_years)), dtype=np.float64)
+    values.fill(np.nan)
+    for row, table in enumerate(tables):
+        values[row, np.searchsorted(all_years, table.years)] = table.column(name)
+
+    return Variable(name, [table.mineral for table in tables], np.array(all_years, dtype=int), values)
+
+# Opens the cube of 'kind' tables written to 'prefix_kind.npy' and its index
+def load_cube(kind='supply', prefix='DS140_cube', directory='.'):
+    path = os.path.join(directory, '%s_%s' % (prefix, kind))
+    with open(path + '.json') as f:
+        index = json.load(f)
+    values = np.load(path + '.npy', mmap_mode='r')
+    years = np.arange(index['years'][0], index['years'][1] + 1) if index['years'] else np.array([], dtype=int)
+    return Cube(kind, index['minerals'], years, index['variables'], values)
@@ -11,46 +11,703 @@ The xlrd module (0.6.0a1 or higher) for reading Excel files  must
 be installed before this script can be run.  It is available at:
 
   http://www.lexicon.net/sjmachin/xlrd.htm
+
+The numpy module is used to clean the worksheet data.  The pyarrow
+module is only needed to write the consolidated Parquet/Feather store and
+the openpyxl module is only needed to read workbooks in the .xlsx format.
 """
 
 import xlrd
-import sys, re
+import numpy as np
+import sys, os, re
+import multiprocessing, optparse
+import hashlib, json, tempfile, time
+import csv, datetime, glob, io, posixpath, shutil, StringIO
+import tarfile, zipfile
+
+try:
+    import resource
+except ImportError:
+    resource = None                           # not available on Windows
+
+# Version of the conversion rules in convert_file() and convert_use_file().
+# Bump this whenever a change to either function changes the CSV output so
+# that an incremental run reconverts every workbook.
+CONVERSION_VERSION = 1
+
+# DS140 release converted by default.  Each release (vintage) is published
+# under its own URL and its tables are padded with missing values up to
+# nine years past the vintage.
+VINTAGE = 2011
+
+def padding_end(vintage):
+    return vintage + 9
+
+# Text found in the data cells of 'mineral.xls' and 'mineral-use.xls' files.
+# Each stripped text value maps to a tuple (value, report) where value is the
+# float to use or None for a missing value (written as "na") and report says
+# whether the substitution is printed.  Any other text is converted with float().
+SENTINELS = {
+    '':   (None, False),                      # non-empty cells with a blank space in them
+    'NA': (None, False),
+    'W':  (None, True),                       # 'Withheld' values
+}
+
+USE_SENTINELS = {
+    '':   (None, False),
+    'NA': (None, True),                       # strontium.xls (and others) use 'NA' instead of XL_CELL_EMPTY
+    'W':  (None, True),
+}
+
+
+# Whether xlrd reads workbooks through a memory map (set by main())
+use_mmap = xlrd.USE_MMAP
+
+# First bytes of an .xlsx file (a zip archive).  Legacy .xls files are OLE2
+# compound documents starting with '\xd0\xcf\x11\xe0'.
+XLSX_MAGIC = 'PK\x03\x04'
+
+# Number of rows read from an .xlsx worksheet.  find_header_row() and
+# clean_data() never look past row 200.
+XLSX_MAX_ROWS = 200
+
 
 ########################################
-# convert_file
+# open_workbook
 # 
-# Reads in an Excel file for a particular mineral and
-# converts the contents to a CSV file
+# Opens a workbook in on-demand mode so that only the worksheets that are
+# asked for are parsed.  The scripts only ever use the first worksheet.
+# release_workbook() unloads it and releases the file contents (or memory
+# map) as soon as the caller is done, rather than whenever the garbage
+# collector gets to the Book object.
+#
+# The format is chosen from the first bytes of the file, not its name:
+# .xlsx files are read by XlsxBook, everything else by xlrd.  When a
+# workbook_source is set the workbook is read from it rather than from the
+# working directory and its contents are handed to xlrd in memory.
+
+def open_workbook(mineral_xls, logfile):
+    if workbook_source is not None:
+        contents = workbook_source.read(os.path.basename(mineral_xls))
+        if contents[:len(XLSX_MAGIC)] == XLSX_MAGIC:
+            return XlsxBook(mineral_xls, contents)
+        return xlrd.open_workbook(mineral_xls, logfile=logfile, file_contents=contents, on_demand=True)
+    with open(mineral_xls, 'rb') as f:
+        magic = f.read(len(XLSX_MAGIC))
+    if magic == XLSX_MAGIC:
+        return XlsxBook(mineral_xls)
+    return xlrd.open_workbook(mineral_xls, logfile=logfile, on_demand=True, use_mmap=use_mmap)
+
+def release_workbook(workbook):
+    for sheetx in range(0,workbook.nsheets):
+        if workbook.sheet_loaded(sheetx):
+            workbook.unload_sheet(sheetx)
+    workbook.release_resources()
+
+# Returns the workbook file of 'mineral': 'mineral.xls' or, failing
+# that, 'mineral.xlsx'
+def workbook_path(mineral):
+    mineral_xls = mineral + '.xls'
+    if not workbook_exists(mineral_xls) and workbook_exists(mineral_xls + 'x'):
+        return mineral_xls + 'x'
+    return mineral_xls
 
-def convert_file(mineral,logfile):
+def workbook_exists(mineral_xls):
+    if workbook_source is not None:
+        return workbook_source.exists(os.path.basename(mineral_xls))
+    return os.path.exists(mineral_xls)
 
-    mineral_xls = mineral + '.xls'
+def workbook_sha1(mineral_xls):
+    if workbook_source is not None:
+        return workbook_source.sha1(os.path.basename(mineral_xls))
+    return file_sha1(mineral_xls)
+
+
+########################################
+# Workbook sources
+# 
+# Workbooks can be read from a zip or tar archive, or from a content
+# addressed cache directory, without extracting them.  A source looks up
+# workbooks by file name, ignoring any directories inside an archive.
+#
+# A cache directory holds every workbook under its SHA-1, as 'ab/cdef...',
+# together with an index of the workbook names:
+#
+#   {"files": {"tin.xls": {"sha1": ...}, ...}}
+#
+# cache_workbooks() adds workbooks to a cache directory; it is run by the
+# --fill-cache option of main().
+
+CACHE_INDEX = 'DS140_cache_index.json'
+
+# Set by main() and init_worker() when workbooks are not read from the
+# working directory
+workbook_source = None
+
+class ArchiveSource(object):
+
+    def __init__(self, path):
+        self.path = path
+        if zipfile.is_zipfile(path):
+            self.archive = zipfile.ZipFile(path)
+            members = [(info.filename, info) for info in self.archive.infolist()]
+        else:
+            self.archive = tarfile.open(path)
+            members = [(member.name, member) for member in self.archive.getmembers() if member.isfile()]
+        self.members = {}
+        for name, member in members:
+            self.members.setdefault(posixpath.basename(name), member)
+
+    def exists(self, name):
+        return name in self.members
+
+    def read(self, name):
+        if name not in self.members:
+            raise IOError("No such file in %s: %s" % (self.path, name))
+        if isinstance(self.archive, zipfile.ZipFile):
+            return self.archive.read(self.members[name])
+        return self.archive.extractfile(self.members[name]).read()
+
+    def sha1(self, name):
+        return hashlib.sha1(self.read(name)).hexdigest()
+
+class CacheSource(object):
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, CACHE_INDEX)) as f:
+            self.files = json.load(f)['files']
+
+    def exists(self, name):
+        return name in self.files
+
+    def read(self, name):
+        if name not in self.files:
+            raise IOError("No such file in %s: %s" % (self.path, name))
+        with open(cache_object(self.path, self.files[name]['sha1']), 'rb') as f:
+            return f.read()
+
+    def sha1(self, name):
+        return self.files[name]['sha1']
+
+def open_source(path):
+    if os.path.isdir(path):
+        return CacheSource(path)
+    return ArchiveSource(path)
+
+def cache_object(directory, sha1):
+    return os.path.join(directory, sha1[:2], sha1[2:])
+
+# Copies the files at 'paths' into the cache 'directory' and adds them to its index
+def cache_workbooks(paths, directory):
+    index_path = os.path.join(directory, CACHE_INDEX)
+    if os.path.exists(index_path):
+        with open(index_path) as f:
+            index = json.load(f)
+    else:
+        index = {'files': {}}
+    for path in paths:
+        sha1 = file_sha1(path)
+        object_path = cache_object(directory, sha1)
+        if not os.path.exists(object_path):
+            if not os.path.exists(os.path.dirname(object_path)):
+                os.makedirs(os.path.dirname(object_path))
+            fd, tmp_path = make_temp(object_path)
+            with os.fdopen(fd, 'wb') as out:
+                with open(path, 'rb') as f:
+                    shutil.copyfileobj(f, out)
+            move_into_place(tmp_path, object_path)
+        index['files'].setdefault(os.path.basename(path), {})['sha1'] = sha1
+    write_atomic(index_path, [json.dumps(index, indent=1, sort_keys=True)])
+
+
+########################################
+# ArchiveWriter
+# 
+# Collects output files in a single .zip or .tar (.tar.gz, .tgz, .tar.bz2)
+# archive.  The archive is written to a temporary file and only renamed
+# into place by close().
+
+class ArchiveWriter(object):
+
+    def __init__(self, path):
+        self.path = path
+        fd, self.tmp_path = make_temp(path)
+        os.close(fd)
+        if path.endswith('.zip'):
+            self.archive = zipfile.ZipFile(self.tmp_path, 'w', zipfile.ZIP_DEFLATED)
+        elif path.endswith('.tar.gz') or path.endswith('.tgz'):
+            self.archive = tarfile.open(self.tmp_path, 'w:gz')
+        elif path.endswith('.tar.bz2'):
+            self.archive = tarfile.open(self.tmp_path, 'w:bz2')
+        else:
+            self.archive = tarfile.open(self.tmp_path, 'w')
+
+    def add(self, name, text):
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+        if isinstance(self.archive, zipfile.ZipFile):
+            self.archive.writestr(name, text)
+        else:
+            info = tarfile.TarInfo(name)
+            info.size = len(text)
+            info.mtime = time.time()
+            info.mode = 0o644
+            self.archive.addfile(info, io.BytesIO(text))
+
+    def close(self):
+        self.archive.close()
+        move_into_place(self.tmp_path, self.path)
+
+    def abort(self):
+        self.archive.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+########################################
+# XlsxBook
+# 
+# Read-only view of an .xlsx workbook offering the parts of the xlrd Book
+# and Sheet interface used by the scripts.  Worksheets are streamed with
+# openpyxl in read-only mode and only the first 'max_rows' rows are kept,
+# so memory use does not grow with the size of the worksheet.  Cell types
+# and values are translated to their xlrd equivalents: numbers are floats,
+# dates are Excel serial numbers and empty cells are XL_CELL_EMPTY with
+# the value ''.
+
+class XlsxBook(object):
+
+    def __init__(self, path, contents=None, max_rows=XLSX_MAX_ROWS):
+        try:
+            import openpyxl
+        except ImportError:
+            raise ImportError("The openpyxl module is required to read %s" % path)
+        # openpyxl refuses file names not ending in .xlsx, but not open files
+        if contents is not None:
+            self.file = io.BytesIO(contents)
+        else:
+            self.file = open(path, 'rb')
+        try:
+            self.workbook = openpyxl.load_workbook(self.file, read_only=True, data_only=True)
+        except:
+            self.file.close()
+            raise
+        self.max_rows = max_rows
+        self.sheets = {}
+
+    @property
+    def nsheets(self):
+        return len(self.workbook.worksheets)
+
+    def sheet_by_index(self, sheetx):
+        if sheetx not in self.sheets:
+            self.sheets[sheetx] = XlsxSheet(self.workbook.worksheets[sheetx], self.max_rows)
+        return self.sheets[sheetx]
+
+    def sheet_loaded(self, sheetx):
+        return sheetx in self.sheets
+
+    def unload_sheet(self, sheetx):
+        self.sheets.pop(sheetx, None)
+
+    def release_resources(self):
+        self.sheets = {}
+        self.workbook.close()
+        self.file.close()
+
+class XlsxSheet(object):
+
+    def __init__(self, worksheet, max_rows):
+        self.name = worksheet.title
+        self.types = []
+        self.values = []
+        for row in worksheet.iter_rows(max_row=max_rows):
+            cells = [xlsx_cell(cell) for cell in row]
+            self.types.append([ctype for ctype, value in cells])
+            self.values.append([value for ctype, value in cells])
+        self.nrows = len(self.types)
+        self.ncols = max([len(types) for types in self.types] or [0])
+        # xlrd pads every row to the full width of the sheet
+        for rowx in range(0,self.nrows):
+            pad = self.ncols - len(self.types[rowx])
+            self.types[rowx].extend([xlrd.XL_CELL_EMPTY] * pad)
+            self.values[rowx].extend([''] * pad)
+
+    def row_types(self, rowx, start_colx=0, end_colx=None):
+        return self.types[rowx][start_colx:end_colx]
+
+    def row_values(self, rowx, start_colx=0, end_colx=None):
+        return self.values[rowx][start_colx:end_colx]
+
+    def col_types(self, colx, start_rowx=0, end_rowx=None):
+        return [types[colx] for types in self.types[start_rowx:end_rowx]]
+
+    def col_values(self, colx, start_rowx=0, end_rowx=None):
+        return [values[colx] for values in self.values[start_rowx:end_rowx]]
+
+# Returns the xlrd (type, value) of an openpyxl cell
+def xlsx_cell(cell):
+    value = getattr(cell, 'value', None)
+    if value is None:
+        return xlrd.XL_CELL_EMPTY, ''
+    if cell.data_type == 'e':
+        return xlrd.XL_CELL_ERROR, value
+    if isinstance(value, bool):
+        return xlrd.XL_CELL_BOOLEAN, int(value)
+    if isinstance(value, (int, long, float)):
+        return xlrd.XL_CELL_NUMBER, float(value)
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        from openpyxl.utils.datetime import to_excel
+        return xlrd.XL_CELL_DATE, float(to_excel(value))
+    return xlrd.XL_CELL_TEXT, value
 
+
+########################################
+# Metrics
+# 
+# Collects timing and counts for the conversion of one workbook.  Each call
+# to lap() adds the time since the previous lap to the named phase.  The
+# record returned by finish() is a plain dictionary:
+#
+#   {"mineral": "tin", "converter": "convert_file",
+#    "phases": {"open": ..., "header": ..., "clean": ..., "write": ...},
+#    "seconds": ..., "rows": ..., "cells": ..., "missing": ...,
+#    "substitutions": ..., "unconverted": ..., "max_rss_kb": ...}
+
+class Metrics(object):
+
+    def __init__(self, mineral, converter):
+        self.record = {'mineral': mineral, 'converter': converter, 'phases': {},
+                       'rows': 0, 'cells': 0, 'missing': 0, 'substitutions': 0, 'unconverted': 0}
+        self.start = time.time()
+        self.last = self.start
+
+    def lap(self, phase):
+        now = time.time()
+        phases = self.record['phases']
+        phases[phase] = phases.get(phase, 0.0) + now - self.last
+        self.last = now
+
+    def count(self, name, n):
+        self.record[name] += int(n)
+
+    def finish(self):
+        self.record['seconds'] = time.time() - self.start
+        if resource is not None:
+            # Peak resident set size of this process so far (kilobytes on Linux)
+            self.record['max_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return self.record
+
+
+# Header rows of workbooks whose header line can't be found by looking for 'Year',
+# keyed by mineral and vintage.  In 2011, the nickel.xls file doesn't include 'Year'
+# in the header line.
+HEADER_ROWS = {
+    ('nickel', 2011): 4,
+}
+
+# True if 'row' has titles and is followed by a row of data beginning with a year
+def looks_like_header(sheet, row):
+    if row + 1 >= sheet.nrows:
+        return False
+    titles = sheet.row_values(row)[1:]
+    return any(isinstance(title, basestring) and title.strip() for title in titles) and \
+           sheet.row_types(row + 1)[0] == xlrd.XL_CELL_NUMBER
+
+
+# Header rows already found in this process, keyed by (path, size, modification
+# time) of the workbook
+header_row_cache = {}
+
+
+########################################
+# find_header_row
+# 
+# The header row is typically row 5 but occasionally another row (eg. ironsteel.xls).
+# Search for the header row by looking for 'Year' in the first column of the first
+# 'last_row' rows.  The first column is read once and, if the workbook 'path' is
+# given, the result is kept in header_row_cache so that the converter and the
+# statistics pass don't repeat the scan.  Workbooks read from a workbook_source
+# are not cached.  A row from HEADER_ROWS is
+# only used if it looks like a header, otherwise a warning goes to 'logfile' (stderr
+# by default) and the sheet is searched as usual.
+# Raises ValueError if there is no header row.
+
+def find_header_row(sheet, mineral, path=None, last_row=200, vintage=VINTAGE, logfile=None):
+
+    if (mineral, vintage) in HEADER_ROWS:
+        header_row = HEADER_ROWS[(mineral, vintage)]
+        if looks_like_header(sheet, header_row):
+            return header_row
+        if logfile is None:
+            logfile = sys.stderr
+        print >> logfile, "*** Row %d of %s doesn't look like a header row, searching for 'Year'" % \
+            (header_row, path or mineral)
+
+    key = None
+    if path is not None and workbook_source is None:
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_size, stat.st_mtime)
+        if key in header_row_cache:
+            return header_row_cache[key]
+
+    if sheet.ncols > 0:
+        column = sheet.col_values(0, 0, min(last_row, sheet.nrows))
+    else:
+        column = []
+    if 'Year' not in column:
+        raise ValueError("No 'Year' header row found in %s" % (path or mineral))
+    header_row = column.index('Year')
+
+    if key is not None:
+        header_row_cache[key] = header_row
+    return header_row
+
+
+########################################
+# clean_data
+# 
+# Reads the block of data rows that begins at 'first_row' and converts it
+# to a float64 matrix with a matching mask of missing values.  Data continue
+# for as long as the Year column contains numbers, up to 'last_row'.
+#
+# The block is read a column at a time.  Number cells are copied as they are,
+# empty cells are missing and text cells are classified in bulk: each distinct
+# text value is looked up in 'sentinels' or converted with float() only once.
+# 'column_sentinels' maps a column index to sentinels that only apply in that
+# column and take precedence over 'sentinels'.
+#
+# Returns (data, missing, unconverted) where 'unconverted' maps (row, col)
+# within the block to the original text of cells that could not be converted.
+# Substitutions and conversion failures are reported to 'logfile' (stdout
+# by default) and counted in 'metrics' if given.
+#
+# From help(xlrd):
+#   XL_CELL_EMPTY   = 0
+#   XL_CELL_TEXT    = 1
+#   XL_CELL_NUMBER  = 2
+#   XL_CELL_DATE    = 3
+#   XL_CELL_BOOLEAN = 4
+#   XL_CELL_ERROR   = 5
+#   XL_CELL_BLANK   = 6
+
+def clean_data(sheet, first_row, colhi, sentinels, column_sentinels={}, last_row=200,
+               logfile=None, metrics=None):
+
+    if logfile is None:
+        logfile = sys.stdout
+
+    # Stop ingesting data when the Year column no longer contains numbers.
+    end_row = max(first_row, min(last_row, sheet.nrows))
+    year_types = np.array(sheet.col_types(0, first_row, end_row), dtype=np.int8)
+    stops = np.nonzero(year_types != xlrd.XL_CELL_NUMBER)[0]
+    if len(stops) > 0:
+        end_row = first_row + stops[0]
+    nrows = end_row - first_row
+
+    types = np.empty((nrows, colhi), dtype=np.int8)
+    values = np.empty((nrows, colhi), dtype=object)
+    for col in range(0,colhi):
+        types[:,col] = sheet.col_types(col, first_row, end_row)
+        values[:,col] = sheet.col_values(col, first_row, end_row)
+
+    # Cells of any other type are considered errors.
+    unknown = (types != xlrd.XL_CELL_EMPTY) & (types != xlrd.XL_CELL_TEXT) & (types != xlrd.XL_CELL_NUMBER)
+    if unknown.any():
+        row, col = np.argwhere(unknown)[0]
+        print >> logfile, "UNKNOWN data type in row %d, col %d" % (first_row+row,col)
+        print >> logfile, "    cell type = " + str(types[row,col])
+        raise ValueError("Unknown data type %d in row %d, col %d" % (types[row,col], first_row+row, col))
+
+    data = np.zeros((nrows, colhi), dtype=np.float64)
+    missing = types == xlrd.XL_CELL_EMPTY
+
+    # Cells with numbers do not need conversion.
+    number = types == xlrd.XL_CELL_NUMBER
+    data[number] = values[number].astype(np.float64)
+
+    # Classify every distinct text value once and spread the result over the cells.
+    text = types == xlrd.XL_CELL_TEXT
+    rows, cols = np.nonzero(text)
+    unconverted = {}
+    if metrics is not None:
+        metrics.count('rows', nrows)
+        metrics.count('cells', nrows*colhi)
+    if len(rows) == 0:
+        if metrics is not None:
+            metrics.count('missing', missing[:,1:].sum())
+        return data, missing, unconverted
+
+    raw = values[rows, cols]
+    uniques, inverse = np.unique(raw, return_inverse=True)
+    stripped = np.array([value.strip() for value in uniques], dtype=object)
+    uvalue = np.zeros(len(uniques), dtype=np.float64)
+    umissing = np.zeros(len(uniques), dtype=bool)
+    ureport = np.zeros(len(uniques), dtype=bool)
+    ufailed = np.zeros(len(uniques), dtype=bool)
+    for i, value in enumerate(stripped):
+        if value in sentinels:
+            substitute, ureport[i] = sentinels[value]
+            if substitute is None:
+                umissing[i] = True
+            else:
+                uvalue[i] = substitute
+        else:
+            try:
+                uvalue[i] = float(value)
+            except ValueError:
+                ufailed[i] = True
+
+    cell_value = uvalue[inverse]
+    cell_missing = umissing[inverse]
+    cell_report = ureport[inverse]
+    cell_failed = ufailed[inverse]
+    cell_stripped = stripped[inverse]
+    for col, extra in column_sentinels.items():
+        for value, (substitute, report) in extra.items():
+            special = (cols == col) & (cell_stripped == value)
+            cell_missing[special] = substitute is None
+            cell_value[special] = 0.0 if substitute is None else substitute
+            cell_report[special] = report
+            cell_failed[special] = False
+
+    data[rows, cols] = cell_value
+    missing[rows, cols] = cell_missing
+
+    # Report substitutions and failures in row order.
+    for i in np.nonzero(cell_report | cell_failed)[0]:
+        if cell_failed[i]:
+            print >> logfile, "Cannot convert value '%s' to float in row %d, col %d" % (cell_stripped[i],first_row+rows[i]+1,cols[i]+1)
+            unconverted[(rows[i],cols[i])] = raw[i]
+        else:
+            print >> logfile, "Converting row %d, column %d to 'na'" % (first_row+rows[i],cols[i])
+
+    if metrics is not None:
+        substituted = np.in1d(cell_stripped, list(sentinels.keys()))
+        for col, extra in column_sentinels.items():
+            substituted |= (cols == col) & np.in1d(cell_stripped, list(extra.keys()))
+        metrics.count('substitutions', substituted.sum())
+        metrics.count('unconverted', len(unconverted))
+        metrics.count('missing', missing[:,1:].sum())
+
+    return data, missing, unconverted
+
+
+########################################
+# CSV output
+# 
+# The rows of a stream are formatted as lines of CSV text.  Files are written
+# to a temporary file in the destination directory which is then renamed into
+# place so that readers never see a partially written file.
+
+# Returns (fd, tmp_path) of a new temporary file next to 'path'
+def make_temp(path):
+    directory = os.path.dirname(os.path.abspath(path))
+    return tempfile.mkstemp(prefix='.' + os.path.basename(path) + '.', dir=directory)
+
+# Renames a finished temporary file to 'path'
+def move_into_place(tmp_path, path):
+    # mkstemp() creates files readable only by the owner
+    umask = os.umask(0)
+    os.umask(umask)
+    os.chmod(tmp_path, 0o666 & ~umask)
+    if os.name == 'nt' and os.path.exists(path):
+        os.remove(path)
+    os.rename(tmp_path, path)
+
+# Writes an iterable of lines to 'path'
+def write_atomic(path, lines):
+    fd, tmp_path = make_temp(path)
     try:
-        workbook = xlrd.open_workbook(mineral_xls, logfile=logfile)
-    except xlrd.XLRDError:
-        print >> logfile, "*** Open failed: %s: %s" % sys.exc_info()[:2]
+        with os.fdopen(fd, 'w') as out:
+            out.writelines(lines)
+        move_into_place(tmp_path, path)
     except:
-        print >> logfile, "*** Open failed: %s: %s" % sys.exc_info()[:2]
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def header_lines(mineral, titles_string, names_string, vintage=VINTAGE):
+    return ["DC.title      = ASCII CSV version of " + mineral + ".xls file\n",
+            "file URL      = http://mazamascience.com/Minerals/USGS/DS140/%d/" % vintage + mineral + ".csv\n",
+            "original data = http://minerals.usgs.gov/ds/2005/140/" + mineral + ".xls\n",
+            "units         = metric tons\n",
+            "\n",
+            titles_string + "\n",
+            names_string + "\n"]
+
+# Formats a row of a stream: years as integers, numbers with one decimal
+# and missing values and unconverted text in quotes.
+def format_row(row):
+    cells = ['%d' % row[0]]
+    for value in row[1:]:
+        if value is None:
+            cells.append('"na"')
+        elif isinstance(value, float):
+            cells.append('%.1f' % value)
+        else:
+            cells.append('"%s"' % value)
+    return ','.join(cells) + '\n'
+
+# Yields the lines of the CSV file for 'mineral' from the rows of a stream
+def csv_lines(mineral, rows, vintage=VINTAGE):
+    titles = next(rows)
+    names = next(rows)
+    titles_string = ','.join(['"' + title + '"' for title in titles])
+    names_string = ','.join(names)
+    for line in header_lines(mineral, titles_string, names_string, vintage):
+        yield line
+    for row in rows:
+        yield format_row(row)
+
+# Writes the CSV version of a stream to any file-like object, eg. sys.stdout
+# or socket.makefile('w')
+def write_rows(mineral, rows, out, vintage=VINTAGE):
+    out.writelines(csv_lines(mineral, rows, vintage))
 
-    mineral_csv = mineral + ".csv"
-    csv = open(mineral_csv,'w')
-    sheet = workbook.sheet_by_index(0) # python index 0 = worksheet 1
 
-    # In 2011, the nickel.xls file doesn't include 'Year' in the header line so the test below won't work
-    if mineral == 'nickel':
-        header_row = 4
-    else:
-        # The header row is typically row 5 but occasionally another row (eg. ironsteel.xls)
-        # Search for the header row by looking for 'Year' in the first column.
-        for row in range(0,200):
-            if sheet.row_values(row)[0] == 'Year':
-                header_row = row
-                break;
-
-    # Get all the titles and create associated names.
-    # Harmonize non-standard names where appropriate.
-    titles = sheet.row_values(header_row)
+########################################
+# Streams
+# 
+# stream_file() and stream_use_file() read and clean a workbook and yield
+# its contents row by row, like csv.reader: first the list of titles, then
+# the list of names and then one list per year starting with the year as
+# an integer.  Values are floats, None where the value is missing and the
+# original text where it could not be converted.  Years without data are
+# included as rows of missing values from 1900 (1975 for '-use' files) to
+# padding_end(vintage), 2020 for 2011.  The workbook is read and released
+# before the first row is yielded.
+
+def na_row(year, colhi):
+    return [year] + [None] * (colhi-1)
+
+# Yields the rows of the output of clean_data()
+def data_rows(data, missing, unconverted):
+    rows = data.tolist()
+    for row, col in zip(*np.nonzero(missing)):
+        rows[row][col] = None
+    for (row,col), value in unconverted.items():
+        rows[row][col] = value
+    for row in rows:
+        row[0] = int(row[0])
+        yield row
+
+# Returns the stream for a 'mineral.xls' or 'mineral-use.xls' file
+def stream(mineral, logfile, metrics=None, vintage=VINTAGE):
+    if mineral.endswith('-use'):
+        return stream_use_file(mineral, logfile, metrics, vintage)
+    return stream_file(mineral, logfile, metrics, vintage)
+
+
+########################################
+# harmonize_titles
+# 
+# Get all the titles of a 'mineral.xls' header row and create associated names.
+# Harmonize non-standard names where appropriate.  Returns (titles, names).
+
+def harmonize_titles(titles):
+    titles = list(titles)
     colhi = len(titles)
     names = []
     for col in range(0,colhi):
@@ -58,7 +715,7 @@ def convert_file(mineral,logfile):
         title = title.strip()                          # remove leading/following whitespace
         title = re.sub("\s" , " ", title)              # replace any whitespacae with a single space
         title = re.sub("\s+" , " ", title)             # replace multilpe spaces with a single space
-        titles[col] = '"' + title + '"' 
+        titles[col] = title
         if title == 'Unit value ($/t)':
             names.append('unit_value')
         elif title == 'Unit value (98$/t)':
@@ -71,581 +728,1532 @@ def convert_file(mineral,logfile):
             names.append('unit_value_1998')
         else:
             names.append(title.lower().replace(' ','_'))
+    return titles, names
 
-    titles_string = ','.join(titles)
-    names_string = ','.join(names) 
 
-    print("Working on " + mineral_csv)
-    """
-  # debugging lines
-  print(titles_string)
-  print(names_string)
-  if 'production' not in names:
-    print("\t missing production")
-  if 'imports' not in names:
-    print("\t missing imports")
-  if 'exports' not in names:
-    print("\t missing exports")
-  if 'apparent_consumption' not in names:
-    print("\t missing apparent_consumption")
-  if 'world_production' not in names:
-    print("\t missing world_production")
-  """
-
-    csv.write("DC.title      = ASCII CSV version of " + mineral + ".xls file\n")
-    csv.write("file URL      = http://mazamascience.com/Minerals/USGS/DS140/2011/" + mineral + ".csv\n")
-    csv.write("original data = http://minerals.usgs.gov/ds/2005/140/" + mineral + ".xls\n")
-    csv.write("units         = metric tons\n")
-    csv.write("\n")
-    csv.write(titles_string + "\n")
-    csv.write(names_string + "\n")
+########################################
+# stream_file
+# 
+# Reads in an Excel file for a particular mineral and
+# yields its contents row by row
+
+def stream_file(mineral,logfile,metrics=None,vintage=VINTAGE):
+
+    mineral_xls = workbook_path(mineral)
+    if metrics is None:
+        metrics = Metrics(mineral, 'stream_file')
+
+    try:
+        workbook = open_workbook(mineral_xls, logfile)
+    except:
+        print >> logfile, "*** Open failed: %s: %s" % sys.exc_info()[:2]
+        raise
+
+    try:
+        sheet = workbook.sheet_by_index(0) # python index 0 = worksheet 1
+        metrics.lap('open')
+
+        header_row = find_header_row(sheet, mineral, mineral_xls, vintage=vintage, logfile=logfile)
+
+        titles, names = harmonize_titles(sheet.row_values(header_row))
+        colhi = len(titles)
+
+        """
+      # debugging lines
+      print(titles_string)
+      print(names_string)
+      if 'production' not in names:
+        print("\t missing production")
+      if 'imports' not in names:
+        print("\t missing imports")
+      if 'exports' not in names:
+        print("\t missing exports")
+      if 'apparent_consumption' not in names:
+        print("\t missing apparent_consumption")
+      if 'world_production' not in names:
+        print("\t missing world_production")
+      """
+
+        first_year = sheet.row_values(header_row+1)[0]
+
+        # Data begin after the header_row and continue for up to current_year-1900 years
+        sentinels = SENTINELS
+        column_sentinels = {}
+
+        # Special case for aluminum, net_import_reliance which uses 'E'
+        if mineral == 'aluminum':
+            for col in range(0,colhi):
+                if names[col] == 'net_import_reliance':
+                    column_sentinels[col] = {'E': (None, False)}
+
+        # Special case for tantalum which has '1470*' in [2005,'World production']
+        if mineral == 'tantalum':
+            sentinels = dict(SENTINELS)
+            sentinels['1470*'] = (1470.0, False)
+
+        metrics.lap('header')
+        data, missing, unconverted = clean_data(sheet, header_row+1, colhi, sentinels, column_sentinels,
+                                                logfile=logfile, metrics=metrics)
+    finally:
+        release_workbook(workbook)
+    metrics.lap('clean')
+
+    yield titles
+    yield names
 
     # Check first year and fill in missing values if first year > 1900
     year = 1900
-    first_year = sheet.row_values(header_row+1)[0]
     while (year < first_year):
-        for col in range(0,colhi):
-            if col == 0:
-                csv.write('%d' % year)
-            else:
-                csv.write(',"na"')
-        csv.write('\n')
+        yield na_row(year, colhi)
         year += 1
 
+    #### Special case for beryllium which is missing the row for the year 2000.
+    #### Before we write out the results for 2001, insert the 2000 results -- all missing values
+    ###if (mineral == 'beryllium') and (year == 2001):
+        ###csv.write("2000")
+        ###for col in range(1,colhi):
+            ###csv.write(",\"na\"")
+        ###csv.write("\n")
 
-    # Data begin after the header_row and continue for up to current_year-1900 years
-    # We will check the type of the first column to determine when to stop ingesting data
-    for row in range(header_row+1,200):
+    for row in data_rows(data, missing, unconverted):
+        year = row[0]
+        yield row
 
-        # Stop ingesting data if you run out of rows
-        try:
-            types = sheet.row_types(row)
-            values = sheet.row_values(row)
-        except IndexError:
-            break;
-
-        # Stop ingesting data when the Year column no longer contains numbers.
-        if types[0] == xlrd.XL_CELL_NUMBER:
-            year = values[0]
-        else:
-            break;
-
-        # From help(xlrd):
-        #   XL_CELL_EMPTY   = 0
-        #   XL_CELL_TEXT    = 1
-        #   XL_CELL_NUMBER  = 2
-        #   XL_CELL_DATE    = 3
-        #   XL_CELL_BOOLEAN = 4
-        #   XL_CELL_ERROR   = 5
-        #   XL_CELL_BLANK   = 6
-
-        # Validate and fix the data in the cells of this row.
-        for col in range(0,colhi):
+    # Check last year and fill in missing values if last year < padding_end(vintage)
+    last_year = padding_end(vintage)
+    year += 1
+    while (year <= last_year):
+        yield na_row(year, colhi)
+        year += 1
 
-            # Empty cells are converted to 'na'.
-            if types[col] == xlrd.XL_CELL_EMPTY:
-                values[col] = 'na'
-                types[col] = xlrd.XL_CELL_TEXT
-
-            # Cells with text are converted directly to float.
-            elif types[col] == xlrd.XL_CELL_TEXT:
-
-                value = values[col].strip()
-
-                # Catch non-empty cells with a blank space in them
-                if len(value) == 0:
-                    values[col] = 'na'
-                    types[col] = xlrd.XL_CELL_TEXT
-
-                # Special case for aluminum, net_import_reliance
-                elif mineral == 'aluminum' and names[col] == 'net_import_reliance' and value == 'E':
-                    values[col] = 'na'
-                    types[col] = xlrd.XL_CELL_TEXT
-
-                # Special case for tantalum which has '1470*' in [2005,'World production']
-                elif mineral == 'tantalum' and value == '1470*':
-                    values[col] = 1470.0
-                    types[col] = xlrd.XL_CELL_NUMBER
-
-                # Everything else we convert to float
-                else: 
-                    if value == 'NA':
-                        values[col] = 'na'
-                        types[col] = xlrd.XL_CELL_NUMBER
-                    elif value == 'W':
-                        values[col] = 'na'
-                        types[col] = xlrd.XL_CELL_TEXT
-                        print("Converting row %d, column %d to 'na'" % (row,col))
-                    else:
-                        try:
-                            values[col] = float(value)
-                            types[col] = xlrd.XL_CELL_NUMBER
-                        except:
-                            print("Cannot convert value '%s' to float in row %d, col %d" % (value,row+1,col+1))
-
-            # Cells with numbers do not need conversion.
-            elif types[col] == xlrd.XL_CELL_NUMBER:
-                value = values[col]
-                if value == 'W':
-                    values[col] = 'na'
-                    types[col] = xlrd.XL_CELL_TEXT
-                pass
-
-            # Cells of any other type are considered errors.
-            else:
-                print("UNKNOWN data type in row %d, col %d" % (row,col))
-                print("    cell type = " + str(types[col]))
-                sys.exit(1)
-
-        #### Special case for beryllium which is missing the row for the year 2000.
-        #### Before we write out the results for 2001, insert the 2000 results -- all missing values
-        ###if (mineral == 'beryllium') and (year == 2001):
-            ###csv.write("2000")
-            ###for col in range(1,colhi):
-                ###csv.write(",\"na\"")
-            ###csv.write("\n")
-
-        # Print out the values with appropriate formatting.
-        for col in range(0,colhi):
 
-            if types[col] == xlrd.XL_CELL_NUMBER:
-                if col == 0: # Year
-                    csv.write("%d" % int(values[col]))
-                else:
-                    if values[col] == 'na':
-                        csv.write(",\"na\"")
-                    else:
-                        csv.write(",%.1f" % values[col])
+########################################
+# stream_use_file
+# 
+# Reads in an Excel file for a particular mineral's end uses and
+# yields its contents row by row
+
+def stream_use_file(mineral,logfile,metrics=None,vintage=VINTAGE):
 
-            elif types[col] == xlrd.XL_CELL_TEXT:
-                csv.write(",\"%s\"" % values[col])
+    mineral_xls = workbook_path(mineral)
+    if metrics is None:
+        metrics = Metrics(mineral, 'stream_use_file')
+
+    try:
+        workbook = open_workbook(mineral_xls, logfile)
+    except:
+        print >> logfile, "*** Open failed: %s: %s" % sys.exc_info()[:2]
+        raise
 
+    try:
+        sheet = workbook.sheet_by_index(0) # python index 0 = worksheet 1
+        metrics.lap('open')
+
+        header_row = find_header_row(sheet, mineral, mineral_xls, vintage=vintage, logfile=logfile)
+
+        # Get all the titles and create associated names.
+        # Harmonize non-standard names where appropriate.
+        titles = sheet.row_values(header_row)
+        colhi = len(titles)
+        names = []
+        for col in range(0,colhi):
+            title = titles[col]
+            title = title.strip()                          # remove leading/following whitespace
+            title = re.sub("\s" , " ", title)              # replace any whitespacae with a single space
+            title = re.sub("\s+" , " ", title)             # replace multilpe spaces with a single space
+            titles[col] = title
+            if mineral=='stonecrushed-use' and col == 1:
+                titles[col] = 'Coarse aggregate' 
+                names.append('coarse_aggregate')
+            elif mineral=='stonecrushed-use' and col == 3:
+                titles[col] = 'Fine aggregate' 
+                names.append('fine_aggregate')
             else:
-                print("UNKNOWN cell_type %d in column %d" % (types[col],col))
-                sys.exit(1)
+                names.append(title.lower().replace(' ','_').replace(',','_').replace('(','_').replace(')','_'))
 
+        """
+      # debugging lines
+      print(titles_string)
+      print(names_string)
+      if 'production' not in names:
+        print("\t missing production")
+      if 'imports' not in names:
+        print("\t missing imports")
+      if 'exports' not in names:
+        print("\t missing exports")
+      if 'apparent_consumption' not in names:
+        print("\t missing apparent_consumption")
+      if 'world_production' not in names:
+        print("\t missing world_production")
+      """
+
+        # Fix up issues with problem files
+
+        # TODO:  boron-use.xls is a mess because 'Year' and all the titles appear in row 5 EXCEPT for 'Fire retardants'
+        # TODO:  that have subtitles in row 6.  The data start in row 7.  Don't include it for now.
+        # TODO:  cement-use.xls has the same issues
+        # TODO:  clayskaolin-use.xls has the same issues
+        # TODO:  claysmisc-use.xls has the same issues
+        # TODO:  gypsum-use.xls has the same issues
+        # TODO:  ironsteelslag-use.xls has the same issues
+        # TODO:  mercury-use.xls has the same issues
+        # TODO:  sandgravelindustrial-use.xls has the same issues
+        # TODO:  sodaash-use.xls has the same issues
+        # TODO:  stonedimension-use.xls has the same issues
+
+        if mineral == 'claysbentonite-use':
+            header_row += 1
+
+        first_year = sheet.row_values(header_row+1)[0]
+
+        # Data begin after the header_row and continue for up to current_year-1975 years
+        metrics.lap('header')
+        data, missing, unconverted = clean_data(sheet, header_row+1, colhi, USE_SENTINELS,
+                                                logfile=logfile, metrics=metrics)
+    finally:
+        release_workbook(workbook)
+    metrics.lap('clean')
+
+    yield titles
+    yield names
 
-        csv.write("\n")
+    # Check first year and fill in missing values if first year > 1975
+    year = 1975
+    while (year < first_year):
+        yield na_row(year, colhi)
+        year += 1
 
-    # Check first year and fill in missing values if first year > 1900
-    last_year = 2020
+    for row in data_rows(data, missing, unconverted):
+        year = row[0]
+        yield row
+
+    # Check last year and fill in missing values if last year < padding_end(vintage)
+    last_year = padding_end(vintage)
     year += 1
     while (year <= last_year):
-        for col in range(0,colhi):
-            if col == 0:
-                csv.write('%d' % year)
-            else:
-                csv.write(',"na"')
-        csv.write('\n')
+        yield na_row(year, colhi)
         year += 1
 
+
+########################################
+# convert_file
+# 
+# Reads in an Excel file for a particular mineral and
+# converts the contents to a CSV file (or to 'out' if given)
+
+def convert_file(mineral,logfile,vintage=VINTAGE,out=None):
+
+    metrics = Metrics(mineral, 'convert_file')
+    mineral_csv = mineral + ".csv"
+
+    print("Working on " + mineral_csv)
+    rows = stream_file(mineral, logfile, metrics, vintage)
+    if out is None:
+        write_atomic(mineral_csv, csv_lines(mineral, rows, vintage))
+    else:
+        write_rows(mineral, rows, out, vintage)
+    metrics.lap('write')
+
     print("Finished with " + mineral + " workbook.")
+    return metrics.finish()
 
 
 ########################################
 # convert_use_file
 # 
-# Reads in an Excel file for a particular mineral and
-# converts the contents to a CSV file
+# Reads in an Excel file for a particular mineral's end uses and
+# converts the contents to a CSV file (or to 'out' if given)
 
-def convert_use_file(mineral,logfile):
+def convert_use_file(mineral,logfile,vintage=VINTAGE,out=None):
 
-    mineral_xls = mineral + '.xls'
+    metrics = Metrics(mineral, 'convert_use_file')
+    mineral_csv = mineral + ".csv"
+
+    print("Working on " + mineral_csv)
+    rows = stream_use_file(mineral, logfile, metrics, vintage)
+    if out is None:
+        write_atomic(mineral_csv, csv_lines(mineral, rows, vintage))
+    else:
+        write_rows(mineral, rows, out, vintage)
+    metrics.lap('write')
+
+    print("Finished with " + mineral + " workbook.")
+    return metrics.finish()
+
+
+########################################
+# read_csv
+# 
+# Reads a CSV file written by convert_file() or convert_use_file() and
+# returns (titles, names, data) where data is a float64 matrix with the
+# year in column 0.  Values of "na" (and any text that was not converted)
+# are returned as NaN.
 
+def to_float(value):
     try:
-        workbook = xlrd.open_workbook(mineral_xls, logfile=logfile)
-    except xlrd.XLRDError:
-        print >> logfile, "*** Open failed: %s: %s" % sys.exc_info()[:2]
-    except:
-        print >> logfile, "*** Open failed: %s: %s" % sys.exc_info()[:2]
+        return float(value)
+    except ValueError:
+        return np.nan
+
+def read_csv(mineral_csv):
+    with open(mineral_csv) as f:
+        lines = f.readlines()
+    # Skip the four lines of metadata and the blank line that follows them
+    reader = csv.reader(lines[5:])
+    titles = next(reader)
+    names = next(reader)
+    rows = [[to_float(value) for value in row] for row in reader]
+    data = np.array(rows, dtype=np.float64).reshape(len(rows), len(names))
+    return titles, names, data
+
+# Columns of a table read with read_csv() that hold variables.  Stray cells
+# next to a header leave blank names, which are dropped, and only the first
+# column of a repeated name is kept.
+def variable_columns(names):
+    seen = set()
+    cols = []
+    for col in range(1,len(names)):
+        if names[col] and names[col] not in seen:
+            seen.add(names[col])
+            cols.append(col)
+    return cols
+
+
+# Kind of table written by each converter
+TABLE_KINDS = {
+    'convert_file': 'supply',
+    'convert_use_file': 'end_use',
+}
+
+def table_kind(converter):
+    return TABLE_KINDS[converter.__name__]
+
+# Mineral name without the '-use' suffix of end use workbooks
+def base_mineral(mineral):
+    if mineral.endswith('-use'):
+        return mineral[:-len('-use')]
+    return mineral
 
-    mineral_csv = mineral + ".csv"
-    csv = open(mineral_csv,'w')
-    sheet = workbook.sheet_by_index(0) # python index 0 = worksheet 1
-
-    # The header row is typically row 5 but occasionally another row (eg. ironsteel.xls)
-    # Search for the header row by looking for 'Year' in the first column.
-    for row in range(0,200):
-        if sheet.row_values(row)[0] == 'Year':
-            header_row = row
-            break;
-
-    # Get all the titles and create associated names.
-    # Harmonize non-standard names where appropriate.
-    titles = sheet.row_values(header_row)
-    colhi = len(titles)
-    names = []
-    for col in range(0,colhi):
-        title = titles[col]
-        title = title.strip()                          # remove leading/following whitespace
-        title = re.sub("\s" , " ", title)              # replace any whitespacae with a single space
-        title = re.sub("\s+" , " ", title)             # replace multilpe spaces with a single space
-        titles[col] = '"' + title + '"' 
-        if mineral=='stonecrushed-use' and col == 1:
-            titles[col] = '"Coarse aggregate"' 
-            names.append('coarse_aggregate')
-        elif mineral=='stonecrushed-use' and col == 3:
-            titles[col] = '"Fine aggregate"' 
-            names.append('fine_aggregate')
+
+########################################
+# write_store
+# 
+# Writes every converted table into one columnar dataset in long form with
+# the columns mineral, kind ('supply' or 'end_use'), year, variable and
+# value.  Missing values are stored as nulls and columns are picked with
+# variable_columns(), as for the cube and SQLite.  The file format is chosen
+# from the extension of 'path': '.feather' for Feather (version 2, the Arrow
+# IPC file format), anything else for Parquet.  Both are written in chunks
+# of 'row_group_size' rows.  'tables' is a list of (mineral, kind, mineral_csv).
+
+STORE_ROW_GROUP_SIZE = 64 * 1024
+
+def write_store(tables, path, row_group_size=STORE_ROW_GROUP_SIZE):
+
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("The pyarrow module is required to write %s" % path)
+
+    minerals = []
+    kinds = []
+    years = []
+    variables = []
+    values = []
+    for mineral, kind, mineral_csv in tables:
+        titles, names, data = read_csv(mineral_csv)
+        cols = variable_columns(names)
+        nrows = data.shape[0]
+        nvars = len(cols)
+        minerals.append(np.repeat(base_mineral(mineral), nrows*nvars).astype(object))
+        kinds.append(np.repeat(kind, nrows*nvars).astype(object))
+        years.append(np.tile(data[:,0].astype(np.int16), nvars))
+        variables.append(np.repeat(np.array([names[col] for col in cols], dtype=object), nrows))
+        values.append(data[:,cols].T.ravel())
+
+    columns = [
+        pyarrow.array(np.concatenate(minerals), type=pyarrow.string()),
+        pyarrow.array(np.concatenate(kinds), type=pyarrow.string()),
+        pyarrow.array(np.concatenate(years), type=pyarrow.int16()),
+        pyarrow.array(np.concatenate(variables), type=pyarrow.string()),
+        pyarrow.array(np.concatenate(values), type=pyarrow.float64(), from_pandas=True),
+    ]
+    table = pyarrow.Table.from_arrays(columns, ['mineral', 'kind', 'year', 'variable', 'value'])
+
+    fd, tmp_path = make_temp(path)
+    os.close(fd)
+    try:
+        if path.endswith('.feather'):
+            writer = pyarrow.RecordBatchFileWriter(tmp_path, table.schema)
+            for batch in table.to_batches(row_group_size):
+                writer.write_batch(batch)
+            writer.close()
         else:
-            names.append(title.lower().replace(' ','_').replace(',','_').replace('(','_').replace(')','_'))
+            pyarrow.parquet.write_table(table, tmp_path, row_group_size=row_group_size)
+        move_into_place(tmp_path, path)
+    except:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
 
-    titles_string = ','.join(titles)
-    names_string = ','.join(names) 
+    print("Wrote %d values to %s" % (table.num_rows, path))
 
-    print("Working on " + mineral_csv)
-    """
-  # debugging lines
-  print(titles_string)
-  print(names_string)
-  if 'production' not in names:
-    print("\t missing production")
-  if 'imports' not in names:
-    print("\t missing imports")
-  if 'exports' not in names:
-    print("\t missing exports")
-  if 'apparent_consumption' not in names:
-    print("\t missing apparent_consumption")
-  if 'world_production' not in names:
-    print("\t missing world_production")
-  """
-
-    # Fix up issues with problem files
-
-    # TODO:  boron-use.xls is a mess because 'Year' and all the titles appear in row 5 EXCEPT for 'Fire retardants'
-    # TODO:  that have subtitles in row 6.  The data start in row 7.  Don't include it for now.
-    # TODO:  cement-use.xls has the same issues
-    # TODO:  clayskaolin-use.xls has the same issues
-    # TODO:  claysmisc-use.xls has the same issues
-    # TODO:  gypsum-use.xls has the same issues
-    # TODO:  ironsteelslag-use.xls has the same issues
-    # TODO:  mercury-use.xls has the same issues
-    # TODO:  sandgravelindustrial-use.xls has the same issues
-    # TODO:  sodaash-use.xls has the same issues
-    # TODO:  stonedimension-use.xls has the same issues
-
-    if mineral == 'claysbentonite-use':
-        header_row += 1
-
-    csv.write("DC.title      = ASCII CSV version of " + mineral + ".xls file\n")
-    csv.write("file URL      = http://mazamascience.com/Minerals/USGS/DS140/2011/" + mineral + ".csv\n")
-    csv.write("original data = http://minerals.usgs.gov/ds/2005/140/" + mineral + ".xls\n")
-    csv.write("units         = metric tons\n")
-    csv.write("\n")
-    csv.write(titles_string + "\n")
-    csv.write(names_string + "\n")
 
-    # Check first year and fill in missing values if first year > 1975
-    year = 1975
-    first_year = sheet.row_values(header_row+1)[0]
-    while (year < first_year):
-        for col in range(0,colhi):
-            if col == 0:
-                csv.write('%d' % year)
-            else:
-                csv.write(',"na"')
-        csv.write('\n')
-        year += 1
+########################################
+# write_sqlite
+# 
+# Loads every converted table into one SQLite database:
+#
+#   minerals(id, name)
+#   variables(id, kind, name)
+#   titles(mineral, variable, title)
+#   observations(mineral, variable, year, value)
+#
+# 'titles' and 'observations' refer to the ids of the other two tables and
+# missing values are NULL.  Columns are picked with variable_columns().
+# Besides its primary key (mineral, variable, year), 'observations' is
+# indexed on (mineral, year) and (variable, year).  The 'series' view joins
+# in the names:
+#
+#   SELECT year, value FROM series WHERE mineral = 'tin'
+#     AND variable = 'world_production' AND year BETWEEN 1990 AND 2010
+#
+# The database is built in a temporary file, each table with one bulk
+# insert inside a single transaction, and moved into place when complete.
+# 'tables' is a list of (mineral, kind, mineral_csv).
+
+SQLITE_SCHEMA = """
+CREATE TABLE minerals (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE variables (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    UNIQUE (name, kind)
+);
+CREATE TABLE titles (
+    mineral INTEGER NOT NULL REFERENCES minerals (id),
+    variable INTEGER NOT NULL REFERENCES variables (id),
+    title TEXT NOT NULL,
+    PRIMARY KEY (mineral, variable)
+);
+CREATE TABLE observations (
+    mineral INTEGER NOT NULL REFERENCES minerals (id),
+    variable INTEGER NOT NULL REFERENCES variables (id),
+    year INTEGER NOT NULL,
+    value REAL,
+    PRIMARY KEY (mineral, variable, year)
+);
+CREATE VIEW series AS
+    SELECT minerals.name AS mineral, variables.kind AS kind, variables.name AS variable,
+           observations.year AS year, observations.value AS value
+    FROM observations
+    JOIN minerals ON minerals.id = observations.mineral
+    JOIN variables ON variables.id = observations.variable;
+"""
+
+# Built after the bulk load, which is faster than maintaining them row by row
+SQLITE_INDEXES = """
+CREATE INDEX observations_mineral_year ON observations (mineral, year);
+CREATE INDEX observations_variable_year ON observations (variable, year);
+ANALYZE;
+"""
+
+def write_sqlite(tables, path):
+
+    import sqlite3
+
+    mineral_ids = {}
+    variable_ids = {}
+    titles_rows = []
+    observations = []
+    for mineral, kind, mineral_csv in tables:
+        titles, names, data = read_csv(mineral_csv)
+        mineral_id = mineral_ids.setdefault(base_mineral(mineral), len(mineral_ids) + 1)
+        years = data[:,0].astype(int).tolist()
+        values = data.astype(object)
+        values[np.isnan(data)] = None
+        for col in variable_columns(names):
+            variable_id = variable_ids.setdefault((kind, names[col]), len(variable_ids) + 1)
+            titles_rows.append((mineral_id, variable_id, titles[col]))
+            observations.extend(zip([mineral_id] * len(years), [variable_id] * len(years),
+                                    years, values[:,col].tolist()))
+
+    fd, tmp_path = make_temp(path)
+    os.close(fd)
+    try:
+        connection = sqlite3.connect(tmp_path)
+        try:
+            # Nothing needs protecting until the file is moved into place
+            connection.execute("PRAGMA journal_mode = OFF")
+            connection.execute("PRAGMA synchronous = OFF")
+            connection.executescript(SQLITE_SCHEMA)
+            with connection:
+                connection.executemany("INSERT INTO minerals (id, name) VALUES (?, ?)",
+                                       [(id, name) for name, id in mineral_ids.items()])
+                connection.executemany("INSERT INTO variables (id, kind, name) VALUES (?, ?, ?)",
+                                       [(id, kind, name) for (kind, name), id in variable_ids.items()])
+                connection.executemany("INSERT INTO titles VALUES (?, ?, ?)", titles_rows)
+                connection.executemany("INSERT INTO observations VALUES (?, ?, ?, ?)", observations)
+            connection.executescript(SQLITE_INDEXES)
+        finally:
+            connection.close()
+        move_into_place(tmp_path, path)
+    except:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
 
+    print("Wrote %d values of %d minerals to %s" % (len(observations), len(mineral_ids), path))
 
-    # Data begin after the header_row and continue for up to current_year-1975 years
-    # We will check the type of the first column to determine when to stop ingesting data
-    for row in range(header_row+1,200):
 
-        # Stop ingesting data if you run out of rows
+########################################
+# build_cube
+# 
+# Stacks the tables of one kind into a dense float64 array of shape
+# (minerals, years, variables).  Missing values, years outside a table and
+# variables a mineral doesn't have are all NaN, so np.isnan(values) is the
+# mask of missing data.  Columns are picked with variable_columns(), as for
+# write_sqlite().  'tables' is a list of (mineral, mineral_csv) and the
+# years run from the earliest to the latest year of any table.
+# Returns (minerals, years, variables, values).
+
+def build_cube(tables):
+
+    minerals = []
+    contents = []
+    for mineral, mineral_csv in tables:
+        titles, names, data = read_csv(mineral_csv)
+        cols = variable_columns(names)
+        minerals.append(base_mineral(mineral))
+        contents.append(([names[col] for col in cols], data[:,0].astype(int), data[:,cols]))
+
+    variables = sorted(set().union(*[names for names, years, data in contents])) if contents else []
+    first_year = min([years.min() for names, years, data in contents if len(years)] or [0])
+    last_year = max([years.max() for names, years, data in contents if len(years)] or [-1])
+    years = np.arange(first_year, last_year + 1)
+
+    values = np.empty((len(minerals), len(years), len(variables)), dtype=np.float64)
+    values.fill(np.nan)
+    index = dict((name, col) for col, name in enumerate(variables))
+    for i, (names, table_years, data) in enumerate(contents):
+        cols = np.array([index[name] for name in names], dtype=int)
+        values[i, (table_years - first_year)[:,np.newaxis], cols[np.newaxis,:]] = data
+
+    return minerals, years, variables, values
+
+
+########################################
+# write_cube
+# 
+# Writes the cube of every kind of table to 'prefix_kind.npy' which can be
+# opened as a memory map with np.load(path, mmap_mode='r').  The axes are
+# described by a sidecar 'prefix_kind.json':
+#
+#   {"kind": "supply", "vintage": 2011, "shape": [...],
+#    "minerals": [...], "years": [first, last], "variables": [...]}
+#
+# 'tables' is a list of (mineral, kind, mineral_csv) as for write_store().
+
+def write_cube(tables, prefix, vintage=VINTAGE):
+
+    for kind in sorted(set(kind for mineral, kind, mineral_csv in tables)):
+        minerals, years, variables, values = build_cube([(mineral, mineral_csv)
+                                                         for mineral, table_kind, mineral_csv in tables
+                                                         if table_kind == kind])
+        path = '%s_%s.npy' % (prefix, kind)
+        fd, tmp_path = make_temp(path)
         try:
-            types = sheet.row_types(row)
-            values = sheet.row_values(row)
-        except IndexError:
-            break;
-
-        # Stop ingesting data when the Year column no longer contains numbers.
-        if types[0] == xlrd.XL_CELL_NUMBER:
-            year = values[0]
+            with os.fdopen(fd, 'wb') as out:
+                np.save(out, values)
+            move_into_place(tmp_path, path)
+        except:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        index = {'kind': kind,
+                 'vintage': vintage,
+                 'shape': list(values.shape),
+                 'minerals': minerals,
+                 'years': [int(years[0]), int(years[-1])] if len(years) else [],
+                 'variables': variables}
+        write_atomic('%s_%s.json' % (prefix, kind), [json.dumps(index, indent=1, sort_keys=True)])
+
+        print("Wrote %d minerals x %d years x %d variables to %s" % (values.shape + (path,)))
+
+
+########################################
+# derive_indicators
+# 
+# Computes indicators for every mineral and year of a supply cube as
+# returned by build_cube():
+#
+#   VARIABLE_growth      change from the previous year (%)
+#   VARIABLE_meanN       mean of the last 'window' years, NaN unless all are present
+#   world_share          production as a share of world production (%)
+#   unit_value_BASE      unit_value in constant 'base_year' dollars
+#
+# The constant dollar unit values use the deflator implied by unit_value
+# and unit_value_1998 (in 1998 dollars).  The deflator of the base year is
+# the median of those of all minerals, so that every mineral is re-based
+# with the same price index.  Returns (names, titles, values) where values
+# has the shape (minerals, years, names).
+
+INDICATOR_WINDOW = 5
+
+def derive_indicators(years, variables, values, window=INDICATOR_WINDOW, base_year=VINTAGE-1):
+
+    values = np.asarray(values, dtype=np.float64)
+    nminerals, nyears, nvariables = values.shape
+    names = []
+    titles = []
+    columns = []
+
+    def column(name):
+        if name in variables:
+            return values[:,:,variables.index(name)]
+        return np.empty((nminerals, nyears)) * np.nan
+
+    # Growth from the previous year
+    previous = np.empty_like(values) * np.nan
+    previous[:,1:,:] = values[:,:-1,:]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        growth = 100 * (values / previous - 1)
+    growth[~np.isfinite(growth)] = np.nan
+
+    # Trailing means over complete windows, from cumulative sums along the years
+    present = ~np.isnan(values)
+    sums = np.zeros((nminerals, nyears+1, nvariables))
+    counts = np.zeros((nminerals, nyears+1, nvariables))
+    sums[:,1:,:] = np.cumsum(np.where(present, values, 0.0), axis=1)
+    counts[:,1:,:] = np.cumsum(present, axis=1)
+    means = np.empty_like(values) * np.nan
+    if nyears >= window:
+        complete = (counts[:,window:,:] - counts[:,:-window,:]) == window
+        window_means = (sums[:,window:,:] - sums[:,:-window,:]) / window
+        means[:,window-1:,:] = np.where(complete, window_means, np.nan)
+
+    for col, variable in enumerate(variables):
+        names += [variable + '_growth', variable + '_mean%d' % window]
+        titles += [variable.replace('_', ' ').capitalize() + ' growth (%)',
+                   variable.replace('_', ' ').capitalize() + ' %d year mean' % window]
+        columns += [growth[:,:,col], means[:,:,col]]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        share = 100 * column('production') / column('world_production')
+        deflator = column('unit_value') / column('unit_value_1998')
+        share[~np.isfinite(share)] = np.nan
+        deflator[~np.isfinite(deflator) | (deflator <= 0)] = np.nan
+    names.append('world_share')
+    titles.append('Share of world production (%)')
+    columns.append(share)
+
+    base = np.nonzero(np.asarray(years) == base_year)[0]
+    base_deflator = np.nan
+    if len(base) and not np.isnan(deflator[:,base[0]]).all():
+        base_deflator = np.nanmedian(deflator[:,base[0]])
+    names.append('unit_value_%d' % base_year)
+    titles.append('Unit value (%d$/t)' % (base_year % 100))
+    columns.append(column('unit_value_1998') * base_deflator)
+
+    return names, titles, np.dstack(columns)
+
+
+########################################
+# write_indicators
+# 
+# Derives the indicators of the supply tables in 'tables', a list of
+# (mineral, kind, mineral_csv) as for write_store(), and writes them to
+# 'mineral_indicators.csv' next to each table in the same layout.  Only
+# indicators with at least one value for a mineral are written.
+
+def write_indicators(tables, vintage=VINTAGE, window=INDICATOR_WINDOW, base_year=None):
+
+    if base_year is None:
+        base_year = vintage - 1
+    supply = [(mineral, mineral_csv) for mineral, kind, mineral_csv in tables if kind == 'supply']
+    minerals, years, variables, values = build_cube(supply)
+    names, titles, indicators = derive_indicators(years, variables, values, window, base_year)
+
+    for i, (mineral, mineral_csv) in enumerate(supply):
+        cols = [col for col in range(0,len(names)) if not np.isnan(indicators[i,:,col]).all()]
+        data = indicators[i][:,cols]
+        missing = np.isnan(data)
+        path = os.path.join(os.path.dirname(mineral_csv), mineral + '_indicators.csv')
+        lines = ["DC.title      = Indicators derived from the ASCII CSV version of " + mineral + ".xls file\n",
+                 "file URL      = http://mazamascience.com/Minerals/USGS/DS140/%d/" % vintage + mineral + "_indicators.csv\n",
+                 "original data = http://mazamascience.com/Minerals/USGS/DS140/%d/" % vintage + mineral + ".csv\n",
+                 "units         = metric tons unless otherwise noted\n",
+                 "\n",
+                 ','.join(['"Year"'] + ['"' + titles[col] + '"' for col in cols]) + "\n",
+                 ','.join(['year'] + [names[col] for col in cols]) + "\n"]
+        for year, row, row_missing in zip(years.tolist(), data.tolist(), missing.tolist()):
+            lines.append(format_row([year] + [None if m else value for value, m in zip(row, row_missing)]))
+        write_atomic(path, lines)
+
+    print("Wrote indicators for %d minerals" % len(supply))
+
+
+################################################################################
+
+# Minerals whose 'mineral.xls' files are converted with convert_file()
+MINERALS = [
+    'abrasivesmanufactured',
+    'abrasivesnatural',
+    'agriculture',
+    'aluminum',
+    'antimony',
+    'arsenic',
+    'asbestos',
+    'barite',
+    'bauxitealumina',
+    'beryllium',
+    'bismuth',
+    'boron',
+    'bromine',
+    'cadmium',
+    'cement',
+    'cesium',
+    'chromium',
+    'clay',
+    'coalcombustionproducts',
+    'cobalt',
+    ### 'columbium', ### Switched to 'niobium'
+    'copper',
+    'diamondindustrial',
+    'diatomite',
+    'feldspar',
+    'fluorspar',
+    'gallium',
+    'garnet',
+    'gemstones',
+    'germanium',
+    'gold',
+    'graphite',
+    'gypsum',
+    'hafnium',
+    'helium',
+    'indium',
+    'iodine',
+    'ironore',
+    'ironoxide',
+    'ironsteelscrap',
+    'ironsteelslag',
+    'ironsteel',
+    'kyanite',
+    'lead',
+    'lime',
+    'lithium',
+    'magnesiumcompounds',
+    'magnesium',
+    'manganese',
+    'mercury',
+    'micascrap',
+    'micasheet',
+    'molybdenum',
+    'nickel',
+    'niobium',
+    'nitrogen',
+    'organics',
+    'peat',
+    'perlite',
+    'phosphate',
+    'platinum',
+    'potash',
+    'pumice',
+    'quartzcrystal',
+    'rareearths',
+    'rhenium',
+    'salt',
+    'sandgravelconstruction',
+    'sandgravelindustrial',
+    'selenium',
+    'silicon',
+    'silver',
+    'sodaash',
+    'sodiumsulfate',
+    'stonecrushed',
+    'stonedimension',
+    'strontium',
+    'sulfur',
+    'talc',
+    'tantalum',
+    'tellurium',
+    'thallium',
+    'thorium',
+    'tin',
+    'titaniumdioxide',
+    'titaniummineral',
+    'titanium',
+    'tungsten',
+    'vanadium',
+    'vermiculite',
+    'wollastonite',
+    'wood',
+    'zinc',
+    'zirconium',
+]
+
+# Minerals whose 'mineral-use.xls' files are converted with convert_use_file()
+USE_MINERALS = [
+    'aluminum-use',
+    'antimony-use',
+    'arsenic-use',
+    'asbestos-use',
+    'bauxite-use',
+    'beryllium-use',
+    'bismuth-use',
+    ### 'boron-use',
+    'cadmium-use',
+    ### 'cement-use',
+    'chromium-use',
+    'claysball-use',
+    'claysbentonite-use',
+    'claysfire-use',
+    'claysfullers-use',
+    ### 'clayskaolin-use',
+    ### 'claysmisc-use',
+    'cobalt-use',
+    'columbium-use',
+    'copper-use',
+    'diamondindustrial-use',
+    'diatomite-use',
+    'feldspar-use',
+    'fluorspar-use',
+    'gallium-use',
+    'garnet-use',
+    'germanium-use',
+    'gold-use',
+    'graphite-use',
+    ### 'gypsum-use',
+    'helium-use',
+    'indium-use',
+    'ironore-use',
+    'ironoxide-use',
+    ### 'ironsteelslag-use',
+    'ironsteel-use',
+    'lead-use',
+    'lime-use',
+    'magnesiumcompounds-use',
+    'magnesium-use',
+    'manganese-use',
+    ### 'mercury-use',
+    'mica-use',
+    'molybdenum-use',
+    'nickel-use',
+    'nitrogen-use',
+    'peat-use',
+    'perlite-use',
+    'phosphate-use',
+    'pumice-use',
+    'salt-use',
+    'sandgravelconstruction-use',
+    ### 'sandgravelindustrial-use',
+    'selenium-use',
+    'silicon-use',
+    'silver-use',
+    ### 'sodaash-use',
+    'stonecrushed-use',
+    ### 'stonedimension-use',
+    'strontium-use',
+    'sulfur-use',
+    'talc-use',
+    'tantalum-use',
+    'tellurium-use',
+    'tin-use',
+    'titaniumdioxide-use',
+    'titanium-use',
+    'tungsten-use',
+    'vanadium-use',
+    'zinc-use',
+]
+
+
+########################################
+# diff_tables
+# 
+# Compares two versions of a table, each a (names, data) pair as returned
+# by read_csv(), and yields the changes from 'old' to 'new' cell by cell:
+#
+#   {"op": "add_column", "variable": ...}
+#   {"op": "remove_column", "variable": ...}
+#   {"op": "add_year", "year": ..., "values": {variable: value, ...}}
+#   {"op": "remove_year", "year": ...}
+#   {"op": "revise", "year": ..., "variable": ..., "old": ..., "new": ...}
+#
+# Years count as present when they have at least one value, so the rows of
+# missing values the converters pad the tables with never show up.  Missing
+# values are None.  Revisions are only reported for the years and variables
+# present in both versions.  Blank and repeated column names are handled
+# by variable_columns(), as for the other outputs.
+
+def json_value(value):
+    if np.isnan(value):
+        return None
+    return float(value)
+
+def diff_tables(old, new):
+
+    # Only the columns picked by variable_columns() are compared
+    old_cols = [0] + variable_columns(old[0])
+    new_cols = [0] + variable_columns(new[0])
+    old_names, old_data = [old[0][col] for col in old_cols], old[1][:,old_cols]
+    new_names, new_data = [new[0][col] for col in new_cols], new[1][:,new_cols]
+
+    for name in new_names[1:]:
+        if name not in old_names:
+            yield {'op': 'add_column', 'variable': name}
+    for name in old_names[1:]:
+        if name not in new_names:
+            yield {'op': 'remove_column', 'variable': name}
+
+    old_years = old_data[:,0].astype(int)
+    new_years = new_data[:,0].astype(int)
+    old_present = ~np.isnan(old_data[:,1:]).all(axis=1)
+    new_present = ~np.isnan(new_data[:,1:]).all(axis=1)
+
+    for row in np.nonzero(new_present & ~np.in1d(new_years, old_years[old_present]))[0]:
+        values = dict((new_names[col], float(new_data[row,col]))
+                      for col in range(1,len(new_names)) if not np.isnan(new_data[row,col]))
+        yield {'op': 'add_year', 'year': int(new_years[row]), 'values': values}
+    for row in np.nonzero(old_present & ~np.in1d(old_years, new_years[new_present]))[0]:
+        yield {'op': 'remove_year', 'year': int(old_years[row])}
+
+    years = np.intersect1d(old_years[old_present], new_years[new_present])
+    common = [name for name in new_names[1:] if name in old_names]
+    if len(years) == 0 or len(common) == 0:
+        return
+    old_index = dict(zip(old_years.tolist(), range(len(old_years))))
+    new_index = dict(zip(new_years.tolist(), range(len(new_years))))
+    old_cells = old_data[np.ix_([old_index[year] for year in years], [old_names.index(name) for name in common])]
+    new_cells = new_data[np.ix_([new_index[year] for year in years], [new_names.index(name) for name in common])]
+    same = (old_cells == new_cells) | (np.isnan(old_cells) & np.isnan(new_cells))
+    for row, col in zip(*np.nonzero(~same)):
+        yield {'op': 'revise', 'year': int(years[row]), 'variable': common[col],
+               'old': json_value(old_cells[row,col]), 'new': json_value(new_cells[row,col])}
+
+
+# Yields the changes to the tables of 'jobs' between the vintages converted
+# in 'old_directory' and 'new_directory' as JSON lines.  Every record also
+# has the mineral and kind of its table; tables found in only one of the
+# directories are recorded as {"op": "add_table"} or {"op": "remove_table"}.
+# The number of records of each op is added to 'counts'.
+def diff_lines(jobs, old_directory, new_directory, counts=None):
+    if counts is None:
+        counts = {}
+    for converter, mineral in jobs:
+        old_csv = os.path.join(old_directory, mineral + '.csv')
+        new_csv = os.path.join(new_directory, mineral + '.csv')
+        if os.path.exists(old_csv) and os.path.exists(new_csv):
+            old_titles, old_names, old_data = read_csv(old_csv)
+            new_titles, new_names, new_data = read_csv(new_csv)
+            records = diff_tables((old_names, old_data), (new_names, new_data))
+        elif os.path.exists(new_csv):
+            records = [{'op': 'add_table'}]
+        elif os.path.exists(old_csv):
+            records = [{'op': 'remove_table'}]
         else:
-            break;
-
-        # From help(xlrd):
-        #   XL_CELL_EMPTY   = 0
-        #   XL_CELL_TEXT    = 1
-        #   XL_CELL_NUMBER  = 2
-        #   XL_CELL_DATE    = 3
-        #   XL_CELL_BOOLEAN = 4
-        #   XL_CELL_ERROR   = 5
-        #   XL_CELL_BLANK   = 6
-
-        # Validate and fix the data in the cells of this row.
-        for col in range(0,colhi):
+            continue
+        for record in records:
+            record['mineral'] = base_mineral(mineral)
+            record['kind'] = table_kind(converter)
+            counts[record['op']] = counts.get(record['op'], 0) + 1
+            yield json.dumps(record, sort_keys=True) + '\n'
 
-            # Empty cells are converted to 'na'.
-            if types[col] == xlrd.XL_CELL_EMPTY:
-                values[col] = 'na'
-                types[col] = xlrd.XL_CELL_TEXT
-
-            # Cells with text are converted directly to float.
-            elif types[col] == xlrd.XL_CELL_TEXT:
-
-                value = values[col].strip()
-
-                # Catch non-empty cells with a blank space in them
-                if len(value) == 0:
-                    values[col] = 'na'
-                    types[col] = xlrd.XL_CELL_TEXT
-
-                # Special case for various worksheets which use 'W' for 'Withheld' values
-                elif value == 'W':
-                    values[col] = 'na'
-                    types[col] = xlrd.XL_CELL_TEXT
-                    print("Converting row %d, column %d to 'na'" % (row,col))
-
-                # Special case for strontium.xls (and others) which uses 'NA' instead of XL_CELL_EMPTY
-                elif value == 'NA':
-                    values[col] = 'na'
-                    types[col] = xlrd.XL_CELL_TEXT
-                    print("Converting row %d, column %d to 'na'" % (row,col))
-
-                # Everything else we convert to float
-                else: 
-                    if value == 'NA':
-                        values[col] = 'na'
-                        types[col] = xlrd.XL_CELL_TEXT
-                        print("Converting row %d, column %d to 'na'" % (row,col))
-                    elif value == 'W':
-                        values[col] = 'na'
-                        types[col] = xlrd.XL_CELL_TEXT
-                        print("Converting row %d, column %d to 'na'" % (row,col))
-                    else:
-                        try:
-                            values[col] = float(value)
-                            types[col] = xlrd.XL_CELL_NUMBER
-                        except:
-                            print("Cannot convert value '%s' to float in row %d, col %d" % (value,row+1,col+1))
-
-            # Cells with numbers do not need conversion.
-            elif types[col] == xlrd.XL_CELL_NUMBER:
-                pass
-
-            # Cells of any other type are considered errors.
-            else:
-                print("UNKNOWN data type in row %d, col %d" % (row,col))
-                print("    cell type = " + str(types[col]))
-                sys.exit(1)
-        """
-    # Special case for beryllium which is missing the row for the year 2000.
-    # Before we write out the results for 2001, insert the 2000 results -- all missing values
-    if (mineral == 'beryllium') and (year == 2001):
-      csv.write("2000")
-      for col in range(1,colhi):
-        csv.write(",\"na\"")
-      csv.write("\n")
-    """
-        # Print out the values with appropriate formatting.
-        for col in range(0,colhi):
 
-            if types[col] == xlrd.XL_CELL_NUMBER:
-                if col == 0: # Year
-                    csv.write("%d" % int(values[col]))
-                else:
-                    csv.write(",%.1f" % values[col])
+########################################
+# convert_worker
+# 
+# Runs in a batch worker process.  Each worker converts whole workbooks
+# and writes xlrd messages to its own log file so that the log streams
+# of concurrently running workers never interleave.  The worker logs are
+# named after the log of the run and the process id of its parent, and
+# merge_worker_logs() appends them to that log once the pool has finished.
+
+worker_logfile = None
+worker_vintage = VINTAGE
+
+# Returns the name of the worker logs of this run, with '%d' for the worker
+# process id
+def worker_log_name(logfile):
+    return '%s_%d_worker%%d.log' % (os.path.splitext(logfile.name)[0], os.getpid())
+
+# Appends the worker logs named 'log_name' to 'logfile' and removes them
+def merge_worker_logs(log_name, logfile):
+    prefix, suffix = log_name.split('%d')
+    for path in sorted(glob.glob(prefix + '[0-9]*' + suffix)):
+        with open(path) as f:
+            text = f.read()
+        if text:
+            print >> logfile, "*** Log of worker %s" % path[len(prefix):-len(suffix)]
+            logfile.write(text)
+        os.remove(path)
+    logfile.flush()
+
+def init_worker(log_name, mmap, vintage=VINTAGE, source=None):
+    global worker_logfile, worker_vintage, use_mmap, workbook_source
+    worker_logfile = open(log_name % os.getpid(), 'w')
+    worker_vintage = vintage
+    use_mmap = mmap
+    # Every worker opens the source itself: archive handles can't be shared
+    workbook_source = open_source(source) if source else None
+
+# With 'in_memory' set the CSV text is returned to the parent rather than
+# written to a file.  Returns (mineral, record, text, error) where 'error'
+# describes a failed conversion and is None otherwise.
+def convert_worker(job):
+    converter, mineral, in_memory = job
+    out = StringIO.StringIO() if in_memory else None
+    try:
+        record = converter(mineral, worker_logfile, worker_vintage, out)
+    except Exception as e:
+        # Failures are handed back as text: the exception itself may not
+        # survive pickling and must not take the pool down with it.
+        return mineral, None, None, error_text(e)
+    finally:
+        worker_logfile.flush()
+    return mineral, record, out.getvalue() if out is not None else None, None
 
-            elif types[col] == xlrd.XL_CELL_TEXT:
-                csv.write(",\"%s\"" % values[col])
 
-            else:
-                print("UNKNOWN cell_type %d in column %d" % (types[col],col))
-                sys.exit(1)
+########################################
+# Conversion state
+# 
+# The state file records, for every CSV file written, the SHA-1 of the
+# workbook it was converted from, the converter used and the version of
+# the conversion rules and the vintage:
+#
+#   {"tin.csv": {"xls_sha1": ..., "converter": "convert_file", "version": 1, "vintage": 2011}}
+#
+# An incremental run skips every job whose signature matches the state.
+
+def file_sha1(path):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(64 * 1024)
+            if not chunk:
+                break
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+def load_state(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def save_state(state, path):
+    write_atomic(path, [json.dumps(state, indent=1, sort_keys=True)])
+
+def job_signature(converter, mineral, vintage=VINTAGE):
+    mineral_xls = workbook_path(mineral)
+    if not workbook_exists(mineral_xls):
+        return None
+    return {'xls_sha1': workbook_sha1(mineral_xls),
+            'converter': converter.__name__,
+            'version': CONVERSION_VERSION,
+            'vintage': vintage}
 
 
-        csv.write("\n")
+########################################
+# Journal
+# 
+# Records the progress of a batch on disk as it happens, one line of JSON
+# for every change in the status of a workbook:
+#
+#   {"mineral": "tin", "status": "pending"}
+#   {"mineral": "tin", "status": "failed", "error": "ValueError: ..."}
+#   {"mineral": "tin", "status": "done"}
+#
+# Every line is flushed and synced before the batch moves on so that the
+# journal survives a crash or a killed run.  The last line of a mineral
+# gives its status; a line cut short by a crash is ignored.  With 'resume'
+# set the statuses of the previous run are read back (and the journal
+# compacted to one line per mineral), otherwise the journal starts empty.
+
+class Journal(object):
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.status = {}
+        self.errors = {}
+        if resume and os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.status[entry['mineral']] = entry['status']
+                    self.errors[entry['mineral']] = entry.get('error')
+        write_atomic(path, [self.line(mineral, self.status[mineral], self.errors[mineral]) + '\n'
+                            for mineral in sorted(self.status)])
+        self.file = open(path, 'a')
+
+    def line(self, mineral, status, error=None):
+        entry = {'mineral': mineral, 'status': status}
+        if error is not None:
+            entry['error'] = error
+        return json.dumps(entry, sort_keys=True)
+
+    def record(self, mineral, status, error=None):
+        self.file.write(self.line(mineral, status, error) + '\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.status[mineral] = status
+        self.errors[mineral] = error
+
+    def done(self, mineral):
+        return self.status.get(mineral) == 'done'
+
+    def failed(self):
+        return sorted(mineral for mineral, status in self.status.items() if status == 'failed')
+
+    def close(self):
+        self.file.close()
+
+# One line description of a failed conversion
+def error_text(e):
+    return "%s: %s" % (e.__class__.__name__, e)
 
-    # Check first year and fill in missing values if first year > 1975
-    last_year = 2020
-    year += 1
-    while (year <= last_year):
-        for col in range(0,colhi):
-            if col == 0:
-                csv.write('%d' % year)
+
+########################################
+# convert_batch
+# 
+# Converts a list of (converter, mineral) jobs.  With a single worker the
+# jobs run in this process in order, exactly as before.  With more workers
+# the jobs are spread over a pool of processes.  Every job writes its own
+# CSV file so the output is identical to a serial run.
+#
+# If a 'state' dictionary is passed in it is updated with the signature of
+# every converted workbook.  With 'incremental' set, jobs whose workbook,
+# converter and conversion version match the state and whose CSV file
+# still exists are skipped.
+#
+# If an ArchiveWriter is passed as 'archive' the CSV files are written into
+# it instead of the working directory.
+#
+# A workbook that fails to convert is reported and logged and the batch
+# carries on with the next one.  If a Journal is passed in the status of
+# every workbook is recorded in it, and workbooks it already lists as done
+# whose CSV file still exists are skipped, so a rerun only converts the
+# workbooks that failed or were never finished.  Workbooks skipped as
+# unchanged by an incremental run are recorded as done.
+#
+# Returns the Metrics records of the converted workbooks.  If 'metrics_file'
+# is given each record is also written to it as a line of JSON as soon as
+# the workbook is finished.
+
+def convert_batch(jobs, logfile, workers=1, state=None, incremental=False, metrics_file=None,
+                  vintage=VINTAGE, archive=None, journal=None):
+
+    if journal is not None:
+        pending = []
+        for converter, mineral in jobs:
+            if journal.done(mineral) and (archive is not None or os.path.exists(mineral + '.csv')):
+                print("Skipping " + mineral + " workbook (done)")
+                continue
+            pending.append((converter, mineral))
+        jobs = pending
+
+    signatures = {}
+    if state is not None:
+        pending = []
+        for converter, mineral in jobs:
+            signature = job_signature(converter, mineral, vintage)
+            mineral_csv = mineral + '.csv'
+            if incremental and signature is not None and \
+               state.get(mineral_csv) == signature and os.path.exists(mineral_csv):
+                print("Skipping " + mineral + " workbook (unchanged)")
+                if journal is not None:
+                    journal.record(mineral, 'done')
+                continue
+            signatures[mineral] = signature
+            pending.append((converter, mineral))
+        jobs = pending
+
+    if journal is not None:
+        for converter, mineral in jobs:
+            journal.record(mineral, 'pending')
+
+    records = []
+
+    def finished(mineral, record, text=None):
+        if text is not None:
+            archive.add(mineral + '.csv', text)
+        if state is not None and signatures.get(mineral) is not None:
+            state[mineral + '.csv'] = signatures[mineral]
+        records.append(record)
+        if metrics_file is not None:
+            metrics_file.write(json.dumps(record, sort_keys=True) + '\n')
+            metrics_file.flush()
+        if journal is not None:
+            journal.record(mineral, 'done')
+
+    def failed(mineral, error):
+        print("*** Conversion of %s failed: %s" % (workbook_path(mineral), error))
+        print >> logfile, "*** Conversion of %s failed: %s" % (workbook_path(mineral), error)
+        logfile.flush()
+        if journal is not None:
+            journal.record(mineral, 'failed', error)
+
+    if workers <= 1:
+        for converter, mineral in jobs:
+            out = StringIO.StringIO() if archive is not None else None
+            try:
+                record = converter(mineral, logfile, vintage, out)
+            except Exception as e:
+                failed(mineral, error_text(e))
+                continue
+            finished(mineral, record, out.getvalue() if out is not None else None)
+        return records
+
+    log_name = worker_log_name(logfile)
+    source = workbook_source.path if workbook_source is not None else None
+    pool = multiprocessing.Pool(workers, init_worker, (log_name, use_mmap, vintage, source))
+    try:
+        jobs = [(converter, mineral, archive is not None) for converter, mineral in jobs]
+        for mineral, record, text, error in pool.imap_unordered(convert_worker, jobs, 1):
+            if error is not None:
+                failed(mineral, error)
             else:
-                csv.write(',"na"')
-        csv.write('\n')
-        year += 1
+                finished(mineral, record, text)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+        merge_worker_logs(log_name, logfile)
+    return records
 
-    print("Finished with " + mineral + " workbook.")
+
+########################################
+# print_summary
+# 
+# Prints the totals of a list of Metrics records and the slowest workbooks.
+
+PHASES = ['open', 'header', 'clean', 'write']
+
+def print_summary(records, slowest=5):
+    if not records:
+        print("No workbooks converted.")
+        return
+    totals = dict((phase, sum(record['phases'].get(phase, 0.0) for record in records)) for phase in PHASES)
+    print("Converted %d workbooks: %d rows, %d cells, %d missing, %d substitutions, %d unconverted" %
+          (len(records), sum(record['rows'] for record in records), sum(record['cells'] for record in records),
+           sum(record['missing'] for record in records), sum(record['substitutions'] for record in records),
+           sum(record['unconverted'] for record in records)))
+    print("Workbook time %.3f s (%s)" %
+          (sum(record['seconds'] for record in records),
+           ', '.join("%s %.3f" % (phase, totals[phase]) for phase in PHASES)))
+    if 'max_rss_kb' in records[0]:
+        print("Peak RSS %d kB" % max(record['max_rss_kb'] for record in records))
+    print("Slowest workbooks:")
+    for record in sorted(records, key=lambda record: record['seconds'], reverse=True)[:slowest]:
+        print("  %-28s %.3f s (%s)" % (record['mineral'], record['seconds'],
+              ', '.join("%s %.3f" % (phase, record['phases'].get(phase, 0.0)) for phase in PHASES)))
+
+
+########################################
+# Watchers
+# 
+# A watcher's wait() blocks for up to 'timeout' seconds and returns the
+# names of the files in 'directory' that may have changed.  InotifyWatcher
+# is woken by the kernel and needs the pyinotify module; PollWatcher
+# compares the size and modification time of every file on each call.
+
+class PollWatcher(object):
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.stats = self.scan()
+
+    def scan(self):
+        stats = {}
+        for name in os.listdir(self.directory):
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue                      # removed while scanning
+            stats[name] = (stat.st_size, stat.st_mtime)
+        return stats
+
+    def wait(self, timeout):
+        time.sleep(timeout)
+        stats = self.scan()
+        changed = [name for name in stats if self.stats.get(name) != stats[name]]
+        self.stats = stats
+        return changed
+
+class InotifyWatcher(object):
+
+    def __init__(self, directory):
+        import pyinotify
+        self.changed = set()
+        watcher = self
+        class Handler(pyinotify.ProcessEvent):
+            def process_default(self, event):
+                watcher.changed.add(event.name)
+        self.manager = pyinotify.WatchManager()
+        self.notifier = pyinotify.Notifier(self.manager, Handler())
+        self.manager.add_watch(directory, pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MODIFY |
+                               pyinotify.IN_MOVED_TO | pyinotify.IN_CREATE)
+
+    def wait(self, timeout):
+        if self.notifier.check_events(int(timeout * 1000)):
+            self.notifier.read_events()
+            self.notifier.process_events()
+        changed = list(self.changed)
+        self.changed = set()
+        return changed
+
+def open_watcher(directory):
+    try:
+        return InotifyWatcher(directory)
+    except ImportError:
+        return PollWatcher(directory)
+
+
+########################################
+# watch
+# 
+# Runs until interrupted, reconverting a workbook of 'jobs' whenever it
+# changes in the working directory.  A changed workbook is only converted
+# once its size and modification time have stayed the same for 'debounce'
+# seconds, so that files still being copied in are left alone.  The
+# converter is picked from the '-use' suffix of the file name.  Every
+# conversion is an incremental convert_batch() so that files touched
+# without changing their content are skipped; the state is saved after
+# each one.  Failures are logged and the watch carries on.
+
+WATCH_DEBOUNCE = 2.0
+
+def watch(jobs, logfile, state, state_path, debounce=WATCH_DEBOUNCE, metrics_file=None, vintage=VINTAGE,
+          interval=1.0):
+
+    minerals = set(mineral for converter, mineral in jobs)
+    watcher = open_watcher('.')
+    print("Watching %s for changed workbooks (%s)" % (os.getcwd(), watcher.__class__.__name__))
+
+    def convert(mineral):
+        converter = convert_use_file if mineral.endswith('-use') else convert_file
+        convert_batch([(converter, mineral)], logfile, 1, state, True, metrics_file, vintage)
+        logfile.flush()
+        save_state(state, state_path)
+
+    # Catch up with workbooks changed while nobody was watching
+    for converter, mineral in jobs:
+        if workbook_exists(workbook_path(mineral)):
+            convert(mineral)
+
+    pending = {}                                  # name -> ((size, mtime), time first seen)
+    while True:
+        for name in watcher.wait(interval if pending else max(interval, debounce)):
+            mineral, extension = os.path.splitext(name)
+            if extension in ('.xls', '.xlsx') and mineral in minerals:
+                pending.setdefault(name, None)
+
+        now = time.time()
+        for name in list(pending):
+            try:
+                stat = os.stat(name)
+            except OSError:
+                del pending[name]                 # removed or renamed away
+                continue
+            signature = (stat.st_size, stat.st_mtime)
+            if pending[name] is None or pending[name][0] != signature:
+                pending[name] = (signature, now)
+            elif now - pending[name][1] >= debounce:
+                del pending[name]
+                convert(os.path.splitext(name)[0])
 
 
 ################################################################################
 
 def main():
 
-    logfile = open('Mazama_2011.log', 'w')
-
-    # Convert the 'mineral.xls' files
-    convert_file('abrasivesmanufactured',logfile)
-    convert_file('abrasivesnatural',logfile)
-    convert_file('agriculture',logfile)
-    convert_file('aluminum',logfile)
-    convert_file('antimony',logfile)
-    convert_file('arsenic',logfile)
-    convert_file('asbestos',logfile)
-    convert_file('barite',logfile)
-    convert_file('bauxitealumina',logfile)
-    convert_file('beryllium',logfile)
-    convert_file('bismuth',logfile)
-    convert_file('boron',logfile)
-    convert_file('bromine',logfile)
-    convert_file('cadmium',logfile)
-    convert_file('cement',logfile)
-    convert_file('cesium',logfile)
-    convert_file('chromium',logfile)
-    convert_file('clay',logfile)
-    convert_file('coalcombustionproducts',logfile)
-    convert_file('cobalt',logfile)
-    ### convert_file('columbium',logfile) ### Switched to 'niobium'
-    convert_file('copper',logfile)
-    convert_file('diamondindustrial',logfile)
-    convert_file('diatomite',logfile)
-    convert_file('feldspar',logfile)
-    convert_file('fluorspar',logfile)
-    convert_file('gallium',logfile)
-    convert_file('garnet',logfile)
-    convert_file('gemstones',logfile)
-    convert_file('germanium',logfile)
-    convert_file('gold',logfile)
-    convert_file('graphite',logfile)
-    convert_file('gypsum',logfile)
-    convert_file('hafnium',logfile)
-    convert_file('helium',logfile)
-    convert_file('indium',logfile)
-    convert_file('iodine',logfile)
-    convert_file('ironore',logfile)
-    convert_file('ironoxide',logfile)
-    convert_file('ironsteelscrap',logfile)
-    convert_file('ironsteelslag',logfile)
-    convert_file('ironsteel',logfile)
-    convert_file('kyanite',logfile)
-    convert_file('lead',logfile)
-    convert_file('lime',logfile)
-    convert_file('lithium',logfile)
-    convert_file('magnesiumcompounds',logfile)
-    convert_file('magnesium',logfile)
-    convert_file('manganese',logfile)
-    convert_file('mercury',logfile)
-    convert_file('micascrap',logfile)
-    convert_file('micasheet',logfile)
-    convert_file('molybdenum',logfile)
-    convert_file('nickel',logfile)
-    convert_file('niobium',logfile)
-    convert_file('nitrogen',logfile)
-    convert_file('organics',logfile)
-    convert_file('peat',logfile)
-    convert_file('perlite',logfile)
-    convert_file('phosphate',logfile)
-    convert_file('platinum',logfile)
-    convert_file('potash',logfile)
-    convert_file('pumice',logfile)
-    convert_file('quartzcrystal',logfile)
-    convert_file('rareearths',logfile)
-    convert_file('rhenium',logfile)
-    convert_file('salt',logfile)
-    convert_file('sandgravelconstruction',logfile)
-    convert_file('sandgravelindustrial',logfile)
-    convert_file('selenium',logfile)
-    convert_file('silicon',logfile)
-    convert_file('silver',logfile)
-    convert_file('sodaash',logfile)
-    convert_file('sodiumsulfate',logfile)
-    convert_file('stonecrushed',logfile)
-    convert_file('stonedimension',logfile)
-    convert_file('strontium',logfile)
-    convert_file('sulfur',logfile)
-    convert_file('talc',logfile)
-    convert_file('tantalum',logfile)
-    convert_file('tellurium',logfile)
-    convert_file('thallium',logfile)
-    convert_file('thorium',logfile)
-    convert_file('tin',logfile)
-    convert_file('titaniumdioxide',logfile)
-    convert_file('titaniummineral',logfile)
-    convert_file('titanium',logfile)
-    convert_file('tungsten',logfile)
-    convert_file('vanadium',logfile)
-    convert_file('vermiculite',logfile)
-    convert_file('wollastonite',logfile)
-    convert_file('wood',logfile)
-    convert_file('zinc',logfile)
-    convert_file('zirconium',logfile)
-
-    # Convert the 'mineral-use.xls' files
-    convert_use_file('aluminum-use',logfile)
-    convert_use_file('antimony-use',logfile)
-    convert_use_file('arsenic-use',logfile)
-    convert_use_file('asbestos-use',logfile)
-    convert_use_file('bauxite-use',logfile)
-    convert_use_file('beryllium-use',logfile)
-    convert_use_file('bismuth-use',logfile)
-    ###convert_use_file('boron-use',logfile)
-    convert_use_file('cadmium-use',logfile)
-    ###convert_use_file('cement-use',logfile)
-    convert_use_file('chromium-use',logfile)
-    convert_use_file('claysball-use',logfile)
-    convert_use_file('claysbentonite-use',logfile)
-    convert_use_file('claysfire-use',logfile)
-    convert_use_file('claysfullers-use',logfile)
-    ###convert_use_file('clayskaolin-use',logfile)
-    ###convert_use_file('claysmisc-use',logfile)
-    convert_use_file('cobalt-use',logfile)
-    convert_use_file('columbium-use',logfile)
-    convert_use_file('copper-use',logfile)
-    convert_use_file('diamondindustrial-use',logfile)
-    convert_use_file('diatomite-use',logfile)
-    convert_use_file('feldspar-use',logfile)
-    convert_use_file('fluorspar-use',logfile)
-    convert_use_file('gallium-use',logfile)
-    convert_use_file('garnet-use',logfile)
-    convert_use_file('germanium-use',logfile)
-    convert_use_file('gold-use',logfile)
-    convert_use_file('graphite-use',logfile)
-    ###convert_use_file('gypsum-use',logfile)
-    convert_use_file('helium-use',logfile)
-    convert_use_file('indium-use',logfile)
-    convert_use_file('ironore-use',logfile)
-    convert_use_file('ironoxide-use',logfile)
-    ###convert_use_file('ironsteelslag-use',logfile)
-    convert_use_file('ironsteel-use',logfile)
-    convert_use_file('lead-use',logfile)
-    convert_use_file('lime-use',logfile)
-    convert_use_file('magnesiumcompounds-use',logfile)
-    convert_use_file('magnesium-use',logfile)
-    convert_use_file('manganese-use',logfile)
-    ###convert_use_file('mercury-use',logfile)
-    convert_use_file('mica-use',logfile)
-    convert_use_file('molybdenum-use',logfile)
-    convert_use_file('nickel-use',logfile)
-    convert_use_file('nitrogen-use',logfile)
-    convert_use_file('peat-use',logfile)
-    convert_use_file('perlite-use',logfile)
-    convert_use_file('phosphate-use',logfile)
-    convert_use_file('pumice-use',logfile)
-    convert_use_file('salt-use',logfile)
-    convert_use_file('sandgravelconstruction-use',logfile)
-    ###convert_use_file('sandgravelindustrial-use',logfile)
-    convert_use_file('selenium-use',logfile)
-    convert_use_file('silicon-use',logfile)
-    convert_use_file('silver-use',logfile)
-    ###convert_use_file('sodaash-use',logfile)
-    convert_use_file('stonecrushed-use',logfile)
-    ###convert_use_file('stonedimension-use',logfile)
-    convert_use_file('strontium-use',logfile)
-    convert_use_file('sulfur-use',logfile)
-    convert_use_file('talc-use',logfile)
-    convert_use_file('tantalum-use',logfile)
-    convert_use_file('tellurium-use',logfile)
-    convert_use_file('tin-use',logfile)
-    convert_use_file('titaniumdioxide-use',logfile)
-    convert_use_file('titanium-use',logfile)
-    convert_use_file('tungsten-use',logfile)
-    convert_use_file('vanadium-use',logfile)
-    convert_use_file('zinc-use',logfile)
+    global use_mmap, workbook_source
+
+    parser = optparse.OptionParser(usage="usage: %prog [options]")
+    parser.add_option("-j", "--jobs", type="int", dest="jobs", default=1,
+                      help="number of worker processes (0 = one per CPU) [default: %default]")
+    parser.add_option("-i", "--incremental", action="store_true", dest="incremental", default=False,
+                      help="skip workbooks that have not changed since the last run")
+    parser.add_option("-v", "--vintage", dest="vintages", default=str(VINTAGE),
+                      help="comma separated DS140 vintages to convert [default: %default]")
+    parser.add_option("-d", "--directory", dest="directory", default=None,
+                      help="directory with one subdirectory of workbooks per vintage "
+                           "[default: the current directory for a single vintage]")
+    parser.add_option("-s", "--state", dest="state", default=None,
+                      help="conversion state file [default: Mazama_VINTAGE_state.json]")
+    parser.add_option("-r", "--resume", action="store_true", dest="resume", default=False,
+                      help="only convert the workbooks the last run's journal does not list as done")
+    parser.add_option("--no-mmap", action="store_false", dest="use_mmap", default=bool(use_mmap),
+                      help="read workbooks into memory instead of through a memory map")
+    parser.add_option("--store", dest="store", default=None,
+                      help="also write all tables to this Parquet (or .feather) file")
+    parser.add_option("--cube", dest="cube", default=None, metavar="PREFIX",
+                      help="also write the tables of each kind as a NumPy cube to PREFIX_KIND.npy")
+    parser.add_option("--sqlite", dest="sqlite", default=None,
+                      help="also load all tables into this SQLite database")
+    parser.add_option("--indicators", action="store_true", dest="indicators", default=False,
+                      help="also write derived indicators to MINERAL_indicators.csv")
+    parser.add_option("--metrics", dest="metrics", default=None,
+                      help="file to write per-workbook metrics to as JSON lines [default: Mazama_VINTAGE_metrics.jsonl]")
+    parser.add_option("-a", "--archive", dest="archive", default=None,
+                      help="read workbooks from this zip or tar archive, or cache directory, "
+                           "instead of the working directory")
+    parser.add_option("--fill-cache", dest="fill_cache", default=None, metavar="DIRECTORY",
+                      help="only copy the workbooks into the cache DIRECTORY for use with --archive")
+    parser.add_option("-o", "--output-archive", dest="output_archive", default=None,
+                      help="write the CSV files into this .zip or .tar[.gz] archive instead of the working directory")
+    parser.add_option("-w", "--watch", action="store_true", dest="watch", default=False,
+                      help="keep running and reconvert workbooks as they change")
+    parser.add_option("--debounce", type="float", dest="debounce", default=WATCH_DEBOUNCE,
+                      help="seconds a changed workbook must be left alone before it is converted [default: %default]")
+    parser.add_option("--stdout", dest="stdout", default=None, metavar="MINERAL",
+                      help="only write the CSV version of MINERAL.xls to stdout")
+    (options, args) = parser.parse_args()
+
+    use_mmap = options.use_mmap
+
+    try:
+        vintages = sorted(set(int(vintage) for vintage in options.vintages.split(',')))
+    except ValueError:
+        parser.error("invalid vintage list: %s" % options.vintages)
+
+    # The other outputs are built from the CSV files in the working directory
+    if options.output_archive and (options.incremental or options.resume or options.store or options.cube or
+                                   options.indicators or options.sqlite or len(vintages) > 1):
+        parser.error("--output-archive can't be combined with --incremental, --resume, --store, --cube, "
+                     "--indicators, --sqlite or several vintages")
+
+    # An archive holds the workbooks of one vintage
+    if options.archive and len(vintages) > 1:
+        parser.error("--archive can't be combined with several vintages")
+
+    if options.archive:
+        workbook_source = open_source(os.path.abspath(options.archive))
+
+    if options.stdout:
+        logfile = open('Mazama_%d.log' % vintages[-1], 'w')
+        write_rows(options.stdout, stream(options.stdout, logfile, vintage=vintages[-1]), sys.stdout, vintages[-1])
+        return
+
+    workers = options.jobs
+    if workers <= 0:
+        workers = multiprocessing.cpu_count()
+
+    jobs = [(convert_file, mineral) for mineral in MINERALS] + \
+           [(convert_use_file, mineral) for mineral in USE_MINERALS]
+
+    # A cache directory indexes workbooks by name so it holds a single vintage
+    if options.fill_cache:
+        if len(vintages) > 1 or options.archive or options.output_archive or options.watch:
+            parser.error("--fill-cache copies the workbooks of a single vintage in a directory")
+        cache_directory = os.path.abspath(options.fill_cache)
+        if options.directory:
+            os.chdir(os.path.join(options.directory, str(vintages[0])))
+        paths = [workbook_path(mineral) for converter, mineral in jobs if workbook_exists(workbook_path(mineral))]
+        if not os.path.exists(cache_directory):
+            os.makedirs(cache_directory)
+        cache_workbooks(paths, cache_directory)
+        print("Copied %d workbooks into %s" % (len(paths), cache_directory))
+        return
+
+    if options.watch:
+        if len(vintages) > 1 or options.archive or options.output_archive:
+            parser.error("--watch works on the workbooks of a single vintage in a directory")
+        vintage = vintages[0]
+        if options.directory:
+            os.chdir(os.path.join(options.directory, str(vintage)))
+        logfile = open('Mazama_%d.log' % vintage, 'w')
+        state_path = options.state or 'Mazama_%d_state.json' % vintage
+        metrics_file = open(options.metrics or 'Mazama_%d_metrics.jsonl' % vintage, 'a')
+        try:
+            watch(jobs, logfile, load_state(state_path), state_path, options.debounce, metrics_file, vintage)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            metrics_file.close()
+        return
+
+    # Each vintage is converted in its own directory, where its log, state
+    # and metrics files are written too.
+    root = os.getcwd()
+    if options.directory is None and len(vintages) == 1:
+        directories = [root]
+    else:
+        directories = [os.path.join(root, options.directory or '.', str(vintage)) for vintage in vintages]
+
+    failures = []
+    for vintage, directory in zip(vintages, directories):
+        if len(vintages) > 1:
+            print("Converting vintage %d in %s" % (vintage, directory))
+        os.chdir(directory)
+        try:
+            logfile = open('Mazama_%d.log' % vintage, 'a' if options.resume else 'w')
+            state_path = options.state or 'Mazama_%d_state.json' % vintage
+            metrics_file = open(options.metrics or 'Mazama_%d_metrics.jsonl' % vintage, 'a' if options.resume else 'w')
+            journal = Journal('Mazama_%d_journal.jsonl' % vintage, options.resume)
+            if options.output_archive:
+                archive = ArchiveWriter(options.output_archive)
+                try:
+                    records = convert_batch(jobs, logfile, workers, None, False, metrics_file, vintage, archive,
+                                            journal)
+                except:
+                    archive.abort()
+                    raise
+                finally:
+                    metrics_file.close()
+                    journal.close()
+                archive.close()
+            else:
+                state = load_state(state_path)
+                try:
+                    records = convert_batch(jobs, logfile, workers, state, options.incremental, metrics_file, vintage,
+                                            None, journal)
+                finally:
+                    save_state(state, state_path)
+                    metrics_file.close()
+                    journal.close()
+
+            print_summary(records)
+            failed = journal.failed()
+            if failed:
+                print("%d workbooks failed: %s" % (len(failed), ', '.join(failed)))
+                print("Rerun with --resume to convert only these")
+                failures += failed
+
+            # Tables of failed workbooks are left out even if an older CSV file exists
+            tables = [(mineral, table_kind(converter), mineral + '.csv') for converter, mineral in jobs
+                      if mineral not in failed and os.path.exists(mineral + '.csv')]
+            if options.store:
+                write_store(tables, options.store)
+            if options.cube:
+                write_cube(tables, options.cube, vintage)
+            if options.indicators:
+                write_indicators(tables, vintage)
+            if options.sqlite:
+                write_sqlite(tables, options.sqlite)
+        finally:
+            os.chdir(root)
+
+    # Changes between consecutive vintages are written next to the vintage directories
+    for i in range(1,len(vintages)):
+        diff_path = os.path.join(root, options.directory or '.', 'DS140_diff_%d_%d.jsonl' % (vintages[i-1], vintages[i]))
+        counts = {}
+        write_atomic(diff_path, diff_lines(jobs, directories[i-1], directories[i], counts))
+        print("Changes from %d to %d: %s" % (vintages[i-1], vintages[i],
+              ', '.join("%d %s" % (counts[op], op) for op in sorted(counts)) or 'none'))
+
+    if failures:
+        sys.exit(1)
 
 ################################################################################
 
@@ -0,0 +1,195 @@
+#!/usr/bin/python
+
+"""
+bench_DS140.py
+
+A script to measure the throughput of the converters in
+Mazama_USGS_DS140_2011.py without the real USGS files.
+
+Synthetic workbooks shaped like the DS140 spreadsheets are written to a
+temporary directory: a few lines of title text, a header row starting
+with 'Year' (at a varying row), numeric data mixed with 'W', 'NA', blank
+and text-typed numbers, and a footnote below the data.  Both the
+'mineral.xls' and the 'mineral-use.xls' layouts are generated.
+
+Each converter is timed end to end and per phase (open, header scan,
+cleaning and writing) as reported by its Metrics.  The results are
+written as JSON.
+
+The xlwt module is needed to write the synthetic workbooks.
+"""
+
+import sys, os, time, json, random, shutil, tempfile, platform
+import optparse
+import xlrd, xlwt
+import numpy as np
+
+import Mazama_USGS_DS140_2011 as DS140
+
+SUPPLY_TITLES = ['Production', 'Imports', 'Exports', 'Stocks', 'Apparent consumption',
+                 'Unit value ($/t)', 'Unit value (98$/t)', 'World production']
+
+
+########################################
+# make_workbook
+#
+# Writes a synthetic workbook to 'path' with 'nrows' years of data in
+# 'ncols' columns (including Year).  A fraction 'sentinels' of the data
+# cells are 'W', 'NA', blank or text-typed numbers.
+
+def make_workbook(path, use=False, header_row=4, nrows=110, ncols=9, first_year=1900,
+                  sentinels=0.2, seed=0):
+
+    rand = random.Random(seed)
+    workbook = xlwt.Workbook()
+    sheet = workbook.add_sheet('Sheet1')
+    sheet.write(0, 0, 'Synthetic statistics')
+    sheet.write(1, 0, '[Metric tons unless otherwise noted]')
+
+    titles = ['Year']
+    for col in range(1,ncols):
+        if use:
+            titles.append('End use %d' % col)
+        else:
+            titles.append(SUPPLY_TITLES[(col-1) % len(SUPPLY_TITLES)] + ' ' * ((col-1) // len(SUPPLY_TITLES)))
+    for col, title in enumerate(titles):
+        sheet.write(header_row, col, title)
+
+    for row in range(0,nrows):
+        rowx = header_row + 1 + row
+        sheet.write(rowx, 0, float(first_year + row))
+        for col in range(1,ncols):
+            r = rand.random()
+            if r >= sentinels:
+                sheet.write(rowx, col, rand.random() * 1e6)
+                continue
+            r = r / sentinels
+            if r < 0.25:
+                pass                                            # empty cell
+            elif r < 0.45:
+                sheet.write(rowx, col, 'W')
+            elif r < 0.65:
+                sheet.write(rowx, col, 'NA')
+            elif r < 0.75:
+                sheet.write(rowx, col, ' ')
+            else:
+                sheet.write(rowx, col, ' %d ' % rand.randint(0, 100000))
+
+    sheet.write(header_row + nrows + 2, 0, 'Footnote: synthetic data.')
+    workbook.save(path)
+
+
+# Writes 'count' workbooks of each layout into 'directory' and returns the
+# names of the supply and use minerals.
+def make_workbooks(directory, count, nrows, ncols, seed=0):
+    minerals = []
+    use_minerals = []
+    for i in range(0,count):
+        mineral = 'synthetic%03d' % i
+        make_workbook(os.path.join(directory, mineral + '.xls'),
+                      header_row=3 + i % 4, nrows=nrows, ncols=ncols, seed=seed+i)
+        minerals.append(mineral)
+        use_mineral = mineral + '-use'
+        make_workbook(os.path.join(directory, use_mineral + '.xls'), use=True,
+                      header_row=3 + i % 4, nrows=max(1, nrows - 75), ncols=ncols,
+                      first_year=1975, seed=seed+count+i)
+        use_minerals.append(use_mineral)
+    return minerals, use_minerals
+
+
+########################################
+# bench_converter
+#
+# Runs 'converter' over all 'minerals' 'repeat' times and returns the best
+# total time together with the phase times and counts the converter
+# reported for that repetition.
+
+def bench_converter(converter, minerals, logfile, repeat):
+    best = None
+    for i in range(0,repeat):
+        start = time.time()
+        records = [converter(mineral, logfile) for mineral in minerals]
+        total = time.time() - start
+
+        if best is None or total < best['total_seconds']:
+            phases = dict((phase, sum(record['phases'].get(phase, 0.0) for record in records))
+                          for phase in DS140.PHASES)
+            best = {'converter': converter.__name__,
+                    'workbooks': len(minerals),
+                    'total_seconds': total,
+                    'seconds_per_workbook': total / max(1, len(minerals)),
+                    'phase_seconds': phases,
+                    'rows': sum(record['rows'] for record in records),
+                    'cells': sum(record['cells'] for record in records),
+                    'substitutions': sum(record['substitutions'] for record in records)}
+    return best
+
+
+################################################################################
+
+def main():
+
+    parser = optparse.OptionParser(usage="usage: %prog [options]")
+    parser.add_option("-n", "--workbooks", type="int", dest="workbooks", default=20,
+                      help="number of workbooks of each layout [default: %default]")
+    parser.add_option("-r", "--rows", type="int", dest="rows", default=110,
+                      help="years of data per supply workbook [default: %default]")
+    parser.add_option("-c", "--columns", type="int", dest="columns", default=9,
+                      help="columns per workbook, including Year [default: %default]")
+    parser.add_option("--repeat", type="int", dest="repeat", default=3,
+                      help="number of timed repetitions [default: %default]")
+    parser.add_option("-o", "--output", dest="output", default="bench_DS140.json",
+                      help="file to write results to [default: %default]")
+    parser.add_option("-k", "--keep", dest="keep", default=None,
+                      help="generate the workbooks in this directory and keep them")
+    (options, args) = parser.parse_args()
+
+    output = os.path.abspath(options.output)
+    if options.keep:
+        directory = os.path.abspath(options.keep)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+    else:
+        directory = tempfile.mkdtemp(prefix='bench_DS140_')
+
+    cwd = os.getcwd()
+    stdout = sys.stdout
+    try:
+        minerals, use_minerals = make_workbooks(directory, options.workbooks, options.rows, options.columns)
+        os.chdir(directory)
+        logfile = open('bench.log', 'w')
+
+        # The converters print a line at the start and end of every workbook
+        sys.stdout = open(os.devnull, 'w')
+        results = [bench_converter(DS140.convert_file, minerals, logfile, options.repeat),
+                   bench_converter(DS140.convert_use_file, use_minerals, logfile, options.repeat)]
+    finally:
+        sys.stdout = stdout
+        os.chdir(cwd)
+        if not options.keep:
+            shutil.rmtree(directory)
+
+    report = {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'python': platform.python_version(),
+              'xlrd': xlrd.__VERSION__,
+              'numpy': np.__version__,
+              'conversion_version': DS140.CONVERSION_VERSION,
+              'parameters': {'workbooks': options.workbooks,
+                             'rows': options.rows,
+                             'columns': options.columns,
+                             'repeat': options.repeat},
+              'results': results}
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=1, sort_keys=True)
+
+    for result in results:
+        phases = result['phase_seconds']
+        print("%-16s %3d workbooks %8.3f s  (open %.3f, header %.3f, clean %.3f, write %.3f)" %
+              (result['converter'], result['workbooks'], result['total_seconds'],
+               phases['open'], phases['header'], phases['clean'], phases['write']))
+    print("Results written to " + output)
+
+################################################################################
+
+if __name__ == "__main__":
+    main()
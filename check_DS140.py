@@ -0,0 +1,141 @@
+#!/usr/bin/python
+
+"""
+check_DS140.py
+
+Checks the supply balance of every mineral converted by
+Mazama_USGS_DS140_2011.py:
+
+  production + imports - exports + stock decrease = apparent consumption
+
+The stock decrease of a year is the previous year's stocks minus this
+year's and is only taken into account where a 'stocks' column has values
+for both years.  Years missing any of the other four values are not checked.
+
+All minerals and years are checked at once on the (minerals, years,
+variables) cube of the supply tables.  The cube is read from a file written
+with the --cube option of the converter when one is given, otherwise it is
+built from the CSV files.  Every year whose residual exceeds the tolerance,
+relative to the larger of apparent consumption and the expected value, is
+reported, worst first.  The script exits with status 1 if there are any.
+"""
+
+import sys, time
+import optparse
+import numpy as np
+
+import DS140
+import Mazama_USGS_DS140_2011 as Mazama
+
+BALANCE = ['production', 'imports', 'exports', 'apparent_consumption']
+
+REPORT_COLUMNS = ['mineral', 'year', 'production', 'imports', 'exports', 'stock_decrease',
+                  'apparent_consumption', 'expected', 'residual', 'relative_error']
+
+
+########################################
+# supply_balance
+#
+# Checks the cube 'values' with axes 'minerals', 'years' and 'variables'.
+# Returns a dictionary of arrays, one per REPORT_COLUMNS entry, with one
+# element per anomaly sorted by decreasing relative error, together with
+# the number of mineral years that could be checked.
+
+def supply_balance(minerals, years, variables, values, tolerance=0.05):
+
+    def column(name):
+        if name in variables:
+            return np.asarray(values[:,:,variables.index(name)], dtype=np.float64)
+        return np.full(values.shape[:2], np.nan)
+
+    production, imports, exports, consumption = [column(name) for name in BALANCE]
+    stocks = column('stocks')
+    stock_decrease = np.zeros_like(stocks)
+    stock_decrease[:,1:] = stocks[:,:-1] - stocks[:,1:]
+    stock_decrease[np.isnan(stock_decrease)] = 0.0
+
+    expected = production + imports - exports + stock_decrease
+    residual = consumption - expected
+    scale = np.fmax(np.abs(consumption), np.abs(expected))
+    checked = ~np.isnan(residual)
+
+    relative = np.zeros_like(residual)
+    nonzero = checked & (np.nan_to_num(scale) > 0)
+    relative[nonzero] = np.abs(residual[nonzero]) / scale[nonzero]
+
+    rows, cols = np.nonzero(checked & (relative > tolerance))
+    order = np.argsort(-relative[rows, cols], kind='mergesort')
+    rows, cols = rows[order], cols[order]
+
+    report = {'mineral': np.array(minerals, dtype=object)[rows],
+              'year': np.asarray(years)[cols],
+              'production': production[rows, cols],
+              'imports': imports[rows, cols],
+              'exports': exports[rows, cols],
+              'stock_decrease': stock_decrease[rows, cols],
+              'apparent_consumption': consumption[rows, cols],
+              'expected': expected[rows, cols],
+              'residual': residual[rows, cols],
+              'relative_error': relative[rows, cols]}
+    return report, int(checked.sum())
+
+
+# Returns (minerals, years, variables, values) for the supply tables
+def load_cube(directory, prefix=None):
+    if prefix:
+        cube = DS140.load_cube('supply', prefix, directory)
+        return cube.minerals, cube.years, cube.variables, cube.values
+    tables = [(mineral, DS140.csv_path(mineral, 'supply', directory))
+              for mineral in DS140.list_minerals('supply', directory)]
+    return Mazama.build_cube(tables)
+
+# Yields the lines of the report as CSV
+def report_lines(report):
+    yield ','.join(REPORT_COLUMNS) + '\n'
+    for i in range(0,len(report['mineral'])):
+        cells = [report['mineral'][i], '%d' % report['year'][i]]
+        cells += ['%.1f' % report[name][i] for name in REPORT_COLUMNS[2:-1]]
+        cells.append('%.4f' % report['relative_error'][i])
+        yield ','.join(cells) + '\n'
+
+
+################################################################################
+
+def main():
+
+    parser = optparse.OptionParser(usage="usage: %prog [options]")
+    parser.add_option("-d", "--directory", dest="directory", default=".",
+                      help="directory with the converted CSV files [default: %default]")
+    parser.add_option("-c", "--cube", dest="cube", default=None, metavar="PREFIX",
+                      help="read the supply cube from PREFIX_supply.npy instead of the CSV files")
+    parser.add_option("-t", "--tolerance", type="float", dest="tolerance", default=0.05,
+                      help="largest acceptable relative error [default: %default]")
+    parser.add_option("-o", "--output", dest="output", default="DS140_balance.csv",
+                      help="file to write the anomaly report to [default: %default]")
+    parser.add_option("-n", "--top", type="int", dest="top", default=20,
+                      help="number of anomalies to print [default: %default]")
+    (options, args) = parser.parse_args()
+
+    start = time.time()
+    minerals, years, variables, values = load_cube(options.directory, options.cube)
+    loaded = time.time()
+    report, checked = supply_balance(minerals, years, variables, values, options.tolerance)
+    finished = time.time()
+
+    Mazama.write_atomic(options.output, report_lines(report))
+
+    count = len(report['mineral'])
+    print("Checked %d mineral years of %d minerals: %d anomalies above %g (load %.3f s, check %.3f s)" %
+          (checked, len(minerals), count, options.tolerance, loaded - start, finished - loaded))
+    for i in range(0,min(count, options.top)):
+        print("  %-20s %d  expected %14.1f  apparent consumption %14.1f  error %6.1f%%" %
+              (report['mineral'][i], report['year'][i], report['expected'][i],
+               report['apparent_consumption'][i], 100 * report['relative_error'][i]))
+    if count:
+        print("Report written to " + options.output)
+        sys.exit(1)
+
+################################################################################
+
+if __name__ == "__main__":
+    main()
@@ -2,18 +2,471 @@
 #
 # Python script to download all Excel spreadsheets that make up the USGS dataset:
 #   "Historical Statistics for Mineral Commodoties in the United States, Data Series 2005-140"
+#
+# Files are fetched by a small pool of worker threads.  Each worker keeps its own
+# keep-alive HTTP connections open between requests, failed requests are retried
+# with exponential backoff and every file is written to a partial file that is
+# only renamed into place once it is complete and its size (and digest, when the
+# server sends one) has been checked.  An interrupted run therefore never leaves
+# a truncated .xls file behind.
+#
+# A partial file is kept together with a small journal recording the URL, the
+# validators of the response and the number of bytes safely on disk.  The next
+# attempt, or the next run, resumes the transfer with an HTTP Range request.
+#
+# A manifest of ETag, Last-Modified, size and SHA-1 for every file is kept in the
+# download directory.  Requests are made conditional on that information so that
+# files which have not changed since the last run are not transferred again.  The
+# minerals whose content actually changed are recorded in the manifest.
 
 import urllib
+import httplib, urlparse
+import os, sys, time, socket, tempfile
+import hashlib, json, base64, re
+import threading, Queue
+import optparse
 from BeautifulSoup import BeautifulSoup
 
 location = "http://minerals.usgs.gov/ds/2005/140/"
-page = urllib.urlopen(location)
-soup = BeautifulSoup(page)
-    
-# Find every occurrence of <a href="...">XLS</a> and download the file pointed to by href="...".
-for link in soup.findAll('a'):
-    if link.string == 'XLS':
-        filename = link.get('href')
-        print("Retrieving " + filename)
-        url = location + filename
-        urllib.urlretrieve(url,filename)
+
+# Status codes for which a request is worth repeating
+RETRY_STATUS = (408, 429, 500, 502, 503, 504)
+
+REDIRECT_STATUS = (301, 302, 303, 307, 308)
+
+CHUNK_SIZE = 64 * 1024
+
+MANIFEST_NAME = 'DS140_manifest.json'
+
+# Bytes received between updates of the progress journal of a partial file
+JOURNAL_INTERVAL = 16 * CHUNK_SIZE
+
+
+# Raised for failures that are worth retrying
+class FetchError(Exception):
+    pass
+
+# Raised for HTTP responses that will not improve on retry (eg. 404)
+class HTTPStatusError(Exception):
+    pass
+
+
+########################################
+# get_links
+#
+# Returns the filename of every <a href="...">XLS</a> link on the index page.
+
+def get_links(location):
+    page = urllib.urlopen(location)
+    soup = BeautifulSoup(page)
+    filenames = []
+    for link in soup.findAll('a'):
+        if link.string == 'XLS':
+            filenames.append(link.get('href'))
+    return filenames
+
+
+########################################
+# Fetcher
+#
+# Issues GET requests over persistent connections.  One Fetcher is used by
+# each worker thread; connections are pooled per (scheme, host) and reused
+# for every file that worker downloads.
+
+class Fetcher(object):
+
+    def __init__(self, timeout=60):
+        self.timeout = timeout
+        self.connections = {}
+
+    def connection(self, scheme, netloc):
+        key = (scheme, netloc)
+        if key not in self.connections:
+            if scheme == 'https':
+                self.connections[key] = httplib.HTTPSConnection(netloc, timeout=self.timeout)
+            else:
+                self.connections[key] = httplib.HTTPConnection(netloc, timeout=self.timeout)
+        return self.connections[key]
+
+    def discard(self, scheme, netloc):
+        conn = self.connections.pop((scheme, netloc), None)
+        if conn is not None:
+            conn.close()
+
+    def close(self):
+        for conn in self.connections.values():
+            conn.close()
+        self.connections = {}
+
+    # Returns an open httplib.HTTPResponse whose body has not been read yet.
+    # Redirects are followed; the final URL is available as response.url.
+    def get(self, url, headers=None, max_redirects=5):
+        for hop in range(max_redirects + 1):
+            parts = urlparse.urlsplit(url)
+            path = parts.path or '/'
+            if parts.query:
+                path += '?' + parts.query
+            conn = self.connection(parts.scheme, parts.netloc)
+            try:
+                conn.request('GET', path, headers=headers or {})
+                response = conn.getresponse()
+            except (socket.error, httplib.HTTPException):
+                # A keep-alive connection may have been closed by the server
+                self.discard(parts.scheme, parts.netloc)
+                raise
+            if response.status in REDIRECT_STATUS:
+                response.read()
+                url = urlparse.urljoin(url, response.getheader('location'))
+                continue
+            response.url = url
+            return response
+        raise FetchError("Too many redirects for %s" % url)
+
+
+########################################
+# Manifest
+#
+# The manifest is a JSON file with one entry per downloaded file:
+#
+#   {"files": {"tin.xls": {"etag": ..., "last_modified": ..., "size": ..., "sha1": ...}},
+#    "changed": ["tin", ...]}
+
+def load_manifest(path):
+    if not os.path.exists(path):
+        return {'files': {}, 'changed': []}
+    with open(path) as f:
+        manifest = json.load(f)
+    manifest.setdefault('files', {})
+    manifest.setdefault('changed', [])
+    return manifest
+
+def save_manifest(manifest, path):
+    save_json(manifest, path)
+
+def save_json(data, path):
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix='.' + os.path.basename(path) + '.', dir=directory)
+    with os.fdopen(fd, 'w') as out:
+        json.dump(data, out, indent=1, sort_keys=True)
+    if os.name == 'nt' and os.path.exists(path):
+        os.remove(path)
+    os.rename(tmp_path, path)
+
+def file_sha1(path):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+# Returns True if the file at 'path' is still the one described by 'entry'.
+def is_current(entry, path):
+    if not entry or not os.path.exists(path):
+        return False
+    if os.path.getsize(path) != entry.get('size'):
+        return False
+    return file_sha1(path) == entry.get('sha1')
+
+
+########################################
+# Partial files
+#
+# A transfer in progress is written to '.name.part' next to its destination.
+# The journal '.name.part.json' describes it:
+#
+#   {"url": ..., "etag": ..., "last_modified": ..., "size": ..., "received": ...}
+#
+# 'size' is the full length of the file (None if unknown) and 'received' the
+# number of bytes of the partial file that have been flushed to disk.
+
+def part_paths(path):
+    directory, name = os.path.split(os.path.abspath(path))
+    part_path = os.path.join(directory, '.' + name + '.part')
+    return part_path, part_path + '.json'
+
+# Returns the journal of a partial download of 'url' or None
+def load_journal(journal_path, url):
+    if not os.path.exists(journal_path):
+        return None
+    try:
+        with open(journal_path) as f:
+            journal = json.load(f)
+    except ValueError:
+        return None
+    if journal.get('url') != url:
+        return None
+    return journal
+
+def discard_part(path):
+    for part in part_paths(path):
+        if os.path.exists(part):
+            os.remove(part)
+
+# Returns (first byte, full length) from a 'bytes first-last/length' header
+def parse_content_range(value):
+    match = re.match(r'bytes\s+(\d+)-(\d+)/(\d+|\*)', value or '')
+    if not match:
+        raise FetchError("Invalid Content-Range: %r" % value)
+    size = match.group(3)
+    return int(match.group(1)), int(size) if size != '*' else None
+
+# Returns a dictionary of expected digests of the whole file: hashlib
+# algorithm name -> raw digest.  A Digest header (RFC 3230) describes the
+# whole file even in a 206 response, Content-MD5 only the body sent.
+def expected_digests(response, partial):
+    digests = {}
+    for item in (response.getheader('digest') or '').split(','):
+        algorithm, sep, value = item.strip().partition('=')
+        algorithm = {'sha': 'sha1', 'sha-256': 'sha256', 'md5': 'md5'}.get(algorithm.lower())
+        if algorithm and value:
+            digests[algorithm] = base64.b64decode(value)
+    if not partial and response.getheader('content-md5'):
+        digests.setdefault('md5', base64.b64decode(response.getheader('content-md5')))
+    return digests
+
+
+########################################
+# save_response
+#
+# Streams a response body into the partial file of 'path', appending to the
+# first journal['received'] bytes already there.  The journal is updated
+# every JOURNAL_INTERVAL bytes and when the transfer fails so that it never
+# claims more than is on disk.  Once the full length has arrived and the
+# digests check out the file is renamed into place and the journal removed.
+# Returns (nbytes, sha1).
+
+def save_response(response, path, journal, digests=None):
+    part_path, journal_path = part_paths(path)
+    offset = journal['received']
+    hashes = dict((algorithm, hashlib.new(algorithm)) for algorithm in set(['sha1']) | set(digests or {}))
+
+    with open(part_path, 'r+b' if offset else 'wb') as out:
+        # Hash what is already there and drop anything past the journal
+        while out.tell() < offset:
+            chunk = out.read(min(CHUNK_SIZE, offset - out.tell()))
+            if not chunk:
+                raise FetchError("Partial file %s is shorter than its journal" % part_path)
+            for h in hashes.values():
+                h.update(chunk)
+        out.truncate(offset)
+        nbytes = offset
+        try:
+            while True:
+                chunk = response.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                out.write(chunk)
+                for h in hashes.values():
+                    h.update(chunk)
+                nbytes += len(chunk)
+                if nbytes - journal['received'] >= JOURNAL_INTERVAL:
+                    out.flush()
+                    os.fsync(out.fileno())
+                    journal['received'] = nbytes
+                    save_json(journal, journal_path)
+        finally:
+            out.flush()
+            os.fsync(out.fileno())
+            journal['received'] = nbytes
+            save_json(journal, journal_path)
+
+    if journal.get('size') is not None and nbytes != journal['size']:
+        raise FetchError("Truncated transfer: got %d of %d bytes" % (nbytes, journal['size']))
+    for algorithm, digest in (digests or {}).items():
+        if hashes[algorithm].digest() != digest:
+            discard_part(path)
+            raise FetchError("%s digest mismatch for %s" % (algorithm, path))
+
+    if os.name == 'nt' and os.path.exists(path):
+        os.remove(path)
+    os.rename(part_path, path)
+    os.remove(journal_path)
+    return nbytes, hashes['sha1'].hexdigest()
+
+
+########################################
+# download_file
+#
+# Downloads a single file, retrying with exponential backoff on network
+# errors and transient server errors.  If 'entry' is the manifest entry of
+# an intact local copy the request is made conditional and a 304 response
+# leaves the file alone.  A partial file left by an earlier attempt is
+# resumed with a Range request, guarded by If-Range so that a file changed
+# on the server in the meantime is downloaded from the start.  Returns the
+# new manifest entry.
+
+def download_file(fetcher, url, path, retries=3, backoff=1.0, entry=None):
+    part_path, journal_path = part_paths(path)
+    conditional = {}
+    if is_current(entry, path):
+        if entry.get('etag'):
+            conditional['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            conditional['If-Modified-Since'] = entry['last_modified']
+    attempt = 0
+    while True:
+        try:
+            headers = dict(conditional)
+            journal = load_journal(journal_path, url)
+            validator = journal and (journal.get('etag') or journal.get('last_modified'))
+            if journal and journal.get('received') and validator and os.path.exists(part_path):
+                headers['Range'] = 'bytes=%d-' % journal['received']
+                headers['If-Range'] = validator
+            else:
+                journal = None
+
+            response = fetcher.get(url, headers)
+            if response.status == 304 and conditional:
+                response.read()
+                discard_part(path)
+                return entry
+            if response.status == 416 and journal is not None:
+                # The partial file no longer matches the file on the server
+                response.read()
+                discard_part(path)
+                raise FetchError("Range not satisfiable for %s" % url)
+            if response.status == 206 and journal is not None:
+                first, size = parse_content_range(response.getheader('content-range'))
+                if first != journal['received']:
+                    response.read()
+                    raise FetchError("Server resumed %s at byte %d instead of %d" % (url, first, journal['received']))
+                if size is not None:
+                    journal['size'] = size
+                print("Resuming %s at byte %d" % (url, first))
+            elif response.status == 200:
+                length = response.getheader('content-length')
+                journal = {'url': url,
+                           'etag': response.getheader('etag'),
+                           'last_modified': response.getheader('last-modified'),
+                           'size': int(length) if length is not None else None,
+                           'received': 0}
+                save_json(journal, journal_path)
+            else:
+                response.read()
+                if response.status in RETRY_STATUS:
+                    raise FetchError("HTTP %d for %s" % (response.status, url))
+                raise HTTPStatusError("HTTP %d for %s" % (response.status, url))
+
+            nbytes, sha1 = save_response(response, path, journal, expected_digests(response, response.status == 206))
+            return {'etag': journal['etag'],
+                    'last_modified': journal['last_modified'],
+                    'size': nbytes,
+                    'sha1': sha1}
+        except (socket.error, httplib.HTTPException, FetchError) as e:
+            parts = urlparse.urlsplit(url)
+            fetcher.discard(parts.scheme, parts.netloc)
+            if attempt >= retries:
+                raise
+            delay = backoff * (2 ** attempt)
+            print("Retrying %s in %.1f seconds (%s)" % (url, delay, e))
+            time.sleep(delay)
+            attempt += 1
+
+
+########################################
+# download_all
+#
+# Downloads 'filenames' relative to 'location' into 'directory' using
+# 'workers' threads and updates 'manifest' in place.  Returns a list of
+# (filename, error) for failures.
+
+def download_all(filenames, location, directory='.', workers=4, retries=3, backoff=1.0, manifest=None):
+
+    if manifest is None:
+        manifest = {'files': {}, 'changed': []}
+    files = manifest['files']
+    changed = []
+
+    queue = Queue.Queue()
+    for filename in filenames:
+        queue.put(filename)
+
+    failures = []
+    lock = threading.Lock()
+
+    def worker():
+        fetcher = Fetcher()
+        try:
+            while True:
+                try:
+                    filename = queue.get_nowait()
+                except Queue.Empty:
+                    return
+                url = urlparse.urljoin(location, filename)
+                name = os.path.basename(filename)
+                path = os.path.join(directory, name)
+                old_entry = files.get(name)
+                try:
+                    entry = download_file(fetcher, url, path, retries, backoff, old_entry)
+                    with lock:
+                        files[name] = entry
+                        if entry is old_entry:
+                            print("Unchanged " + filename)
+                        elif old_entry is None or entry['sha1'] != old_entry.get('sha1'):
+                            changed.append(os.path.splitext(name)[0])
+                            print("Retrieved " + filename)
+                        else:
+                            print("Retrieved " + filename + " (content unchanged)")
+                except Exception as e:
+                    with lock:
+                        failures.append((filename, e))
+                    print("*** Failed to retrieve %s: %s" % (filename, e))
+        finally:
+            fetcher.close()
+
+    threads = [threading.Thread(target=worker) for i in range(max(1, workers))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        # join() with a timeout keeps the main thread responsive to Ctrl-C
+        while thread.is_alive():
+            thread.join(1.0)
+
+    manifest['changed'] = sorted(changed)
+    return failures
+
+
+################################################################################
+
+def main():
+
+    parser = optparse.OptionParser(usage="usage: %prog [options]")
+    parser.add_option("-l", "--location", dest="location", default=location,
+                      help="URL of the DS140 index page [default: %default]")
+    parser.add_option("-d", "--directory", dest="directory", default=".",
+                      help="directory to save files in [default: %default]")
+    parser.add_option("-j", "--jobs", type="int", dest="jobs", default=4,
+                      help="number of concurrent downloads [default: %default]")
+    parser.add_option("-r", "--retries", type="int", dest="retries", default=3,
+                      help="number of retries per file [default: %default]")
+    parser.add_option("-m", "--manifest", dest="manifest", default=None,
+                      help="manifest file [default: DIRECTORY/%s]" % MANIFEST_NAME)
+    parser.add_option("-f", "--force", action="store_true", dest="force", default=False,
+                      help="ignore the manifest and download every file")
+    (options, args) = parser.parse_args()
+
+    manifest_path = options.manifest or os.path.join(options.directory, MANIFEST_NAME)
+    if options.force:
+        manifest = {'files': {}, 'changed': []}
+    else:
+        manifest = load_manifest(manifest_path)
+
+    # Find every occurrence of <a href="...">XLS</a> and download the file pointed to by href="...".
+    filenames = get_links(options.location)
+    failures = download_all(filenames, options.location, options.directory,
+                            options.jobs, options.retries, manifest=manifest)
+    save_manifest(manifest, manifest_path)
+
+    print("%d files changed: %s" % (len(manifest['changed']), ' '.join(manifest['changed'])))
+
+    if failures:
+        sys.exit(1)
+
+################################################################################
+
+if __name__ == "__main__":
+    main()
@@ -11,338 +11,186 @@ The xlrd module (0.6.0a1 or higher) for reading Excel files  must
 be installed before this script can be run.  It is available at:
 
   http://www.lexicon.net/sjmachin/xlrd.htm
+
+Run without options, the script audits the header rows of all 'mineral.xls'
+files.  Only the header row of each workbook is examined, workbooks are read
+by a pool of worker processes and the names found are cached by the SHA-1 of
+each file so that unchanged workbooks are not opened again.  A coverage
+matrix of minerals and variables is written as CSV and JSON.
 """
 
-import xlrd
-import sys, re
+import os, json
+import multiprocessing, optparse
+import Mazama_USGS_DS140_2011 as Mazama
+from Mazama_USGS_DS140_2011 import find_header_row, open_workbook, release_workbook, harmonize_titles, workbook_path
+
 
 ########################################
-# get_row_data
+# read_names
 # 
-# Reads part of a row of numeric data from a worksheet, converting
-# string values to float where appropriate.
-#
-# From help(xlrd):
-#   XL_CELL_EMPTY   = 0
-#   XL_CELL_TEXT    = 1
-#   XL_CELL_NUMBER  = 2
-#   XL_CELL_DATE    = 3
-#   XL_CELL_BOOLEAN = 4
-#   XL_CELL_ERROR   = 5
-#   XL_CELL_BLANK   = 6
-
-def get_row_data(workbook, sheet, row, colhi):
-  result = []
-  row_types = sheet.row_types(row)
-  row_values = sheet.row_values(row)
-
-  # Go through every cell in this row and check it's type.
-  for col in range(0,colhi):
-    cell_type = row_types[col]
-    cell_value = row_values[col]
-
-    # Empty cells are converted to 'na'.
-    if cell_type == xlrd.XL_CELL_EMPTY:
-      value = "na"
-      cell_type = xlrd.XL_CELL_TEXT
-
-    # Cells with text are converted directly to float.
-    elif cell_type == xlrd.XL_CELL_TEXT:
-      value = cell_value
-      value = float(cell_value)
-      cell_type = xlrd.XL_CELL_NUMBER
-
-    # Cells with numbers do not need conversion.
-    elif cell_type == xlrd.XL_CELL_NUMBER:
-      value = cell_value
-
-    # Cells of any other type are considered errors.
-    else:
-      print("UNKNOWN data type in row %d, col %d" % (row,col))
-      print("    cell type = " + str(cell_type))
-      sys.exit(1)
+# Returns the harmonized names of the header row of a 'mineral.xls' file.
 
-    result.append((cell_type, value))
-  return result
+def read_names(mineral, logfile):
+  mineral_xls = workbook_path(mineral)
+  workbook = open_workbook(mineral_xls, logfile)
+  try:
+    sheet = workbook.sheet_by_index(0) # python index 0 = worksheet 1
+    header_row = find_header_row(sheet, mineral, mineral_xls)
+    titles, names = harmonize_titles(sheet.row_values(header_row))
+  finally:
+    release_workbook(workbook)
+  return names
+
+# Runs in a worker process started with Mazama.init_worker()
+def header_worker(job):
+  mineral, sha1 = job
+  try:
+    return mineral, sha1, read_names(mineral, Mazama.worker_logfile), None
+  except Exception as e:
+    return mineral, sha1, None, "%s: %s" % (e.__class__.__name__, e)
+  finally:
+    Mazama.worker_logfile.flush()
 
 
 ########################################
-# convert_file
+# Header cache
 # 
-# Reads in an Excel file for a particular mineral and
-# converts the contents to a CSV file
+# Maps the SHA-1 of a workbook to the names in its header row.  The cache is
+# discarded when Mazama.CONVERSION_VERSION changes since the harmonized names
+# may have changed with it.
+
+def load_cache(path):
+  if os.path.exists(path):
+    with open(path) as f:
+      cache = json.load(f)
+    if cache.get('version') == Mazama.CONVERSION_VERSION:
+      return cache['headers']
+  return {}
+
+def save_cache(headers, path):
+  Mazama.write_atomic(path, [json.dumps({'version': Mazama.CONVERSION_VERSION, 'headers': headers}, indent=1, sort_keys=True)])
 
-def convert_file(mineral,logfile):
 
-  mineral_xls = mineral + '.xls'
+########################################
+# audit
+# 
+# Returns a dictionary mapping every mineral in 'minerals' to its list of
+# names, or to None if the workbook could not be read.  Workbooks found in
+# 'cache' are not opened; the others are read by 'workers' processes and
+# added to the cache.
+
+def audit(minerals, logfile, cache, workers=1):
+
+  headers = {}
+  jobs = []
+  for mineral in minerals:
+    mineral_xls = workbook_path(mineral)
+    if not os.path.exists(mineral_xls):
+      print >> logfile, "*** Missing: %s" % mineral_xls
+      headers[mineral] = None
+      continue
+    sha1 = Mazama.file_sha1(mineral_xls)
+    if sha1 in cache:
+      headers[mineral] = cache[sha1]
+    else:
+      jobs.append((mineral, sha1))
 
+  def finished(result):
+    mineral, sha1, names, error = result
+    if error is not None:
+      print >> logfile, "*** Open failed: %s: %s" % (workbook_path(mineral), error)
+    else:
+      cache[sha1] = names
+    headers[mineral] = names
+
+  if workers <= 1 or len(jobs) <= 1:
+    for mineral, sha1 in jobs:
+      try:
+        finished((mineral, sha1, read_names(mineral, logfile), None))
+      except Exception as e:
+        finished((mineral, sha1, None, "%s: %s" % (e.__class__.__name__, e)))
+    return headers
+
+  log_name = Mazama.worker_log_name(logfile)
+  pool = multiprocessing.Pool(min(workers, len(jobs)), Mazama.init_worker, (log_name, Mazama.use_mmap))
   try:
-    workbook = xlrd.open_workbook(mineral_xls, logfile=logfile)
-  except xlrd.XLRDError:
-    print >> logfile, "*** Open failed: %s: %s" % sys.exc_info()[:2]
+    for result in pool.imap_unordered(header_worker, jobs):
+      finished(result)
+    pool.close()
   except:
-    print >> logfile, "*** Open failed: %s: %s" % sys.exc_info()[:2]
-
-  mineral_csv = "USGS_2011_" + mineral + ".csv"
-  ###csv = open(mineral_csv,'w')
-  sheet = workbook.sheet_by_index(0) # python index 0 = worksheet 1
-
-  # The header row is typically row 5 but occasionally another row (eg. ironsteel.xls)
-  # Search for the header row by looking for 'Year' in the first column.
-  for i in range(0,200):
-    if sheet.row_values(i)[0] == 'Year':
-      header_row = i
-      break;
-
-  # Get all the titles and create associated names.
-  # Harmonize non-standard names where appropriate.
-  titles = sheet.row_values(header_row)
-  colhi = len(titles)
-  names = []
-  for i in range(0,colhi):
-    title = titles[i]
-    title = title.strip()                          # remove leading/following whitespace
-    title = re.sub("\s" , " ", title)              # replace any whitespacae with a single space
-    title = re.sub("\s+" , " ", title)             # replace multilpe spaces with a single space
-    titles[i] = title
-    if title == 'Unit value ($/t)':
-      names.append('unit_value')
-    elif title == 'Unit value (98$/t)':
-      names.append('unit_value_1998')
-    elif title == 'Net import reliance (%)':       # found in aluminum.xls
-      names.append('net_import_reliance')
-    elif title == 'Unit value $/t':                # found in asbestos.xls
-      names.append('unit_value')
-    elif title == 'Unit value 98$/t':              # found in asbestos.xls
-      names.append('unit_value_1998')
-    else:
-      names.append(title.lower().replace(' ','_'))
-
-  titles_string = ','.join(titles)
-  names_string = ','.join(names) 
-
-  ###print("Working on " + mineral_csv)
-  
-  # debugging lines
-  ###print(titles_string)
-  ###print(names_string)
-  if ('production' in names) and ('imports' in names) and ('exports' in names) and ('apparent_consumption' in names):
-    print(mineral)
-  else:
-    print(mineral + " is missing one or more variables")
-  """
-  if 'production' not in names:
-    print("\t missing production")
-  if 'imports' not in names:
-    print("\t missing imports")
-  if 'exports' not in names:
-    print("\t missing exports")
-  if 'apparent_consumption' not in names:
-    print("\t missing apparent_consumption")
-  if 'world_production' not in names:
-    print("\t missing world_production")
-  """
-  """
-  csv.write("DC.title      = ASCII CSV version of ...\n")
-  csv.write("file URL      = http://mazamascience.com/Minerals/USGS_2011_" + mineral + ".csv\n")
-  csv.write("original data = http://minerals.usgs.gov/ds/2005/140/" + mineral + ".xls\n")
-  csv.write("units         = metric tons\n")
-  csv.write("\n")
-  csv.write(titles_string + "\n")
-  csv.write(names_string + "\n")
-
-  # Data begin after the header_row and continue for up to current_year-1900 years
-  # We will check the type of the first column to determine when to stop ingesting data
-  for row in range(header_row+1,200):
-
-    # Stop ingesting data if you run out of rows
-    try:
-      types = sheet.row_types(row)
-      values = sheet.row_values(row)
-    except IndexError:
-      break;
-
-    # Stop ingesting data when the Year column no longer contains numbers.
-    if types[0] != xlrd.XL_CELL_NUMBER:
-      break;
-
-    # From help(xlrd):
-    #   XL_CELL_EMPTY   = 0
-    #   XL_CELL_TEXT    = 1
-    #   XL_CELL_NUMBER  = 2
-    #   XL_CELL_DATE    = 3
-    #   XL_CELL_BOOLEAN = 4
-    #   XL_CELL_ERROR   = 5
-    #   XL_CELL_BLANK   = 6
-
-    # First, validate and fix the data in the cells of this row
-    for col in range(0,colhi):
-
-      # Empty cells are converted to 'na'.
-      if types[col] == xlrd.XL_CELL_EMPTY:
-        values[col] = 'na'
-        types[col] = xlrd.XL_CELL_TEXT
-  
-      # Cells with text are converted directly to float.
-      elif types[col] == xlrd.XL_CELL_TEXT:
-
-        value = values[col].strip()
-
-        # Catch non-empty cells with a blank space in them
-        if len(value) == 0:
-          values[col] = 'na'
-          types[col] = xlrd.XL_CELL_TEXT
-
-        # Special case for aluminum, net_import_reliance
-        elif mineral == 'aluminum' and names[col] == 'net_import_reliance' and value == 'E':
-          values[col] = 'na'
-          types[col] = xlrd.XL_CELL_TEXT
-
-        # Special case for tantalum which has '1470*' in [2005,'World production']
-        elif mineral == 'tantalum' and value == '1470*':
-          values[col] = 1470.0
-          types[col] = xlrd.XL_CELL_NUMBER
-
-        # Everything else we convert to float
-        else: 
-          try:
-            value[col] = float(value)
-          except:
-            print("Cannot convert value '%s' to float in row %d, col %d" % (value,row+1,col+1))
-          types[col] = xlrd.XL_CELL_NUMBER
-  
-      # Cells with numbers do not need conversion.
-      elif types[col] == xlrd.XL_CELL_NUMBER:
-        pass
-  
-      # Cells of any other type are considered errors.
-      else:
-        print("UNKNOWN data type in row %d, col %d" % (row,col))
-        print("    cell type = " + str(types[col]))
-        sys.exit(1)
-
-    # Second, print out the values with appropriate formatting
-    for col in range(0,colhi):
-
-      if types[col] == xlrd.XL_CELL_NUMBER:
-        if col == 0: # Year
-          csv.write("%d" % int(values[col]))
-        else:
-          csv.write(",%.1f" % values[col])
-
-      elif types[col] == xlrd.XL_CELL_TEXT:
-        csv.write(",\"%s\"" % values[col])
-
-      else:
-        print("UNKNOWN cell_type %d in column %d" % (types[col],col))
-        sys.exit(1)
-
-    csv.write("\n")
-
-  print("Finished with " + mineral + " workbook.")
-  """
+    pool.terminate()
+    raise
+  finally:
+    pool.join()
+    Mazama.merge_worker_logs(log_name, logfile)
+  return headers
+
+
+########################################
+# write_coverage
+# 
+# Writes the coverage matrix of minerals (rows) and variables (columns) as
+# CSV with 1 where a variable is present and 0 where it is not, and as JSON
+# with the names of every mineral and the minerals missing required variables.
+
+REQUIRED = ['production', 'imports', 'exports', 'apparent_consumption']
+
+def write_coverage(minerals, headers, csv_path, json_path):
+
+  others = set()
+  for names in headers.values():
+    others.update(names or [])
+  others.difference_update(['year', ''])
+  variables = REQUIRED + sorted(others.difference(REQUIRED))
+
+  lines = ['mineral,' + ','.join(variables) + '\n']
+  for mineral in minerals:
+    names = headers.get(mineral) or []
+    lines.append(mineral + ',' + ','.join(['1' if variable in names else '0' for variable in variables]) + '\n')
+  Mazama.write_atomic(csv_path, lines)
+
+  incomplete = [mineral for mineral in minerals
+                if headers.get(mineral) is None or not set(REQUIRED).issubset(headers[mineral])]
+  coverage = {'required': REQUIRED,
+              'variables': variables,
+              'names': dict((mineral, headers.get(mineral)) for mineral in minerals),
+              'incomplete': incomplete}
+  Mazama.write_atomic(json_path, [json.dumps(coverage, indent=1, sort_keys=True)])
+
 
 ################################################################################
 
 def main():
 
+  parser = optparse.OptionParser(usage="usage: %prog [options]")
+  parser.add_option("-j", "--jobs", type="int", dest="jobs", default=0,
+                    help="number of worker processes (0 = one per CPU) [default: %default]")
+  parser.add_option("-c", "--cache", dest="cache", default="print_statistics_cache.json",
+                    help="header cache file [default: %default]")
+  parser.add_option("-o", "--output", dest="output", default="DS140_coverage",
+                    help="write the coverage matrix to OUTPUT.csv and OUTPUT.json [default: %default]")
+  (options, args) = parser.parse_args()
+
+  workers = options.jobs
+  if workers <= 0:
+    workers = multiprocessing.cpu_count()
+
   logfile = open('Mazama_2009.log', 'w')
 
-#  convert_file('antimony',logfile)
-
-  convert_file('abrasivesmanufactured',logfile)
-  convert_file('abrasivesnatural',logfile)
-  convert_file('agriculture',logfile)
-  convert_file('aluminum',logfile)
-  convert_file('antimony',logfile)
-  convert_file('arsenic',logfile)
-  convert_file('asbestos',logfile)
-  convert_file('barite',logfile)
-  convert_file('bauxitealumina',logfile)
-  convert_file('beryllium',logfile)
-  convert_file('bismuth',logfile)
-  convert_file('boron',logfile)
-  convert_file('bromine',logfile)
-  convert_file('cadmium',logfile)
-  convert_file('cement',logfile)
-  convert_file('cesium',logfile)
-  convert_file('chromium',logfile)
-  convert_file('clay',logfile)
-  convert_file('coalcombustionproducts',logfile)
-  convert_file('cobalt',logfile)
-  convert_file('columbium',logfile)
-  convert_file('copper',logfile)
-  convert_file('diamondindustrial',logfile)
-  convert_file('diatomite',logfile)
-  convert_file('feldspar',logfile)
-  convert_file('fluorspar',logfile)
-  convert_file('gallium',logfile)
-  convert_file('garnet',logfile)
-  convert_file('gemstones',logfile)
-  convert_file('germanium',logfile)
-  convert_file('gold',logfile)
-  convert_file('graphite',logfile)
-  convert_file('gypsum',logfile)
-  convert_file('hafnium',logfile)
-  convert_file('helium',logfile)
-  convert_file('indium',logfile)
-  convert_file('iodine',logfile)
-  convert_file('ironore',logfile)
-  convert_file('ironoxide',logfile)
-  convert_file('ironsteelscrap',logfile)
-  convert_file('ironsteelslag',logfile)
-  convert_file('ironsteel',logfile)
-  convert_file('kyanite',logfile)
-  convert_file('lead',logfile)
-  convert_file('lime',logfile)
-  convert_file('lithium',logfile)
-  convert_file('magnesiumcompounds',logfile)
-  convert_file('magnesium',logfile)
-  convert_file('manganese',logfile)
-  convert_file('mercury',logfile)
-  convert_file('micascrap',logfile)
-  convert_file('micasheet',logfile)
-  convert_file('molybdenum',logfile)
-  convert_file('nickel',logfile)
-  convert_file('nitrogen',logfile)
-  convert_file('organics',logfile)
-  convert_file('peat',logfile)
-  convert_file('perlite',logfile)
-  convert_file('phosphate',logfile)
-  convert_file('platinum',logfile)
-  convert_file('potash',logfile)
-  convert_file('pumice',logfile)
-  convert_file('quartzcrystal',logfile)
-  convert_file('rareearths',logfile)
-  convert_file('rhenium',logfile)
-  convert_file('salt',logfile)
-  convert_file('sandgravelconstruction',logfile)
-  convert_file('sandgravelindustrial',logfile)
-  convert_file('selenium',logfile)
-  convert_file('silicon',logfile)
-  convert_file('silver',logfile)
-  convert_file('sodaash',logfile)
-  convert_file('sodiumsulfate',logfile)
-  convert_file('stonecrushed',logfile)
-  convert_file('stonedimension',logfile)
-  convert_file('strontium',logfile)
-  convert_file('sulfur',logfile)
-  convert_file('talc',logfile)
-  convert_file('tantalum',logfile)
-  convert_file('tellurium',logfile)
-  convert_file('thallium',logfile)
-  convert_file('thorium',logfile)
-  convert_file('tin',logfile)
-  convert_file('titaniumdioxide',logfile)
-  convert_file('titaniummineral',logfile)
-  convert_file('titanium',logfile)
-  convert_file('tungsten',logfile)
-  convert_file('vanadium',logfile)
-  convert_file('vermiculite',logfile)
-  convert_file('wollastonite',logfile)
-  convert_file('wood',logfile)
-  convert_file('zinc',logfile)
-  convert_file('zirconium',logfile)
+  cache = load_cache(options.cache)
+  headers = audit(Mazama.MINERALS, logfile, cache, workers)
+  save_cache(cache, options.cache)
+
+  for mineral in Mazama.MINERALS:
+    names = headers[mineral]
+    if names is None:
+      print(mineral + " could not be read")
+    elif set(REQUIRED).issubset(names):
+      print(mineral)
+    else:
+      print(mineral + " is missing one or more variables")
+
+  write_coverage(Mazama.MINERALS, headers, options.output + '.csv', options.output + '.json')
 
 ################################################################################
 
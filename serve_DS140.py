@@ -0,0 +1,345 @@
+#!/usr/bin/python
+
+"""
+serve_DS140.py
+
+A small read-only HTTP service for the CSV files written by
+Mazama_USGS_DS140_2011.py:
+
+  /                      JSON list of the minerals and end use tables
+  /tin.csv               the table for tin as CSV
+  /tin.json              the same table as JSON
+  /tin-use.csv           the end use table for tin
+
+Tables can be cut down with query parameters:
+
+  /tin.json?years=1990-2010&columns=production,imports
+
+'years' is a single year or a range (either end may be left open) and
+'columns' a comma separated list of names; the year is always included.
+
+Responses are built once from the DS140 table cache and kept, together with
+a gzip compressed copy, in an in-memory cache bounded by size.  Every body
+has a strong ETag derived from its SHA-1 and requests with a matching
+If-None-Match get an empty 304 response, so clients polling for changes
+pay almost nothing while the data stay the same.  A cached response is
+rebuilt when its CSV file changes.
+"""
+
+import os, gzip, hashlib, json, threading
+import collections, optparse, urlparse
+import BaseHTTPServer, SocketServer
+import cStringIO
+import numpy as np
+
+import DS140
+from Mazama_USGS_DS140_2011 import format_row
+
+
+# Raised for requests that can't be answered: (status, message)
+class RequestError(Exception):
+    pass
+
+
+########################################
+# Response
+#
+# A rendered body in both plain and gzip encodings.  The ETags of the two
+# differ since they are different representations.
+
+class Response(object):
+
+    def __init__(self, body, content_type, signature):
+        if isinstance(body, unicode):
+            body = body.encode('utf-8')
+        self.body = body
+        self.content_type = content_type
+        self.signature = signature
+        self.etag = '"%s"' % hashlib.sha1(body).hexdigest()
+        buf = cStringIO.StringIO()
+        with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=6, mtime=0) as f:
+            f.write(body)
+        self.gzip_body = buf.getvalue()
+        self.gzip_etag = self.etag[:-1] + '-gzip"'
+
+    @property
+    def nbytes(self):
+        return len(self.body) + len(self.gzip_body)
+
+
+########################################
+# ResponseCache
+#
+# Least recently used cache of Responses keyed by request.  Every entry
+# remembers the size and modification time of the CSV file it was built
+# from and is rebuilt when they change.  Entries are evicted once the
+# bodies of all cached Responses exceed 'max_bytes'.
+
+class ResponseCache(object):
+
+    def __init__(self, max_bytes=32*1024*1024):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, signature, build):
+        with self.lock:
+            response = self.entries.pop(key, None)
+            if response is not None:
+                if response.signature == signature:
+                    self.entries[key] = response
+                    return response
+                self.nbytes -= response.nbytes
+        response = build()
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.nbytes -= old.nbytes
+            self.entries[key] = response
+            self.nbytes += response.nbytes
+            while self.nbytes > self.max_bytes and len(self.entries) > 1:
+                old_key, old = self.entries.popitem(last=False)
+                self.nbytes -= old.nbytes
+        return response
+
+
+########################################
+# Query parameters
+
+# Returns (first, last) from '1990', '1990-2010', '1990-' or '-2010'
+def parse_years(value):
+    first, sep, last = value.partition('-')
+    try:
+        first = int(first) if first else None
+        last = int(last) if last else None
+    except ValueError:
+        raise RequestError(400, "Invalid years: %s" % value)
+    if not sep:
+        last = first
+    return first, last
+
+def parse_columns(value, table):
+    columns = [column for column in value.split(',') if column and column != 'year']
+    for column in columns:
+        if column not in table.names:
+            raise RequestError(400, "Unknown column: %s" % column)
+    return columns
+
+
+########################################
+# Content negotiation
+
+# True if an Accept-Encoding header allows a gzip response.  Codings with
+# q=0 are refused; 'x-gzip' is taken as gzip and '*' stands for any coding
+# not listed.
+def accepts_gzip(value):
+    qualities = {}
+    for item in (value or '').split(','):
+        coding, sep, params = item.partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params.split(';'):
+            name, sep, number = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(number)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding] = quality
+    listed = [qualities[coding] for coding in ('gzip', 'x-gzip') if coding in qualities]
+    if listed:
+        return max(listed) > 0
+    return qualities.get('*', 0.0) > 0
+
+
+########################################
+# Rendering
+#
+# 'table' is a DS140.Table already cut down to the years asked for and
+# 'columns' the list of variables to include.
+
+def render_csv(table, columns, csv_path):
+    # Keep the metadata lines of the original file
+    with open(csv_path) as f:
+        lines = [f.readline() for i in range(0,5)]
+    cols = [0] + [table.names.index(column) for column in columns]
+    lines.append(','.join(['"' + table.titles[col] + '"' for col in cols]) + '\n')
+    lines.append(','.join([table.names[col] for col in cols]) + '\n')
+    data = table.data[:,cols]
+    missing = np.isnan(data)
+    for values, row_missing in zip(data.tolist(), missing.tolist()):
+        lines.append(format_row([None if m else v for v, m in zip(values, row_missing)]))
+    return ''.join(lines)
+
+def render_json(table, columns):
+    cols = [table.names.index(column) for column in columns]
+    data = table.data[:,cols]
+    missing = np.isnan(data)
+    content = {'mineral': table.mineral,
+               'kind': table.kind,
+               'years': table.years.tolist(),
+               'titles': dict((table.names[col], table.titles[col]) for col in cols),
+               'columns': dict((table.names[col], [None if m else v for v, m in zip(values, col_missing)])
+                               for col, values, col_missing in zip(cols, data.T.tolist(), missing.T.tolist()))}
+    return json.dumps(content, sort_keys=True)
+
+
+########################################
+# Handler
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    server_version = 'serve_DS140/1.0'
+
+    def do_GET(self):
+        self.respond(True)
+
+    def do_HEAD(self):
+        self.respond(False)
+
+    def respond(self, send_body):
+        try:
+            response = self.server.lookup(self.path)
+        except RequestError as e:
+            status, message = e.args
+            body = message + '\n'
+            self.send_response(status)
+            self.send_header('Content-Type', 'text/plain')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            if send_body:
+                self.wfile.write(body)
+            return
+
+        if accepts_gzip(self.headers.getheader('Accept-Encoding')):
+            body, etag = response.gzip_body, response.gzip_etag
+        else:
+            body, etag = response.body, response.etag
+
+        matches = [tag.strip() for tag in (self.headers.getheader('If-None-Match') or '').split(',')]
+        not_modified = '*' in matches or etag in matches or 'W/' + etag in matches
+
+        self.send_response(304 if not_modified else 200)
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Vary', 'Accept-Encoding')
+        if not_modified:
+            self.end_headers()
+            return
+        self.send_header('Content-Type', response.content_type)
+        if body is response.gzip_body:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+########################################
+# Server
+#
+# Serves the CSV files in 'directory' with one thread per connection.
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, address, directory='.', cache_bytes=32*1024*1024, verbose=False):
+        BaseHTTPServer.HTTPServer.__init__(self, address, Handler)
+        self.directory = directory
+        self.cache = ResponseCache(cache_bytes)
+        self.verbose = verbose
+
+    # Returns the Response for a request path or raises RequestError
+    def lookup(self, path):
+        parts = urlparse.urlsplit(path)
+        query = urlparse.parse_qs(parts.query)
+        name = parts.path.strip('/')
+
+        if name == '':
+            signature = (os.stat(self.directory).st_mtime,)
+            return self.cache.get(('index',), signature,
+                                  lambda: Response(self.render_index(), 'application/json', signature))
+
+        name, extension = os.path.splitext(name)
+        if extension not in ('.csv', '.json') or '/' in name:
+            raise RequestError(404, "Not found: %s" % parts.path)
+        if name.endswith('-use'):
+            mineral, kind = name[:-len('-use')], 'end_use'
+        else:
+            mineral, kind = name, 'supply'
+        csv_path = DS140.csv_path(mineral, kind, self.directory)
+        if not os.path.exists(csv_path):
+            raise RequestError(404, "Not found: %s" % parts.path)
+
+        years = query.get('years', [''])[-1]
+        columns = query.get('columns', [''])[-1]
+        stat = os.stat(csv_path)
+        signature = (stat.st_size, stat.st_mtime)
+        key = (csv_path, extension, years, columns)
+
+        def build():
+            if extension == '.csv' and not years and not columns:
+                # The file itself, byte for byte
+                with open(csv_path, 'rb') as f:
+                    return Response(f.read(), 'text/csv', signature)
+            table = DS140.load_mineral(mineral, kind, directory=self.directory)
+            if years:
+                first, last = parse_years(years)
+                rows = np.ones(len(table.years), dtype=bool)
+                if first is not None:
+                    rows &= table.years >= first
+                if last is not None:
+                    rows &= table.years <= last
+                table = table.select(table.years[rows])
+            names = parse_columns(columns, table) if columns else table.variables
+            if extension == '.csv':
+                return Response(render_csv(table, names, csv_path), 'text/csv', signature)
+            return Response(render_json(table, names), 'application/json', signature)
+
+        return self.cache.get(key, signature, build)
+
+    def render_index(self):
+        content = {'supply': DS140.list_minerals('supply', self.directory),
+                   'end_use': DS140.list_minerals('end_use', self.directory)}
+        return json.dumps(content, sort_keys=True)
+
+
+################################################################################
+
+def main():
+
+    parser = optparse.OptionParser(usage="usage: %prog [options]")
+    parser.add_option("-p", "--port", type="int", dest="port", default=8140,
+                      help="port to listen on [default: %default]")
+    parser.add_option("-b", "--bind", dest="bind", default="127.0.0.1",
+                      help="address to listen on [default: %default]")
+    parser.add_option("-d", "--directory", dest="directory", default=".",
+                      help="directory with the converted CSV files [default: %default]")
+    parser.add_option("-c", "--cache-size", type="int", dest="cache_size", default=32,
+                      help="size of the response cache in megabytes [default: %default]")
+    parser.add_option("-v", "--verbose", action="store_true", dest="verbose", default=False,
+                      help="log every request to stderr")
+    (options, args) = parser.parse_args()
+
+    server = Server((options.bind, options.port), options.directory, options.cache_size*1024*1024, options.verbose)
+    print("Serving %s on http://%s:%d/" % (os.path.abspath(options.directory), options.bind, options.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+################################################################################
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+A local stand-in for the USGS web server used by the get_DS140.py tests.
+
+  server = StandInServer({'tin.xls': data})
+  server.url('tin.xls')
+  server.failures = 2       # answer the next two requests with 503
+  server.drops = 1          # cut the next response short
+  server.honor_range = False
+  server.close()
+
+Files are served with a strong ETag derived from their content, so changing
+server.files changes the ETag, and a matching If-None-Match gets a 304
+response.  Range requests are answered with 206 when server.honor_range is
+set and any If-Range matches, otherwise the whole file is sent.  Every
+request is recorded in server.requests as a dictionary of path, range,
+if_range, status and client (address, port).
+"""
+
+import hashlib, re, threading
+import BaseHTTPServer, SocketServer
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        name = self.path.lstrip('/')
+        request = {'path': self.path,
+                   'range': self.headers.getheader('Range'),
+                   'if_range': self.headers.getheader('If-Range'),
+                   'client': self.client_address}
+        with server.lock:
+            server.requests.append(request)
+            data = server.files.get(name)
+            failing = server.failures > 0
+            if failing:
+                server.failures -= 1
+
+        if failing:
+            self.reply(request, 503, '')
+            return
+        if data is None:
+            self.reply(request, 404, '')
+            return
+
+        etag = '"%s"' % hashlib.md5(data).hexdigest()
+        headers = [('ETag', etag)]
+        if self.headers.getheader('If-None-Match') == etag:
+            self.reply(request, 304, '', headers)
+            return
+        status = 200
+        start = 0
+        match = re.match(r'bytes=(\d+)-$', request['range'] or '')
+        if match and server.honor_range and request['if_range'] in (None, etag):
+            start = int(match.group(1))
+            if start >= len(data):
+                self.reply(request, 416, '', headers)
+                return
+            status = 206
+            headers.append(('Content-Range', 'bytes %d-%d/%d' % (start, len(data) - 1, len(data))))
+        self.reply(request, status, data[start:], headers)
+
+    def reply(self, request, status, body, headers=()):
+        request['status'] = status
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        with self.server.lock:
+            drop = self.server.drops > 0 and len(body) > 1
+            if drop:
+                self.server.drops -= 1
+        if drop:
+            # Send a third of the body and hang up
+            self.wfile.write(body[:len(body) // 3])
+            self.wfile.flush()
+            self.close_connection = 1
+            return
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StandInServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, files):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), Handler)
+        self.files = dict(files)
+        self.drops = 0
+        self.failures = 0
+        self.honor_range = True
+        self.requests = []
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def url(self, name=''):
+        return 'http://127.0.0.1:%d/%s' % (self.server_address[1], name)
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
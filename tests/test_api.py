@@ -0,0 +1,58 @@
+import os, shutil, tempfile, threading
+import unittest
+import numpy as np
+
+import DS140
+
+
+class TableCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'tin.csv')
+        with open(self.path, 'w') as f:
+            f.write('tin\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def cached_bytes(self, cache):
+        return sum(table.data.nbytes for signature, table in cache.entries.values())
+
+    def test_concurrent_misses(self):
+        cache = DS140.TableCache()
+        loading = []
+        both = threading.Event()
+
+        # Both threads miss before either has put its table in the cache
+        def load(path):
+            loading.append(path)
+            if len(loading) == 2:
+                both.set()
+            both.wait(10)
+            return DS140.Table('tin', 'supply', ['Year'], ['year'], np.zeros((100, 1)))
+
+        threads = [threading.Thread(target=cache.get, args=(self.path, load)) for i in range(0,2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(loading), 2)
+        self.assertEqual(len(cache.entries), 1)
+        self.assertEqual(cache.nbytes, self.cached_bytes(cache))
+
+    def test_hit_and_reload(self):
+        cache = DS140.TableCache()
+        load = lambda path: DS140.Table('tin', 'supply', ['Year'], ['year'], np.zeros((10, 1)))
+        table = cache.get(self.path, load)
+        self.assertIs(cache.get(self.path, load), table)
+        with open(self.path, 'w') as f:
+            f.write('tin, changed\n')
+        os.utime(self.path, (0, 0))
+        self.assertIsNot(cache.get(self.path, load), table)
+        self.assertEqual(cache.nbytes, self.cached_bytes(cache))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import sys, StringIO
+import unittest
+import numpy as np
+
+import check_DS140
+from tests.workbooks import WorkbookTestCase
+
+nan = np.nan
+
+VARIABLES = ['apparent_consumption', 'exports', 'imports', 'production', 'stocks']
+
+
+# Returns a cube of 'tin', which balances once stocks are taken into account,
+# and 'zinc', which doesn't balance in 2001
+def supply_cube():
+    minerals = ['tin', 'zinc']
+    years = np.array([2000, 2001, 2002])
+    values = np.full((2, 3, len(VARIABLES)), nan)
+    #                           consumption  exports  imports  production  stocks
+    values[0] = [[110.0,       10.0,    20.0,    100.0,      50.0],
+                 [120.0,       10.0,    20.0,    100.0,      40.0],    # 10 taken from stocks
+                 [110.0,       10.0,    20.0,    100.0,      nan]]
+    values[1] = [[104.0,       0.0,     0.0,     100.0,      nan],     # within the tolerance
+                 [200.0,       0.0,     0.0,     100.0,      nan],
+                 [200.0,       0.0,     0.0,     nan,        nan]]     # not checked
+    return minerals, years, list(VARIABLES), values
+
+
+class SupplyBalanceTest(unittest.TestCase):
+
+    def test_anomalies(self):
+        report, checked = check_DS140.supply_balance(*supply_cube())
+        self.assertEqual(checked, 5)
+        self.assertEqual(list(report['mineral']), ['zinc'])
+        self.assertEqual(list(report['year']), [2001])
+        self.assertEqual(list(report['expected']), [100.0])
+        self.assertEqual(list(report['residual']), [100.0])
+        self.assertEqual(list(report['relative_error']), [0.5])
+
+    def test_stock_decrease(self):
+        minerals, years, variables, values = supply_cube()
+        report, checked = check_DS140.supply_balance(minerals[:1], years, variables, values[:1])
+        self.assertEqual(len(report['mineral']), 0)
+
+        # A stock increase is taken from the supply
+        values[0,1,[0,4]] = [100.0, 60.0]
+        report, checked = check_DS140.supply_balance(minerals[:1], years, variables, values[:1])
+        self.assertEqual(len(report['mineral']), 0)
+
+        values[0,1,0] = 120.0
+        report, checked = check_DS140.supply_balance(minerals[:1], years, variables, values[:1])
+        self.assertEqual(list(report['stock_decrease']), [-10.0])
+        self.assertEqual(list(report['expected']), [100.0])
+
+
+class MainTest(WorkbookTestCase):
+
+    # Runs check_DS140.py on 'cube' and returns its exit status
+    def check(self, cube):
+        load_cube = check_DS140.load_cube
+        argv, stdout = sys.argv, sys.stdout
+        check_DS140.load_cube = lambda directory, prefix: cube
+        sys.argv = ['check_DS140.py', '-o', 'balance.csv']
+        sys.stdout = StringIO.StringIO()
+        try:
+            check_DS140.main()
+        except SystemExit as e:
+            return e.code
+        finally:
+            check_DS140.load_cube = load_cube
+            sys.argv, sys.stdout = argv, stdout
+        return 0
+
+    def test_exit_status(self):
+        minerals, years, variables, values = supply_cube()
+        self.assertEqual(self.check((minerals[:1], years, variables, values[:1])), 0)
+        self.assertEqual(self.check((minerals, years, variables, values)), 1)
+        with open('balance.csv') as f:
+            lines = f.readlines()
+        self.assertEqual(lines[1], 'zinc,2001,100.0,0.0,0.0,0.0,200.0,100.0,100.0,0.5000\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+
+import Mazama_USGS_DS140_2011 as Mazama
+from tests.workbooks import SUPPLY_TITLES, WorkbookTestCase, write_workbook
+
+# Sentinels, thousands separators, footnote markers and trailing text.  The
+# footnote in the Year column ends the data block.
+CELLS = {(4, 1): ' ', (4, 2): 'NA', (4, 3): 'W',
+         (5, 1): '1,470', (5, 2): '1470*', (5, 3): ' 12.5 ',
+         (6, 4): 'See note', (7, 4): '2e',
+         (8, 0): 'e Estimated.', (9, 0): 2004.0, (9, 1): 'W'}
+
+# Rows written by the converter before the cleaning engine: None for "na",
+# text for cells that could not be converted
+ROWS = [[2000.0, None, None, None, 4000.0],
+        [2001.0, '1,470', '1470*', 12.5, 4001.0],
+        [2002.0, 1002.0, 2002.0, 3002.0, 'See note'],
+        [2003.0, 1003.0, 2003.0, 3003.0, '2e']]
+
+
+class CleanDataTest(WorkbookTestCase):
+
+    # Returns the block cleaned by clean_data() as rows like ROWS
+    def clean(self, cells, sentinels=Mazama.SENTINELS, column_sentinels={}, titles=SUPPLY_TITLES):
+        write_workbook('tin.xls', nrows=4, titles=titles, extra=cells)
+        workbook = Mazama.open_workbook('tin.xls', self.logfile)
+        try:
+            data, missing, unconverted = Mazama.clean_data(workbook.sheet_by_index(0), 4, len(titles),
+                                                           sentinels, column_sentinels, logfile=self.logfile)
+        finally:
+            Mazama.release_workbook(workbook)
+        rows = []
+        for row in range(0,data.shape[0]):
+            rows.append([unconverted.get((row, col), None if missing[row,col] else data[row,col])
+                         for col in range(0,data.shape[1])])
+        return rows
+
+    def test_sentinels_and_text(self):
+        self.assertEqual(self.clean(CELLS), ROWS)
+
+    def test_value_sentinel(self):
+        # tantalum: '1470*' in [2005,'World production']
+        sentinels = dict(Mazama.SENTINELS)
+        sentinels['1470*'] = (1470.0, False)
+        rows = [list(row) for row in ROWS]
+        rows[1][2] = 1470.0
+        self.assertEqual(self.clean(CELLS, sentinels), rows)
+
+    def test_column_sentinel(self):
+        # aluminum: 'E' only in the net_import_reliance column
+        titles = SUPPLY_TITLES[:3] + ['Net import reliance', 'Apparent consumption']
+        rows = self.clean({(6, 2): 'E', (7, 3): 'E'}, column_sentinels={3: {'E': (None, False)}}, titles=titles)
+        self.assertEqual(rows, [[2000.0, 1000.0, 2000.0, 3000.0, 4000.0],
+                                [2001.0, 1001.0, 2001.0, 3001.0, 4001.0],
+                                [2002.0, 1002.0, 'E', 3002.0, 4002.0],
+                                [2003.0, 1003.0, 2003.0, None, 4003.0]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+import os, sys, StringIO
+import unittest
+import xlrd
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+import Mazama_USGS_DS140_2011 as Mazama
+from tests.test_clean import CELLS
+from tests.workbooks import SUPPLY_TITLES, TRAILING_HEADER_CELLS, WorkbookTestCase, write_workbook
+
+
+class ReleaseTest(WorkbookTestCase):
+
+    def setUp(self):
+        WorkbookTestCase.setUp(self)
+        self.released = []
+        self.release_workbook = Mazama.release_workbook
+        Mazama.release_workbook = lambda workbook: self.released.append(workbook)
+
+    def tearDown(self):
+        Mazama.release_workbook = self.release_workbook
+        WorkbookTestCase.tearDown(self)
+
+    def test_released_after_failure(self):
+        write_workbook('tin.xls', titles=['Date', 'Production'])
+        write_workbook('tin-use.xls', titles=['Date', 'Transportation'])
+        self.assertRaises(ValueError, Mazama.convert_file, 'tin', self.logfile)
+        self.assertRaises(ValueError, Mazama.convert_use_file, 'tin-use', self.logfile)
+        self.assertEqual(len(self.released), 2)
+
+    def test_released_after_success(self):
+        write_workbook('tin.xls')
+        Mazama.convert_file('tin', self.logfile)
+        self.assertEqual(len(self.released), 1)
+
+
+class HeaderRowCacheTest(WorkbookTestCase):
+
+    def test_cache_in_process(self):
+        write_workbook('tin.xls', header_row=6)
+        Mazama.convert_file('tin', self.logfile)
+        stat = os.stat('tin.xls')
+        key = (os.path.abspath('tin.xls'), stat.st_size, stat.st_mtime)
+        self.assertEqual(Mazama.header_row_cache[key], 6)
+        # Nothing is written besides the CSV file
+        self.assertEqual(sorted(os.listdir('.')), ['tin.csv', 'tin.xls'])
+
+class HeaderRowOverrideTest(WorkbookTestCase):
+
+    def header_row(self, vintage):
+        workbook = Mazama.open_workbook('nickel.xls', self.logfile)
+        try:
+            return Mazama.find_header_row(workbook.sheet_by_index(0), 'nickel', vintage=vintage)
+        finally:
+            Mazama.release_workbook(workbook)
+
+    def test_override_for_its_vintage(self):
+        # The 2011 layout without 'Year' in the header line
+        write_workbook('nickel.xls', header_row=4, titles=[''] + SUPPLY_TITLES[1:])
+        self.assertEqual(self.header_row(2011), 4)
+        self.assertRaises(ValueError, self.header_row, 2012)
+
+    def test_corrected_layout(self):
+        write_workbook('nickel.xls', header_row=6)
+        self.assertEqual(self.header_row(2011), 6)
+
+
+class StdoutTest(WorkbookTestCase):
+
+    # Returns what stream() writes through write_rows() to stdout and the log
+    def stream(self, mineral):
+        stdout = sys.stdout
+        sys.stdout = out = StringIO.StringIO()
+        logfile = StringIO.StringIO()
+        try:
+            Mazama.write_rows(mineral, Mazama.stream(mineral, logfile), sys.stdout)
+        finally:
+            sys.stdout = stdout
+        return out.getvalue(), logfile.getvalue()
+
+    def test_header_row_warning(self):
+        write_workbook('nickel.xls', header_row=6)
+        out, log = self.stream('nickel')
+        self.assertTrue(out.startswith('DC.title'), out[:80])
+        self.assertIn("doesn't look like a header row", log)
+
+    def test_unknown_data_type(self):
+        write_workbook('tin.xls', extra={(6, 2): True})
+        stdout = sys.stdout
+        sys.stdout = out = StringIO.StringIO()
+        logfile = StringIO.StringIO()
+        try:
+            self.assertRaises(ValueError, list, Mazama.stream('tin', logfile))
+        finally:
+            sys.stdout = stdout
+        self.assertEqual(out.getvalue(), '')
+        self.assertIn('UNKNOWN data type in row 6, col 2', logfile.getvalue())
+
+
+@unittest.skipIf(openpyxl is None, "openpyxl is not installed")
+class XlsxTest(WorkbookTestCase):
+
+    # Copies the cells of the .xls workbook 'xls_path' to a new .xlsx workbook
+    def copy_to_xlsx(self, xls_path, xlsx_path):
+        sheet = xlrd.open_workbook(xls_path).sheet_by_index(0)
+        workbook = openpyxl.Workbook()
+        worksheet = workbook.active
+        for row in range(0,sheet.nrows):
+            for col in range(0,sheet.ncols):
+                if sheet.cell_type(row, col) != xlrd.XL_CELL_EMPTY:
+                    worksheet.cell(row=row+1, column=col+1, value=sheet.cell_value(row, col))
+        workbook.save(xlsx_path)
+
+    def convert(self, mineral):
+        Mazama.convert_file(mineral, self.logfile)
+        with open(mineral + '.csv') as f:
+            return f.read()
+
+    def test_same_csv_as_xls(self):
+        cells = dict(CELLS)
+        cells.update(TRAILING_HEADER_CELLS)
+        write_workbook('tin.xls', nrows=4, extra=cells)
+        xls_csv = self.convert('tin')
+        self.copy_to_xlsx('tin.xls', 'tin.xlsx')
+        os.remove('tin.xls')
+        self.assertEqual(Mazama.workbook_path('tin'), 'tin.xlsx')
+        self.assertEqual(self.convert('tin'), xls_csv)
+
+
+if __name__ == '__main__':
+    unittest.main()
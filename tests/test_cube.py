@@ -0,0 +1,22 @@
+import unittest
+import numpy as np
+
+import Mazama_USGS_DS140_2011 as Mazama
+from tests.workbooks import WorkbookTestCase, write_workbook
+
+
+class CubeTest(WorkbookTestCase):
+
+    def test_trailing_header_cells(self):
+        write_workbook('tin.xls', titles=['Year', 'Production', 'Imports', 'Production'],
+                       extra={(3, 6): 'e', (3, 8): 'x'})
+        Mazama.convert_file('tin', self.logfile)
+        minerals, years, variables, values = Mazama.build_cube([('tin', 'tin.csv')])
+        self.assertEqual(variables, ['e', 'imports', 'production', 'x'])
+        # The first of the repeated columns wins
+        rows = (years >= 2000) & (years <= 2009)
+        np.testing.assert_array_equal(values[0,rows,variables.index('production')], 1000.0 + np.arange(10))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+import numpy as np
+
+import Mazama_USGS_DS140_2011 as Mazama
+
+nan = np.nan
+
+
+def diff(old, new):
+    return list(Mazama.diff_tables(old, new))
+
+
+class DiffTablesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.names = ['year', 'production', 'imports']
+        self.data = np.array([[2000.0, 10.0, 1.0],
+                              [2001.0, 11.0, nan],
+                              [2002.0, 12.0, 3.0],
+                              [2003.0, nan, nan]])
+
+    def test_unchanged(self):
+        self.assertEqual(diff((self.names, self.data), (self.names, self.data.copy())), [])
+
+    def test_renamed_column(self):
+        records = diff((self.names, self.data), (['year', 'production', 'imports_total'], self.data))
+        self.assertEqual(records, [{'op': 'add_column', 'variable': 'imports_total'},
+                                   {'op': 'remove_column', 'variable': 'imports'}])
+
+    def test_dropped_year(self):
+        # Padding rows of missing values don't count as years
+        new = self.data.copy()
+        new[1,1:] = nan
+        self.assertEqual(diff((self.names, self.data), (self.names, new)), [{'op': 'remove_year', 'year': 2001}])
+
+    def test_added_year(self):
+        new = self.data.copy()
+        new[3,1] = 13.0
+        self.assertEqual(diff((self.names, self.data), (self.names, new)),
+                         [{'op': 'add_year', 'year': 2003, 'values': {'production': 13.0}}])
+
+    def test_revisions(self):
+        new = self.data.copy()
+        new[1,2] = 2.0      # NaN to value
+        new[2,1] = nan      # value to NaN
+        new[0,1] = 10.5
+        records = diff((self.names, self.data), (self.names, new))
+        self.assertEqual(records, [
+            {'op': 'revise', 'year': 2000, 'variable': 'production', 'old': 10.0, 'new': 10.5},
+            {'op': 'revise', 'year': 2001, 'variable': 'imports', 'old': None, 'new': 2.0},
+            {'op': 'revise', 'year': 2002, 'variable': 'production', 'old': 12.0, 'new': None}])
+
+    def test_blank_and_repeated_names(self):
+        names = self.names + ['', 'e', '', 'e']
+        data = np.hstack([self.data, np.full((4, 4), nan)])
+        data[:3,4] = 5.0
+        new = data.copy()
+        new[:,6] = 7.0      # the second 'e' column is ignored
+        self.assertEqual(diff((self.names, self.data), (names, new)), [{'op': 'add_column', 'variable': 'e'}])
+        self.assertEqual(diff((names, data), (names, new)), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+import os, shutil, tempfile
+import unittest
+
+import get_DS140
+from tests.http_server import StandInServer
+
+
+def make_data(size):
+    return os.urandom(size)
+
+
+class DownloadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.data = make_data(200 * 1024)
+        self.server = StandInServer({'tin.xls': self.data})
+        self.fetcher = get_DS140.Fetcher(timeout=10)
+        self.path = os.path.join(self.directory, 'tin.xls')
+
+    def tearDown(self):
+        self.fetcher.close()
+        self.server.close()
+        shutil.rmtree(self.directory)
+
+    def download(self, retries=3, entry=None):
+        return get_DS140.download_file(self.fetcher, self.server.url('tin.xls'), self.path,
+                                       retries=retries, backoff=0, entry=entry)
+
+    def contents(self):
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+    def assertNoPartFiles(self):
+        for part in get_DS140.part_paths(self.path):
+            self.assertFalse(os.path.exists(part), part)
+
+
+class RetryTest(DownloadTest):
+
+    def test_transient_errors(self):
+        self.server.failures = 2
+        entry = self.download()
+        self.assertEqual(self.contents(), self.data)
+        self.assertEqual([request['status'] for request in self.server.requests], [503, 503, 200])
+        self.assertEqual(entry['size'], len(self.data))
+
+    def test_gives_up(self):
+        self.server.failures = 5
+        self.assertRaises(get_DS140.FetchError, self.download, 1)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_not_found(self):
+        self.assertRaises(get_DS140.HTTPStatusError, get_DS140.download_file, self.fetcher,
+                          self.server.url('zinc.xls'), self.path, 3, 0)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_unchanged(self):
+        entry = self.download()
+        self.assertIs(self.download(entry=entry), entry)
+        self.assertEqual(self.server.requests[-1]['status'], 304)
+
+    def test_pooled_connections(self):
+        for i in range(0,3):
+            self.server.files['mineral%d.xls' % i] = make_data(10 * 1024)
+        names = sorted(self.server.files)
+        failures = get_DS140.download_all(names, self.server.url(), self.directory, workers=1, backoff=0)
+        self.assertEqual(failures, [])
+        self.assertEqual(len(set(request['client'] for request in self.server.requests)), 1)
+        for name in names:
+            with open(os.path.join(self.directory, name), 'rb') as f:
+                self.assertEqual(f.read(), self.server.files[name])
+
+
+class ResumeTest(DownloadTest):
+
+    def test_resume_after_dropped_connection(self):
+        self.server.drops = 1
+        entry = self.download()
+        self.assertEqual(self.contents(), self.data)
+        self.assertEqual(entry['size'], len(self.data))
+        self.assertNoPartFiles()
+        first, second = self.server.requests
+        self.assertEqual(first['range'], None)
+        self.assertEqual(second['status'], 206)
+        self.assertEqual(second['range'], 'bytes=%d-' % (len(self.data) // 3))
+
+    def test_resume_next_run(self):
+        self.server.drops = 1
+        self.assertRaises(get_DS140.FetchError, self.download, 0)
+        self.assertFalse(os.path.exists(self.path))
+        part_path, journal_path = get_DS140.part_paths(self.path)
+        self.assertEqual(os.path.getsize(part_path), len(self.data) // 3)
+
+        self.download()
+        self.assertEqual(self.contents(), self.data)
+        self.assertEqual(self.server.requests[-1]['status'], 206)
+        self.assertNoPartFiles()
+
+    def test_changed_etag_restarts(self):
+        self.server.drops = 1
+        self.assertRaises(get_DS140.FetchError, self.download, 0)
+
+        # The file changes on the server before the next run
+        new_data = make_data(150 * 1024)
+        self.server.files['tin.xls'] = new_data
+        self.download()
+        self.assertEqual(self.contents(), new_data)
+        request = self.server.requests[-1]
+        self.assertTrue(request['range'] and request['if_range'])
+        self.assertEqual(request['status'], 200)
+        self.assertNoPartFiles()
+
+    def test_range_ignored(self):
+        self.server.drops = 1
+        self.server.honor_range = False
+        self.download()
+        self.assertEqual(self.contents(), self.data)
+        self.assertEqual([request['status'] for request in self.server.requests], [200, 200])
+        self.assertNoPartFiles()
+
+
+if __name__ == '__main__':
+    unittest.main()
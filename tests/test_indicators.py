@@ -0,0 +1,80 @@
+import unittest
+import numpy as np
+
+import Mazama_USGS_DS140_2011 as Mazama
+
+nan = np.nan
+
+YEARS = np.arange(2006, 2011)
+VARIABLES = ['production', 'unit_value', 'unit_value_1998', 'world_production']
+
+
+# Returns a cube of two minerals with values by variable
+def cube(**columns):
+    values = np.full((2, len(YEARS), len(columns)), nan)
+    variables = sorted(columns)
+    for col, variable in enumerate(variables):
+        values[:,:,col] = columns[variable]
+    return variables, values
+
+
+class DeriveIndicatorsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.variables, self.values = cube(
+            production=[[100.0, 110.0, 0.0, 50.0, nan], [200.0] * 5],
+            world_production=[[1000.0, 1000.0, 1000.0, 0.0, 500.0], [nan] * 5],
+            unit_value=[[10.0, 11.0, 12.0, 13.0, 20.0], [nan, nan, nan, nan, 30.0]],
+            unit_value_1998=[[8.0, 8.0, 8.0, 8.0, 10.0], [nan, nan, nan, nan, 10.0]])
+
+    def indicators(self, variables=None, values=None, base_year=2010):
+        if variables is None:
+            variables, values = self.variables, self.values
+        names, titles, derived = Mazama.derive_indicators(YEARS, variables, values, window=3, base_year=base_year)
+        self.assertEqual(len(titles), len(names))
+        self.assertEqual(derived.shape, (2, len(YEARS), len(names)))
+        return dict((name, derived[:,:,col]) for col, name in enumerate(names)), names
+
+    def test_names(self):
+        indicators, names = self.indicators()
+        self.assertEqual(names, ['production_growth', 'production_mean3',
+                                 'unit_value_growth', 'unit_value_mean3',
+                                 'unit_value_1998_growth', 'unit_value_1998_mean3',
+                                 'world_production_growth', 'world_production_mean3',
+                                 'world_share', 'unit_value_2010'])
+
+    def test_growth_and_means(self):
+        indicators, names = self.indicators()
+        # Growth from zero and to or from a missing value is missing
+        np.testing.assert_allclose(indicators['production_growth'],
+                                   [[nan, 10.0, -100.0, nan, nan], [nan, 0.0, 0.0, 0.0, 0.0]])
+        # Windows with a missing value have no mean
+        np.testing.assert_allclose(indicators['production_mean3'],
+                                   [[nan, nan, 70.0, 160.0/3, nan], [nan, nan, 200.0, 200.0, 200.0]])
+
+    def test_world_share(self):
+        indicators, names = self.indicators()
+        np.testing.assert_allclose(indicators['world_share'],
+                                   [[10.0, 11.0, 0.0, nan, nan], [nan] * 5])
+
+    def test_constant_dollars(self):
+        # The deflators of 2010 are 2 and 3, the median 2.5
+        indicators, names = self.indicators()
+        np.testing.assert_allclose(indicators['unit_value_2010'],
+                                   [[20.0, 20.0, 20.0, 20.0, 25.0], [nan, nan, nan, nan, 25.0]])
+
+        # No deflator without a base year in the cube
+        indicators, names = self.indicators(base_year=2011)
+        self.assertEqual(names[-1], 'unit_value_2011')
+        self.assertTrue(np.isnan(indicators['unit_value_2011']).all())
+
+    def test_missing_variables(self):
+        variables, values = cube(production=[[100.0] * 5, [200.0] * 5])
+        indicators, names = self.indicators(variables, values)
+        self.assertEqual(names, ['production_growth', 'production_mean3', 'world_share', 'unit_value_2010'])
+        self.assertTrue(np.isnan(indicators['world_share']).all())
+        self.assertTrue(np.isnan(indicators['unit_value_2010']).all())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import os, json
+import unittest
+
+from tests.workbooks import WorkbookTestCase, write_workbook, run_converter
+
+
+class JournalTest(WorkbookTestCase):
+
+    def setUp(self):
+        WorkbookTestCase.setUp(self)
+        for mineral in ['copper', 'tin', 'zinc']:
+            write_workbook(os.path.join(self.directory, mineral + '.xls'))
+
+    def statuses(self):
+        status = {}
+        with open(os.path.join(self.directory, 'Mazama_2011_journal.jsonl')) as f:
+            for line in f:
+                entry = json.loads(line)
+                status[entry['mineral']] = entry['status']
+        return status
+
+    def test_incremental_then_resume(self):
+        run_converter(self.directory)
+        status, output = run_converter(self.directory, '-i')
+        self.assertIn('Skipping tin workbook (unchanged)', output)
+        for mineral in ['copper', 'tin', 'zinc']:
+            self.assertEqual(self.statuses()[mineral], 'done')
+
+        status, output = run_converter(self.directory, '-r')
+        self.assertNotIn('Working on tin.csv', output)
+        self.assertIn('Skipping tin workbook (done)', output)
+
+    def test_resume_after_failure(self):
+        with open(os.path.join(self.directory, 'tin.xls'), 'w') as f:
+            f.write('not a workbook')
+        status, output = run_converter(self.directory)
+        self.assertEqual(status, 1)
+        self.assertEqual(self.statuses()['tin'], 'failed')
+        self.assertEqual(self.statuses()['zinc'], 'done')
+
+        write_workbook(os.path.join(self.directory, 'tin.xls'))
+        status, output = run_converter(self.directory, '-r')
+        self.assertIn('Working on tin.csv', output)
+        self.assertNotIn('Working on zinc.csv', output)
+        self.assertEqual(self.statuses()['tin'], 'done')
+
+
+if __name__ == '__main__':
+    unittest.main()
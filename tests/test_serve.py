@@ -0,0 +1,60 @@
+import os, gzip, httplib, threading
+import cStringIO
+import unittest
+
+import Mazama_USGS_DS140_2011 as Mazama
+import serve_DS140
+from tests.workbooks import WorkbookTestCase, write_workbook
+
+
+class AcceptEncodingTest(unittest.TestCase):
+
+    def test_accepted(self):
+        for value in ['gzip', 'gzip, deflate', 'deflate, gzip;q=0.5', 'x-gzip', '*', 'identity, *;q=0.1',
+                      'GZIP;Q=1']:
+            self.assertTrue(serve_DS140.accepts_gzip(value), value)
+
+    def test_refused(self):
+        for value in [None, '', 'identity', 'deflate', 'gzip;q=0', 'identity, x-gzip;q=0',
+                      'gzip;q=0.0, *', '*;q=0', 'gzip;q=bad']:
+            self.assertFalse(serve_DS140.accepts_gzip(value), value)
+
+
+class ServerTest(WorkbookTestCase):
+
+    def setUp(self):
+        WorkbookTestCase.setUp(self)
+        write_workbook('tin.xls')
+        Mazama.convert_file('tin', self.logfile)
+        self.server = serve_DS140.Server(('127.0.0.1', 0), self.directory)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        WorkbookTestCase.tearDown(self)
+
+    def get(self, path, headers):
+        connection = httplib.HTTPConnection('127.0.0.1', self.server.server_address[1], timeout=10)
+        try:
+            connection.request('GET', path, headers=headers)
+            response = connection.getresponse()
+            return response.status, response.getheader('content-encoding'), response.read()
+        finally:
+            connection.close()
+
+    def test_encodings(self):
+        with open(os.path.join(self.directory, 'tin.csv'), 'rb') as f:
+            csv = f.read()
+        status, encoding, body = self.get('/tin.csv', {'Accept-Encoding': 'gzip'})
+        self.assertEqual(encoding, 'gzip')
+        self.assertEqual(gzip.GzipFile(fileobj=cStringIO.StringIO(body)).read(), csv)
+        for value in ['gzip;q=0', 'identity, x-gzip;q=0']:
+            status, encoding, body = self.get('/tin.csv', {'Accept-Encoding': value})
+            self.assertEqual((status, encoding, body), (200, None, csv))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import os, json
+import unittest
+
+from tests.workbooks import WorkbookTestCase, write_workbook, run_converter
+
+
+class CacheDirectoryTest(WorkbookTestCase):
+
+    def setUp(self):
+        WorkbookTestCase.setUp(self)
+        self.workbooks = os.path.join(self.directory, 'workbooks')
+        self.cache = os.path.join(self.directory, 'cache')
+        self.output = os.path.join(self.directory, 'output')
+        os.mkdir(self.workbooks)
+        os.mkdir(self.output)
+        for mineral in ['tin', 'zinc']:
+            write_workbook(os.path.join(self.workbooks, mineral + '.xls'))
+
+    def test_fill_cache_and_convert(self):
+        # A download manifest in the cache directory must not get in the way
+        os.mkdir(self.cache)
+        with open(os.path.join(self.cache, 'DS140_manifest.json'), 'w') as f:
+            json.dump({'files': {'tin.xls': {'etag': '"1"'}}}, f)
+
+        status, output = run_converter(self.workbooks, '--fill-cache', self.cache)
+        self.assertEqual(status, 0, output)
+        self.assertIn('Copied 2 workbooks', output)
+
+        run_converter(self.output, '-a', self.cache)
+        run_converter(self.workbooks)
+        for mineral in ['tin', 'zinc']:
+            with open(os.path.join(self.output, mineral + '.csv')) as f:
+                cached = f.read()
+            with open(os.path.join(self.workbooks, mineral + '.csv')) as f:
+                self.assertEqual(cached, f.read())
+
+    def test_several_vintages(self):
+        status, output = run_converter(self.output, '-a', self.workbooks, '-v', '2010,2011')
+        self.assertEqual(status, 2)
+        self.assertIn("--archive can't be combined with several vintages", output)
+        self.assertEqual(os.listdir(self.output), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
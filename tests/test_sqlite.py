@@ -0,0 +1,24 @@
+import os, sqlite3
+import unittest
+
+from tests.workbooks import TRAILING_HEADER_CELLS, WorkbookTestCase, write_workbook, run_converter
+
+
+class SqliteExportTest(WorkbookTestCase):
+
+    def test_trailing_header_cells(self):
+        write_workbook(os.path.join(self.directory, 'tin.xls'), extra=TRAILING_HEADER_CELLS)
+        status, output = run_converter(self.directory, '--sqlite', 'ds140.db')
+        self.assertNotIn('Traceback', output)
+
+        connection = sqlite3.connect(os.path.join(self.directory, 'ds140.db'))
+        variables = [name for name, in connection.execute("SELECT name FROM variables ORDER BY id")]
+        self.assertEqual(variables, ['production', 'imports', 'exports', 'apparent_consumption', 'e', 'see_note'])
+        rows = connection.execute("SELECT year, value FROM series WHERE mineral = 'tin' AND "
+                                  "variable = 'imports' AND year BETWEEN 2002 AND 2003").fetchall()
+        self.assertEqual(rows, [(2002, 2002.0), (2003, 2003.0)])
+        connection.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+import unittest
+
+import Mazama_USGS_DS140_2011 as Mazama
+from tests.workbooks import TRAILING_HEADER_CELLS, WorkbookTestCase, write_workbook
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+@unittest.skipIf(pyarrow is None, "pyarrow is not installed")
+class StoreTest(WorkbookTestCase):
+
+    def check_store(self, path, read):
+        write_workbook('tin.xls', extra=TRAILING_HEADER_CELLS)
+        Mazama.convert_file('tin', self.logfile)
+        Mazama.write_store([('tin', 'supply', 'tin.csv')], path)
+        table = read(path).to_pydict()
+        keys = zip(table['mineral'], table['kind'], table['year'], table['variable'])
+        self.assertEqual(len(keys), len(set(keys)))
+        self.assertEqual(sorted(set(table['variable'])),
+                         ['apparent_consumption', 'e', 'exports', 'imports', 'production', 'see_note'])
+        values = dict(((year, variable), value) for year, variable, value
+                      in zip(table['year'], table['variable'], table['value']))
+        self.assertEqual(values[(2003, 'imports')], 2003.0)
+
+    def test_parquet(self):
+        self.check_store('ds140.parquet', pyarrow.parquet.read_table)
+
+    def test_feather(self):
+        self.check_store('ds140.feather', lambda path: pyarrow.ipc.open_file(pyarrow.OSFile(path)).read_all())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,21 @@
+import glob, os
+import unittest
+
+from tests.workbooks import WorkbookTestCase, write_workbook, run_converter
+
+
+class WorkerLogTest(WorkbookTestCase):
+
+    def test_merged_into_log(self):
+        write_workbook(os.path.join(self.directory, 'nickel.xls'), header_row=6)
+        for run in range(0,2):
+            run_converter(self.directory, '-j', '2')
+            self.assertEqual(glob.glob(os.path.join(self.directory, '*worker*')), [])
+        with open(os.path.join(self.directory, 'Mazama_2011.log')) as f:
+            log = f.read()
+        self.assertIn("Row 4 of nickel.xls doesn't look like a header row", log)
+        self.assertIn('*** Log of worker ', log)
+
+
+if __name__ == '__main__':
+    unittest.main()
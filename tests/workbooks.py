@@ -0,0 +1,65 @@
+"""
+Small DS140-shaped workbooks for the tests.
+"""
+
+import os, shutil, subprocess, sys, tempfile
+import unittest
+import xlwt
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT = os.path.join(ROOT, 'Mazama_USGS_DS140_2011.py')
+
+SUPPLY_TITLES = ['Year', 'Production', 'Imports', 'Exports', 'Apparent consumption']
+
+# Footnote markers to the right of the header, which give blank and repeated
+# column names
+TRAILING_HEADER_CELLS = {(3, 6): 'e', (3, 8): 'e', (3, 10): 'See note'}
+
+
+# Writes a supply workbook with 'nrows' years starting at 'first_year'.
+# 'extra' is a dictionary of (row, col): value for further cells or in place
+# of data cells.
+def write_workbook(path, nrows=10, first_year=2000, header_row=3, titles=SUPPLY_TITLES, extra=None):
+    workbook = xlwt.Workbook()
+    sheet = workbook.add_sheet('Sheet1')
+    sheet.write(0, 0, 'Test statistics')
+    sheet.write(1, 0, '[Metric tons]')
+    for col, title in enumerate(titles):
+        sheet.write(header_row, col, title)
+    extra = extra or {}
+    for row in range(0,nrows):
+        sheet.write(header_row + 1 + row, 0, float(first_year + row))
+        for col in range(1,len(titles)):
+            if (header_row + 1 + row, col) not in extra:
+                sheet.write(header_row + 1 + row, col, float(1000 * col + row))
+    for (row, col), value in sorted(extra.items()):
+        sheet.write(row, col, value)
+    workbook.save(path)
+
+
+# Runs the converter in 'directory' and returns (status, output)
+def run_converter(directory, *args):
+    process = subprocess.Popen([sys.executable, SCRIPT] + list(args), cwd=directory,
+                               stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = process.communicate()[0]
+    return process.returncode, output
+
+
+########################################
+# WorkbookTestCase
+#
+# Runs every test in a fresh temporary directory, which is also the working
+# directory while the test runs.  'logfile' is a log that goes nowhere.
+
+class WorkbookTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+        os.chdir(self.directory)
+        self.logfile = open(os.devnull, 'w')
+
+    def tearDown(self):
+        self.logfile.close()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.directory)